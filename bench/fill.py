@@ -0,0 +1,133 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Layer fill benchmark
+#
+# Rasterizes a layer of N x N cells, each a square contour with a hole
+# holding an island, with the single even-odd fill of SVGRender, and
+# with the former fill of one cr.fill() per contour and per hole. The
+# former fill loses the islands, which shows as the dots that differ.
+#
+# Usage: python bench/fill.py [N] [runs]
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cairo
+import numpy
+
+from xml.dom import minidom
+
+import fab
+from fab import mm2in
+
+def square(x, y, size):
+    return "%g,%g %g,%g %g,%g %g,%g" % (x, y, x + size, y, x + size, y + size, x, y + size)
+
+def layer(cells):
+    pitch = 190.0 / cells
+    polygons = []
+    for row in range(0, cells):
+        for column in range(0, cells):
+            x = 5 + column * pitch
+            y = 5 + row * pitch
+            polygons.append(('contour', square(x, y, pitch * 0.8)))
+            polygons.append(('hole', square(x + pitch * 0.2, y + pitch * 0.2, pitch * 0.4)))
+            polygons.append(('contour', square(x + pitch * 0.3, y + pitch * 0.3, pitch * 0.2)))
+
+    xml = ['<svg xmlns:slic3r="http://slic3r.org/namespaces/slic3r"><g slic3r:z="1e-6">']
+    for kind, points in polygons:
+        xml.append('<polygon slic3r:type="%s" points="%s"/>' % (kind, points))
+    xml.append('</g></svg>')
+    return minidom.parseString("".join(xml))
+
+# The former fill: one fill per contour, then one clear per hole
+def separate(svg):
+    x, y, w, h = svg.bbox(0)
+    contours, holes = svg.outlines(0)
+
+    surface = cairo.ImageSurface(cairo.FORMAT_A8, w, h)
+    cr = cairo.Context(surface)
+    cr.set_antialias(cairo.ANTIALIAS_NONE)
+    cr.translate(-x, -y)
+    dpi = svg.resolution()
+    cr.scale(mm2in(1.0) * dpi[0], mm2in(1.0) * dpi[1])
+
+    for contour in contours:
+        svg._draw_path(cr, contour)
+        cr.fill()
+
+    cr.set_operator(cairo.OPERATOR_CLEAR)
+    for hole in holes:
+        svg._draw_path(cr, hole)
+        cr.fill()
+
+    surface.flush()
+    return fab.Raster(x = x, y = y, w = w, h = h, surface = surface)
+
+def single(svg):
+    x, y, w, h = svg.bbox(0)
+    return svg._render(0, x, y, w, h)
+
+def measure(svg, fill, runs):
+    times = []
+    for i in range(0, runs):
+        start = time.time()
+        raster = fill(svg)
+        times.append(time.time() - start)
+    return sorted(times)[len(times)//2], raster
+
+def main():
+    cells = 40
+    runs = 5
+    if len(sys.argv) > 1:
+        cells = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        runs = int(sys.argv[2])
+
+    svg = fab.SVGRender(xml = layer(cells))
+    svg.resolution(dpi = (300, 300))
+    svg.outlines(0)
+
+    rings = cells * cells * 3
+    t_separate, r_separate = measure(svg, separate, runs)
+    t_single, r_single = measure(svg, single, runs)
+    differ = numpy.count_nonzero((r_separate.image() > 0) != (r_single.image() > 0))
+
+    print("%d rings, %dx%d dots" % (rings, r_single.w, r_single.h))
+    print("separate fills %8.1fms" % (t_separate * 1000))
+    print("single fill    %8.1fms (%.1fx)" % (t_single * 1000, t_separate / t_single))
+    print("%d dots differ (islands inside holes)" % (differ))
+    pass
+
+if __name__ == "__main__":
+    main()
+
+#  vim: set shiftwidth=4 expandtab: #
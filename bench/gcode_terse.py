@@ -0,0 +1,126 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Terse G-code benchmark
+#
+# Converts an SVG with the BrundleFab backend, with and without --terse,
+# compares the output sizes, and replays both outputs through a small
+# G-code interpreter to check that they produce identical motion.
+#
+# Usage: python bench/gcode_terse.py [stl2fab options] FILE.svg
+
+from __future__ import print_function
+
+import os
+import sys
+import subprocess
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def convert(args):
+    return subprocess.check_output([sys.executable, os.path.join(TOP, "stl2fab.py"),
+                                    "--svg", "-f", "brundle"] + args,
+                                   cwd = TOP, stderr = open(os.devnull, "w"))
+
+# Return the list of the commands of a G-code output, with the motion
+# commands as the absolute position and feed rate they move to
+def motion(gcode):
+    position = {}
+    feed = None
+    mode = None
+    relative = False
+
+    commands = []
+    for line in gcode.decode().splitlines():
+        words = line.split()
+        if len(words) == 0:
+            continue
+        if words[0].startswith("M117"):
+            commands.append(line)
+            continue
+
+        if words[0][0] in "GMT":
+            command = words.pop(0)
+        else:
+            command = mode
+
+        if command in ("G0", "G1"):
+            mode = command
+            axes = [word for word in words if word[0] != "F"]
+            for word in words:
+                axis, value = word[0], float(word[1:])
+                if axis == "F":
+                    # A feed rate alone, and unchanged, is no command
+                    if len(axes) == 0 and value == feed:
+                        break
+                    feed = value
+                elif relative:
+                    position[axis] = round(position.get(axis, 0.0) + value, 6)
+                else:
+                    position[axis] = value
+            else:
+                commands.append((command, tuple(sorted(position.items())), feed))
+        else:
+            if command == "G90":
+                relative = False
+            elif command == "G91":
+                relative = True
+            if command[0] == "G":
+                mode = None
+            commands.append((command, tuple([(word[0], float(word[1:])) for word in words])))
+        pass
+
+    return commands
+
+def main():
+    args = sys.argv[1:]
+    if len(args) == 0:
+        print("Usage: python bench/gcode_terse.py [stl2fab options] FILE.svg", file=sys.stderr)
+        sys.exit(1)
+
+    plain = convert(args)
+    terse = convert(["--terse"] + args)
+
+    print("plain %10d bytes, %8d lines" % (len(plain), plain.count(b"\n")))
+    print("terse %10d bytes, %8d lines (%.1f%% smaller)" %
+          (len(terse), terse.count(b"\n"), 100.0 * (len(plain) - len(terse)) / len(plain)))
+
+    expected = motion(plain)
+    actual = motion(terse)
+    for index, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            print("Motion differs at command %d: %s != %s" % (index, a, b))
+            sys.exit(1)
+    if len(expected) != len(actual):
+        print("Motion differs: %d != %d commands" % (len(expected), len(actual)))
+        sys.exit(1)
+
+    print("identical motion, %d commands" % (len(expected)))
+    pass
+
+if __name__ == "__main__":
+    main()
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Startup time benchmark
+#
+# Measures the wall time of fresh interpreters doing just the startup
+# work of stl2fab: '--help', importing 'fab', resolving one backend,
+# and (for reference) importing every backend and the rasterizer, which
+# is what 'import fab' used to cost.
+#
+# Usage: python bench/startup.py [runs]
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import subprocess
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("stl2fab --help",       [os.path.join(TOP, "stl2fab.py"), "--help"]),
+    ("import fab",           ["-c", "import fab"]),
+    ("one backend",          ["-c", "import fab; fab.fabricator['brundle']"]),
+    ("all backends + svg",   ["-c", "import fab; [fab.fabricator[f] for f in fab.fabricator]; import fab.svg"]),
+    ]
+
+def run(args):
+    start = time.time()
+    subprocess.call([sys.executable] + args, cwd = TOP,
+                    stdout = open(os.devnull, "w"), stderr = subprocess.STDOUT)
+    return time.time() - start
+
+def main():
+    runs = 10
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+
+    baseline = run(["-c", "pass"])
+    print("%-24s %8s %8s" % ("case", "median", "-python"))
+    for name, args in CASES:
+        times = sorted([run(args) for i in range(0, runs)])
+        median = times[len(times)//2]
+        print("%-24s %7.1fms %7.1fms" % (name, median * 1000, (median - baseline) * 1000))
+    pass
+
+if __name__ == "__main__":
+    main()
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -25,9 +25,20 @@
 
 __all__ = ['posjet', 'brundle']
 
-import re
-import cairo
-import numpy
+import threading
+import importlib
+import collections
+
+try:
+    import queue
+    from collections.abc import Mapping
+except ImportError:
+    # Python2
+    import Queue as queue
+    from collections import Mapping
+
+# Minimum number of bed rows rasterized at once by Fab.bands()
+STRIP_LINES = 256
 
 # Convenience functions
 def in2mm(inch):
@@ -43,34 +54,247 @@ def mm2in(mm):
 class Fab(object):
     """ Base printer class """
 
-    def __init__(self, output = None, log = None ):
+    def __init__(self, output = None, log = None, cache = None):
         self.log = log
         self.output = output
+        self.cache = cache
         self.svg = None
+        self.deduplicated = 0
+        # fab.volume.Volume of the job, if the layers are rasterized
+        # into one
+        self.volume = None
+        # fab.arena.Arena of the buffers reused from layer to layer
+        self.arena = None
+        # fab.preview.Preview fed with the strips of the layers, if any
+        self.preview = None
+        self._ink_cache = {}
+        self._record = None
         pass
 
     # MUST OVERRIDE: Return the (x, y, z) mm dimenstions of the bed
     def size_mm(self):
         return (200.0, 200.0, 200.0)
 
+    # MAY OVERRIDE: Return the (x, y) mm hardware margin of the bed,
+    # that the layers are shifted by on top of the configured shift
+    def margin_mm(self):
+        return (0.0, 0.0)
+
+    # MAY OVERRIDE: Return the (x, y) resolution of the layers in dpi,
+    # or None to keep the resolution of the fab.svg.SVGRender
+    def dpi(self):
+        return None
+
+    # Return the (x, y) mm shift of the layers on the bed for 'config'
+    def shift_mm(self, config = None):
+        margin_mm = self.margin_mm()
+        return (config.get('x_shift_mm', 0.0) + margin_mm[0],
+                config.get('y_shift_mm', 0.0) + margin_mm[1])
+
+    # MAY OVERRIDE: Estimate the size of the ink commands of a layer,
+    # in bytes, from its polygons alone
+    def ink_bytes(self, layer = 0):
+        return 0
+
+    # MAY OVERRIDE: Size of the other commands of a layer, in bytes,
+    # without rendering it
+    def layer_bytes(self, layer = 0):
+        return 0
+
     # Write something to the output
+    #
+    # 'code' may be a memoryview of an arena buffer, only valid for the
+    # duration of the call. Any other code is a new object, and counted
+    # as such by the arena.
     def send(self, comment = None, code = None ):
-        if comment is not None and self.log is not None:
-            self.log.write("#%s\n" % (comment))
+        if code is not None and self.arena is not None and not isinstance(code, memoryview):
+            self.arena.encoded += len(code)
+        self._emit(comment, code)
+        pass
+
+    def _emit(self, comment = None, code = None):
+        if self._record is not None:
+            if isinstance(code, memoryview):
+                code = code.tobytes()
+                if self.arena is not None:
+                    self.arena.encoded += len(code)
+            self._record.append((comment, code))
+        if self.log is not None:
+            self.log.record(comment, code)
         if code is not None and self.output is not None:
             self.output.write(code)
         pass
 
+    # Emit the ink commands of a layer, as generated by 'encoder(layer)'
+    #
+    # Layers with identical polygons produce identical ink commands,
+    # so the commands of a layer that repeats later in the job are
+    # recorded, and replayed for the repeats instead of re-encoding.
+    # If the printer has a shared fab.Cache, the commands are also
+    # shared with the other jobs using the same cache.
+    def ink(self, layer, encoder):
+        svg = self.svg
+        key = (svg.fingerprint(layer), svg.size(), svg.resolution(), svg.offset_mm(),
+               svg.tolerance())
+
+        cached = self._ink_cache.get(key)
+        if cached is not None:
+            cached[1] -= 1
+            if cached[1] == 0:
+                del self._ink_cache[key]
+            self._replay(cached[0])
+            return
+
+        shared = None
+        if self.cache is not None:
+            shared = (self.__class__.__module__, key, repr(sorted(self.config.items())))
+            record = self.cache.get(shared)
+            if record is not None:
+                self._replay(record)
+                if svg.repeats(layer) > 0:
+                    self._ink_cache[key] = [record, svg.repeats(layer)]
+                return
+
+        repeats = svg.repeats(layer)
+        if repeats == 0 and shared is None:
+            encoder(layer)
+            return
+
+        self._record = []
+        try:
+            encoder(layer)
+            record = self._record
+        finally:
+            self._record = None
+
+        if repeats > 0:
+            self._ink_cache[key] = [record, repeats]
+        if shared is not None:
+            size = sum([len(code) for comment, code in record if code is not None])
+            self.cache.put(shared, record, size)
+        pass
+
+    # Yield the (y, band) bands of a layer, from the bed row 'first'
+    # to the bottom of the bed, where each band is a (lines, width)
+    # boolean ink map of 'lines' bed rows (fewer for the last band).
+    #
+    # Bands outside the bounding box of the layer are None. The other
+    # bands are rasterized on demand, a strip of several bands at a time,
+    # by a background thread that keeps one strip ahead of the encoder,
+    # so the whole layer is never held in memory. With a job volume,
+    # the bands are read from the volume instead.
+    #
+    # The bands are in a buffer of the arena, only valid until the
+    # next band.
+    def bands(self, layer, lines = 1, width = None, first = 0):
+        svg = self.svg
+        w_dots, h_dots = svg.size()
+        if width is None:
+            width = w_dots
+        buffer = self.arena.array('band', (lines, width), dtype=bool)
+
+        x, y, w, h = svg.bbox(layer)
+        if w == 0 or h == 0:
+            for top in range(first, h_dots, lines):
+                yield (top, None)
+            return
+
+        if self.volume is not None:
+            for top in range(first, h_dots, lines):
+                height = min(lines, h_dots - top)
+                if top + height <= y or top >= y + h:
+                    yield (top, None)
+                else:
+                    band = self.volume.rows(layer, top, height, width,
+                                            out = buffer[0:height])
+                    if self.preview is not None:
+                        # A failed preview must not stop the print
+                        try:
+                            self.preview.strip(layer, 0, top, band, full = 1)
+                        except Exception as err:
+                            self.preview._error(layer, err)
+                    yield (top, band)
+            return
+
+        # Simplify the outlines before the rasterizer needs them
+        svg.outlines(layer)
+
+        # Strips hold a whole number of bands
+        strip_lines = max(STRIP_LINES // lines, 1) * lines
+        strips = queue.Queue(maxsize = 1)
+        stop = threading.Event()
+
+        def rasterize():
+            try:
+                for top in range(first, y + h, strip_lines):
+                    if top + strip_lines <= y:
+                        continue
+                    strip = svg.strip(layer, top, strip_lines)
+                    if self.preview is not None and not strip.empty():
+                        try:
+                            self.preview.strip(layer, strip.x, strip.y, strip.image())
+                        except Exception as err:
+                            self.preview._error(layer, err)
+                    if stop.is_set():
+                        strip.release()
+                        return
+                    strips.put((top, strip))
+            except Exception as err:
+                strips.put((None, err))
+            pass
+
+        worker = threading.Thread(target = rasterize)
+        worker.daemon = True
+        worker.start()
+
+        strip = None
+        try:
+            strip_top = None
+            for top in range(first, h_dots, lines):
+                height = min(lines, h_dots - top)
+                if top + height <= y or top >= y + h:
+                    yield (top, None)
+                    continue
+
+                while strip_top is None or top >= strip_top + strip_lines:
+                    if strip is not None:
+                        strip.release()
+                    strip_top, strip = strips.get()
+                    if strip_top is None:
+                        err, strip = strip, None
+                        raise err
+
+                yield (top, strip.rows(top, height, width, out = buffer[0:height]))
+        finally:
+            if strip is not None:
+                strip.release()
+            stop.set()
+            while worker.is_alive() or not strips.empty():
+                try:
+                    strip_top, strip = strips.get(timeout = 0.01)
+                    if strip_top is not None:
+                        strip.release()
+                except queue.Empty:
+                    pass
+            pass
+        pass
+
+    def _replay(self, record):
+        self.deduplicated += 1
+        for comment, code in record:
+            self._emit(comment, code)
+        pass
+
     def layers(self):
         if self.svg is not None:
             return self.svg.layers()
         return 0
 
     # Prepare for the first layer
-    def prepare(self, svg = None, name = None, config = None):
-        self.config = config
-        self.svg = svg
-
+    # Lay the layers of 'svg' out on the bed, and on its dots, for
+    # 'config'. Also used before the job is prepared, to merge the
+    # layers on the dots they will be rendered on.
+    def layout(self, svg = None, config = None):
         size_mm = list(self.size_mm())
         if 'x_bound_mm' in config:
             size_mm[0] = min(config['x_bound_mm'], size_mm[0])
@@ -78,12 +302,23 @@ class Fab(object):
             size_mm[1] = min(config['y_bound_mm'], size_mm[1])
         svg.size_mm(mm = size_mm)
 
-        shift_mm = [0] * 2
-        if 'x_shift_mm' in config:
-            shift_mm[0] = min(config['x_shift_mm'], size_mm[0])
-        if 'y_shift_mm' in config:
-            shift_mm[1] = min(config['y_shift_mm'], size_mm[1])
-        svg.offset_mm(mm = shift_mm)
+        shift_mm = self.shift_mm(config)
+        svg.offset_mm(mm = [min(shift_mm[i], size_mm[i]) for i in range(0, 2)])
+
+        if self.dpi() is not None:
+            svg.resolution(dpi = self.dpi())
+        pass
+
+    def prepare(self, svg = None, name = None, config = None):
+        self.config = config
+        self.svg = svg
+
+        if self.arena is None:
+            from fab.arena import Arena
+            self.arena = Arena()
+        svg.arena = self.arena
+
+        self.layout(svg = svg, config = config)
 
         layers = self.layers()
         z_mm = svg.z_mm(layers)
@@ -105,184 +340,141 @@ class Fab(object):
         self.send(comment = "Finish", code = None)
         pass
 
-class SVGRender(object):
-    """ SVG Rendering helpers """
-
-    def __init__(self, xml = None):
-        self._svg = xml
-        self._dpi = [300] * 2
-        self._size = [200] * 2
-        self._shift = [0] * 2
-        self._z = []
-
-        for layer in self._svg.getElementsByTagName("g"):
-            self._z.append((self._group_z(layer), layer, None))
-
-        # Sort by Z
-        self._z.sort()
+class Cache(object):
+    """ Least-recently-used cache, shared between jobs """
+
+    def __init__(self, size = 64 * 1024 * 1024):
+        # Maximum total size of the cached values, in bytes
+        self.size = size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
         pass
 
-    # Determine Z value of a layer of the SVG
-    def _group_z(self, svg_layer):
-        z_mm = None
-        if svg_layer.hasAttribute("slic3r:z"):
-            # slic3r
-            z_mm = float(svg_layer.getAttribute("slic3r:z")) * 1000000
-        else:
-            # repsnapper
-            label = svg_layer.getAttribute("id").split(':')
-            if len(label) != 2:
-                return
-            z_mm = float(label[1])
-        return z_mm
-
-    def z_mm(self, layer = 0):
-        if layer >= len(self._z):
-            return self._z[len(self._z)-1][0]
-        else:
-            return self._z[layer][0]
-
-    def height_mm(self, layer = 0):
-        z_mm = self.z_mm(layer)
-        if layer == 0:
-            height_mm = z_mm
-        else:
-            height_mm = z_mm - self._z[layer-1][0]
-        return height_mm
-
-    # Return number of layers
-    def layers(self):
-        return len(self._z)
-
-    def _surface_cache_flush(self):
-        for z in self._z:
-            z = (z[0], z[1], None)
-            pass
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size = 0):
+        if size > self.size:
+            return
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.used -= entry[1]
+            self._entries[key] = (value, size)
+            self.used += size
+            while self.used > self.size:
+                old_key, old_entry = self._entries.popitem(last = False)
+                self.used -= old_entry[1]
         pass
 
-    def _any2mm(self, ref = None, mm = None, inch = None):
-        if inch is not None:
-            mm = [ in2mm(x) for x in inch]
-            pass
-
-        if mm is not None:
-            changed = False
-            for i in range(0, 2):
-                if mm[i] is not None and mm[i] > 0:
-                    ref[i] = mm[i]
-                    changed = True
-                    pass
-                pass
-            return changed
-
-        return False
-
-    # Return the size, in mm
-    def size_mm(self, mm = None, inch = None):
-        if self._any2mm(ref = self._size, mm = mm, inch = inch):
-            self._surface_cache_flush()
-
-        return tuple(self._size)
-
-    # Return the size, in dots
-    def size(self):
-        return tuple([int(mm2in(self._size[i])*self._dpi[i]) for i in range(0,2)])
-
-    def offset_mm(self, mm = None, inch = None):
-        if self._any2mm(ref = self._shift, mm = mm, inch = inch):
-            self._surface_cache_flush()
+# Fabricator backends
+#
+# The backend modules are only imported when first used. Besides the
+# built-in backends, any module registered under the 'fab.fabricator'
+# entry point group is found, so new printers need no changes here.
+class Registry(Mapping):
+    """ Fabricator backend registry, importing backends on first use """
+
+    def __init__(self, group = None, builtin = None):
+        self.group = group
+        self._names = dict(builtin or {})
+        self._modules = {}
+        self._scanned = False
+        self._lock = threading.Lock()
+        pass
 
-        return tuple(self._shift)
+    # Register the backend 'name', implemented by the 'module' name
+    def register(self, name, module):
+        with self._lock:
+            self._names[name] = module
+            self._modules.pop(name, None)
+        pass
 
-    # Set up the resolution in dpi
-    def resolution(self, dpi = None):
-        if self._any2mm(ref = self._dpi, mm = dpi):
-            self._surface_cache_flush()
+    # Find the backends registered as entry points
+    def _scan(self):
+        if self._scanned or self.group is None:
+            return
+        self._scanned = True
+
+        try:
+            from importlib import metadata
+            entry_points = metadata.entry_points()
+            if hasattr(entry_points, 'select'):
+                entry_points = entry_points.select(group = self.group)
+            else:
+                entry_points = entry_points.get(self.group, [])
+        except ImportError:
+            try:
+                import pkg_resources
+                entry_points = pkg_resources.iter_entry_points(self.group)
+            except ImportError:
+                entry_points = []
+
+        for entry_point in entry_points:
+            if not entry_point.name in self._names:
+                self._names[entry_point.name] = entry_point
+        pass
 
-        return tuple(self._dpi)
+    def __getitem__(self, name):
+        module = self._modules.get(name)
+        if module is not None:
+            return module
 
-    def _draw_path(self, cr, poly):
-        x_shift = in2mm(self._shift[0]/self._dpi[0])
-        y_shift = in2mm(self._shift[1]/self._dpi[1])
-        p = poly.getAttribute("points")
-        p = re.sub(r'\s+',r' ', p)
-        p = re.sub(r' *, *',r' ', p)
-        pairs = zip(*[iter(p.split(' '))]*2)
+        with self._lock:
+            if not name in self._names:
+                self._scan()
+            target = self._names[name]
 
-        moved = False
-        for pair in pairs:
-            point=[float(f) for f in pair]
-            if moved:
-                cr.line_to(point[0] + x_shift, point[1] + y_shift)
+            if isinstance(target, str):
+                module = importlib.import_module(target)
             else:
-                cr.move_to(point[0] + x_shift, point[1] + y_shift)
-                moved = True
-        cr.close_path()
-
-    # Return the (float(z_mm), float(height_mm), cairo.ImageSurface(surface))
-    # of a layer
-    def surface(self, layer = 0):
-        z_mm, svg, surface = self._z[layer]
-
-        if surface is not None:
-            return surface
-
-        height_mm = self.height_mm(layer)
-
-        # Create a new cairo surface
-        dot = self.size()
-
-        surface = cairo.ImageSurface(cairo.FORMAT_A8, dot[0], dot[1])
-        cr = cairo.Context(surface)
-        cr.set_antialias(cairo.ANTIALIAS_NONE)
-
-        contours = []
-        holes = []
-        for poly in svg.getElementsByTagName("polygon"):
-            if poly.hasAttribute("slic3r:type"):
-                # slic3r
-                mode = poly.getAttribute("slic3r:type")
-                if mode == 'contour':
-                    contours.append(poly)
-                elif mode == 'hole':
-                    holes.append(poly)
-            elif poly.hasAttribute("fill"):
-                fill = poly.getAttribute("fill")
-                if fill == 'black':
-                    contours.append(poly)
-                elif fill == 'white':
-                    holes.append(poly)
-
-        # Scale from mm to dots
-        cr.scale(mm2in(1.0) * self._dpi[0], mm2in(1.0) * self._dpi[1])
-
-        # Draw filled area
-        for contour in contours:
-            self._draw_path(cr, contour)
-            cr.fill()
-
-        # Draw holes
-        cr.set_operator(cairo.OPERATOR_CLEAR)
-        for hole in holes:
-            self._draw_path(cr, hole)
-            cr.fill()
-
-        # Emit the image
-        surface.flush()
-
-        # Update the layer info
-        self._z[layer] = (z_mm, svg, surface)
-
-        return surface
-
-import fab.brundle
-import fab.posjet
-import fab.tmc600
-
-fabricator = {
-        'brundle': fab.brundle,
-        'posjet' : fab.posjet,
-        'tmc600' : fab.tmc600,
-        }
+                module = target.load()
+            self._modules[name] = module
+
+        return module
+
+    def __contains__(self, name):
+        if not name in self._names:
+            self._scan()
+        return name in self._names
+
+    def __iter__(self):
+        self._scan()
+        return iter(sorted(self._names.keys()))
+
+    def __len__(self):
+        self._scan()
+        return len(self._names)
+
+fabricator = Registry(group = 'fab.fabricator', builtin = {
+        'brundle': 'fab.brundle',
+        'posjet' : 'fab.posjet',
+        'tmc600' : 'fab.tmc600',
+        })
+
+# The SVG rasterizer and the arena need cairo and numpy, so they are
+# only imported by the code paths that use them: these build them on
+# first use.
+def SVGRender(*args, **kwargs):
+    import fab.svg
+    return fab.svg.SVGRender(*args, **kwargs)
+
+def Raster(*args, **kwargs):
+    import fab.svg
+    return fab.svg.Raster(*args, **kwargs)
+
+def Arena(*args, **kwargs):
+    import fab.arena
+    return fab.arena.Arena(*args, **kwargs)
 
 #  vim: set shiftwidth=4 expandtab: # 
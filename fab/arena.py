@@ -0,0 +1,144 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Buffer arena of a job
+#
+# The strips, bands and lines of every layer have the same few sizes,
+# so their buffers are kept by the arena of the job and reused from
+# one layer to the next, instead of being allocated again:
+#
+#   surfaces    cairo surfaces, taken and given back by their user
+#   arrays      numpy buffers by name, each valid until the next
+#               request for the same name
+#
+# The byte counters tell whether a job still allocates buffers after
+# its first layer. The commands the backends encode into new bytes
+# objects, rather than into arrays of the arena, are counted apart, in
+# 'encoded': text G-code, run-length encoded lines, and the commands
+# recorded for the repeated layers.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import threading
+
+import cairo
+import numpy
+
+# 8 booleans, read as one native uint64, times _PACK have their bits in
+# the top byte of the product, the first boolean in the top bit
+if sys.byteorder == "little":
+    _PACK = numpy.uint64(0x8040201008040201)
+else:
+    _PACK = numpy.uint64(0x0102040810204080)
+
+class Arena(object):
+    """ Reusable buffers of a job """
+
+    def __init__(self):
+        # Bytes allocated over the life of the arena
+        self.allocated = 0
+        # Bytes of the buffers in use, and their maximum
+        self.in_use = 0
+        self.peak = 0
+        # Bytes of commands encoded outside of the arena
+        self.encoded = 0
+
+        self._arrays = {}
+        self._surfaces = []
+        self._lock = threading.Lock()
+        pass
+
+    def _use(self, size):
+        self.in_use += size
+        self.peak = max(self.peak, self.in_use)
+        pass
+
+    # Return a cairo A8 surface of at least w by h dots. Its contents
+    # are undefined. Give it back with release() when done.
+    def surface(self, w, h):
+        with self._lock:
+            for surface in self._surfaces:
+                if surface.get_width() >= w and surface.get_height() >= h:
+                    self._surfaces.remove(surface)
+                    self._use(surface.get_stride() * surface.get_height())
+                    return surface
+
+            surface = cairo.ImageSurface(cairo.FORMAT_A8, w, h)
+            size = surface.get_stride() * h
+            self.allocated += size
+            self._use(size)
+        return surface
+
+    def release(self, surface):
+        with self._lock:
+            self._surfaces.append(surface)
+            self.in_use -= surface.get_stride() * surface.get_height()
+        pass
+
+    # Return a numpy array of 'shape' and 'dtype', in the buffer 'name'.
+    # The array is only valid until the next request for 'name', and
+    # its contents are undefined.
+    def array(self, name, shape, dtype = numpy.uint8):
+        dtype = numpy.dtype(dtype)
+        size = int(numpy.prod(shape)) * dtype.itemsize
+
+        with self._lock:
+            buffer = self._arrays.get(name)
+            if buffer is None or len(buffer) < size:
+                if buffer is not None:
+                    self.in_use -= len(buffer)
+                buffer = numpy.empty((size), dtype=numpy.uint8)
+                self._arrays[name] = buffer
+                self.allocated += size
+                self._use(size)
+
+        return buffer[0:size].view(dtype).reshape(shape)
+
+    # Return the bytes of the boolean array 'bits', packed 8 to the byte
+    # along its last axis as numpy.packbits() does, in the buffer 'name'.
+    # The last axis must be contiguous, and a multiple of 8 long.
+    def packbits(self, bits, name):
+        shape = bits.shape[:-1] + (bits.shape[-1] // 8,)
+        work = self.array('packbits', shape, dtype=numpy.uint64)
+        out = self.array(name, shape, dtype=numpy.uint8)
+
+        numpy.multiply(bits.view(numpy.uint64), _PACK, out = work)
+        numpy.right_shift(work, numpy.uint64(56), out = work)
+        numpy.copyto(out, work, casting = 'unsafe')
+        return out
+
+    # Dictionary of the byte counters
+    def report(self):
+        return {'allocated': self.allocated,
+                'in_use': self.in_use,
+                'peak': self.peak,
+                'encoded': self.encoded,
+                'surfaces': len(self._surfaces),
+                'arrays': len(self._arrays)}
+
+#  vim: set shiftwidth=4 expandtab: #
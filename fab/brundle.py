@@ -48,30 +48,111 @@ FEED_POWDER=4500    # Extruder feed rate (mm/minute)
 FEED_FUSER_WARM=200 # Fuser pass rate during warm-up (mm/minute)
 TIME_FUSER_WARM=6   # Time (in seconds) for fuser to complete its warm-up
 FEED_FUSER_HOT=700  # Fuser pass rate during hot (mm/minute)
+FUSER_MARGIN=10.0   # Fused margin around the inked area (mm)
 FEED_PEN=5000       # Pen movement (mm/minute)
+
 X_DPI=96.0
 Y_DPI=96.0
 
 Y_DOTS=12
 
+class Pen(object):
+    """ Ink head motion estimate """
+
+    def __init__(self, x = X_BIN_PART, y = 0.0):
+        self.x = x
+        self.y = y
+        self.mm = 0.0
+        pass
+
+    def move(self, x = None, y = None):
+        if x is not None:
+            self.mm += abs(x - self.x)
+            self.x = x
+        if y is not None:
+            self.mm += abs(y - self.y)
+            self.y = y
+        pass
+
+    # Time spent moving, in seconds
+    def seconds(self):
+        return self.mm * 60.0 / FEED_PEN
+
 class Fab(fab.Fab):
-    def size(self):
+    def size_mm(self):
         return (BED_X, BED_Y, BED_Z)
 
+    def dpi(self):
+        return (X_DPI, Y_DPI)
+
     def gc(self, comment, code = None):
+        if code is not None and self.config.get('gcode_terse', False):
+            code = self.terse(code)
         if code is not None:
             code = code.encode() + b"\n"
         self.send(comment = comment, code = code)
         pass
 
+    # Shorten a G-code line: drop the trailing zeros of the numbers, and
+    # the motion mode and feed rate that are still in effect. Returns
+    # None if nothing is left to send.
+    def terse(self, code):
+        words = code.split()
+        if len(words) == 0 or words[0] == "M117":
+            return code
+
+        command = words[0]
+        args = []
+        for word in words[1:]:
+            value = word[1:]
+            if "." in value:
+                value = value.rstrip("0").rstrip(".")
+                if value in ("", "-", "-0"):
+                    value = "0"
+            args.append(word[0] + value)
+
+        if command in ("G0", "G1"):
+            for word in args:
+                if word[0] == "F":
+                    if word == self._feed:
+                        args.remove(word)
+                    self._feed = word
+                    break
+            if len(args) == 0:
+                return None
+            if command == self._motion:
+                return " ".join(args)
+            self._motion = command
+        elif command[0] == "G":
+            # Other G commands may change the motion mode
+            self._motion = None
+
+        return " ".join([command] + args)
+
+    # Size of G-code lines, in bytes, as gc() sends them
+    def gc_bytes(self, lines):
+        size = 0
+        for code in lines:
+            if code is not None and self.config.get('gcode_terse', False):
+                code = self.terse(code)
+            if code is not None:
+                size += len(code) + 1
+        return size
+
+    # Forget the modal state of terse G-code, so that the following
+    # lines do not depend on the lines before them
+    def terse_reset(self):
+        self._motion = None
+        self._feed = None
+        pass
+
     def prepare(self, svg = None, name = "Unknown", config = {}):
         super(Fab, self).prepare(svg = svg, name = name, config = config)
+        self.terse_reset()
 
         layers = svg.layers()
         max_z_mm = svg.z_mm(layers)
 
-        svg.resolution(dpi = (X_DPI, Y_DPI))
-
         self.w_dots, self.h_dots = svg.size()
 
         self.gc("Print %s to the BrundleFab, %dmm, %d layers" % (name, max_z_mm, layers))
@@ -104,6 +185,7 @@ class Fab(fab.Fab):
 
         self.gc("Select repowder tool", "T21")
         self.gc("Move to feed start", "G1 X%.3f" % (X_BIN_FEED))
+        self.terse_reset()
 
     def finish(self):
         self.last_z = None
@@ -149,90 +231,395 @@ class Fab(fab.Fab):
         self.gc(None, "G0 Y0")
         pass
 
-    def render(self, layer = 0):
-        config = self.config
+    # Ink one band, as planned by the serpentine planner
+    #
+    # Each band is inked in whichever direction starts closest to the
+    # ink head, and only the inked span of the band is traversed. The
+    # half-dot interweave return pass is only made when neighbouring
+    # lines of the band are both inked, as there is nothing to weave in
+    # between otherwise. Without it, the head stays at the end of the
+    # band, ready for the next band in the other direction. As the
+    # return pass brings the head back, the planner gains the most
+    # with -W, and is off unless --serpentine is given.
+    #
+    # The motion of both the planned and the fixed round-trip inking
+    # are tracked by self.pen and self.fixed_pen.
+    def brundle_pass(self, x_dots, w_dots, toolmask, weave=True):
+        mask = numpy.asarray(toolmask, dtype=numpy.int64)[0:w_dots]
+        inked = numpy.flatnonzero(mask)
+        if len(inked) == 0:
+            return
 
-        z_delta_mm = self.svg.height_mm(layer)
-        # Extrude a bit more than the layer width
-        e_delta_mm = z_delta_mm * 1.1;
+        first = inked[0]
+        last = inked[-1]
 
-        self.gc(None, "M117 Slice %d of %d" % (layer+1, self.layers()))
-        self.gc("1. Assume layer head is at feed start")
-        self.gc(  "Select recoat tool", "T21")
+        # Runs of identical tool masks, from 'first' to 'last'
+        span = mask[first:last+1]
+        change = numpy.flatnonzero(span[1:] != span[:-1]) + first + 1
+        starts = numpy.concatenate(([first], change))
+        ends = numpy.concatenate((change, [last + 1]))
 
-        if config['do_extrude']:
-            self.gc("2. Raise Feed Bin by one layer width")
-            self.gc(  "Relative positioning", "G91")
-            self.gc(  "Extrude a feed layer", "G1 E%.3f F%d" % (e_delta_mm, FEED_POWDER))
-            self.gc(  "Absolute positioning", "G90")
-
-            self.gc("3. Advance recoat blade past Waste Bin")
-            self.gc(  "Advance to waste bin", "G1 X%.3f F%d" % (X_BIN_WASTE+15, FEED_SPREAD))
-            self.gc("4. Drop Part Bin by %.3fmm, and Feed Bin by %.3fmm" % (FEED_RETRACT, FEED_RETRACT))
-            self.gc(  "Relative positioning", "G91")
-            self.gc(  "Drop bins to get out of the way", "G1 E%.3f Z%.3f F%d" % (-FEED_RETRACT, FEED_RETRACT, FEED_POWDER))
-            self.gc(  "Absolute positioning", "G90")
+        x_mm = X_BIN_PART + in2mm(x_dots / X_DPI)
+        first_mm = in2mm(first / Y_DPI)
+        last_mm = in2mm(last / Y_DPI)
+        weave = weave and numpy.any(mask & (mask >> 1))
 
-        if config['do_layer']:
-            self.gc("5. Move pen to start of the part bin")
-            self.gc(  "Select ink tool", "T1 P0")
-            self.gc(  "Move pen to end of the part bin", "G0 X%.3f" % (X_BIN_PART))
-            self.gc("6. Ink the layer")
-            # See brundle_layer()
+        pen = self.pen
+        forward = abs(pen.y - first_mm) <= abs(pen.y - last_mm)
+
+        self.gc(None, "T0")
+        self.gc(None, "T1 P0")
+        self.gc(None, "G1 X%.3f F%.3f" % (x_mm, FEED_PEN))
+        pen.move(x = x_mm)
+
+        if forward:
+            start_mm = first_mm
+            self.gc(None, "G1 Y%.3f" % (first_mm))
+            for start, end in zip(starts, ends):
+                self.gc(None, "T1 P%d" % (mask[start]))
+                self.gc(None, "G1 Y%.3f" % (in2mm((end - 1) / Y_DPI)))
+        else:
+            # The runs end on their first dot, as the forward runs end
+            # on their last one, so that both directions ink the same
+            # dots
+            start_mm = last_mm
+            self.gc(None, "G1 Y%.3f" % (last_mm))
+            for start in starts[::-1]:
+                self.gc(None, "T1 P%d" % (mask[start]))
+                self.gc(None, "G1 Y%.3f" % (in2mm(start / Y_DPI)))
+        pen.move(y = start_mm)
+        pen.move(y = first_mm + last_mm - start_mm)
+
+        # Flush the inkbar
+        self.gc(None, "T0")
+
+        if weave:
+            # Retract X by a half-dot, and cover the dots inbetween
+            # on the reverse movement of the inkbar
+            x_weave_mm = X_BIN_PART + in2mm((x_dots - 0.5) / X_DPI)
+            self.gc(None, "G1 X%.3f F%.3f" % (x_weave_mm, FEED_PEN))
+            self.gc(None, "T1 P0")
+            self.gc(None, "G0 Y%.3f" % (start_mm))
+            pen.move(x = x_weave_mm)
+            pen.move(y = start_mm)
+
+        # The fixed round trip of brundle_line()
+        fixed = self.fixed_pen
+        fixed.move(x = x_mm)
+        fixed.move(y = first_mm)
+        fixed.move(y = last_mm)
+        if self.config['do_weave']:
+            fixed.move(x = X_BIN_PART + in2mm((x_dots - 0.5) / X_DPI))
+        fixed.move(y = 0.0)
+        pass
 
-        # Ink the layer
+    def brundle_layer(self, layer = 0):
         w_dots = self.w_dots
         h_dots = self.h_dots
         weave = self.config['do_weave']
+        serpentine = self.config.get('do_serpentine', False)
 
-        surface = self.svg.surface(layer)
-        stride = surface.get_stride()
-        image = numpy.frombuffer(surface.get_data(), dtype=numpy.uint8)
-        image = numpy.reshape(image, (h_dots, stride))
-        image = numpy.greater(image, 0)
+        x, y, w, h = self.svg.bbox(layer)
+        if w == 0 or h == 0:
+            return
 
-        for y in range(0, h_dots):
-            l = y % Y_DOTS
+        self.pen = Pen()
+        self.fixed_pen = Pen()
+
+        # Only the bands that overlap the layer have any ink
+        toolmask = self.arena.array('toolmask', (w_dots,), dtype=numpy.int64)
+        for y, band in self.bands(layer, Y_DOTS, w_dots):
+            if band is None:
+                continue
+            lines = len(band)
+            # Nozzle i inks the line i of the band
+            toolmask[:] = 0
+            for i in range(0, lines):
+                numpy.bitwise_or(toolmask, 1 << i, out = toolmask, where = band[i])
+            if serpentine:
+                self.brundle_pass(y + lines - 1, w_dots, toolmask, weave)
+            else:
+                self.brundle_line(y + lines - 1, w_dots, toolmask, weave)
+            pass
 
-            if l == 0:
-                toolmask = numpy.zeros((stride))
-                pass
+        if serpentine:
+            self.gc("Inking takes %.1fs, the planner saved %.1fs" %
+                    (self.pen.seconds(), self.fixed_pen.seconds() - self.pen.seconds()))
+        pass
 
-            toolmask = toolmask + image[y]*(1 << l)
+    # Return the (x_dots, first, last) of each band crossed by the
+    # outlines of a layer: the X of its last line, and the first and
+    # last dots of the span of the outlines crossing it
+    def band_spans(self, layer = 0):
+        x, y, w, h = self.svg.bbox(layer)
+        if w == 0 or h == 0:
+            return []
+
+        contours, holes = self.svg.polygons(layer)
+
+        # Dot extent of each contour, holes are inside of them
+        dpi = self.svg.resolution()
+        scale = [mm2in(1.0) * dpi[0], mm2in(1.0) * dpi[1]]
+        left = min([ring[:, 0].min() for ring in contours])
+        top = min([ring[:, 1].min() for ring in contours])
+        first = numpy.array([numpy.floor((ring[:, 0].min() - left) * scale[0]) for ring in contours]) + x
+        last = numpy.array([numpy.ceil((ring[:, 0].max() - left) * scale[0]) for ring in contours]) + x
+        lo = numpy.array([numpy.floor((ring[:, 1].min() - top) * scale[1]) for ring in contours]) + y
+        hi = numpy.array([numpy.ceil((ring[:, 1].max() - top) * scale[1]) for ring in contours]) + y
+
+        spans = []
+        for start in range(y - (y % Y_DOTS), y + h, Y_DOTS):
+            crossing = (lo < start + Y_DOTS) & (hi >= start)
+            if numpy.any(crossing):
+                spans.append((start + Y_DOTS - 1,
+                              int(max(first[crossing].min(), x)),
+                              int(min(last[crossing].max(), x + w - 1))))
+        return spans
+
+    # Estimate the inking time of a layer, in seconds, from the band
+    # spans of its outlines, with or without the inking planner
+    def ink_seconds(self, layer = 0):
+        serpentine = self.config.get('do_serpentine', False)
+        weave = self.config['do_weave']
 
-            if l == (Y_DOTS-1):
-                self.brundle_line(y, w_dots, toolmask, weave)
-                pass
+        pen = Pen()
+        for x_dots, first, last in self.band_spans(layer):
+            first_mm = in2mm(first / Y_DPI)
+            last_mm = in2mm(last / Y_DPI)
+            pen.move(x = X_BIN_PART + in2mm(x_dots / X_DPI))
+            if not serpentine:
+                pen.move(y = first_mm)
+                pen.move(y = last_mm)
+                pen.move(y = 0.0)
+            elif abs(pen.y - first_mm) <= abs(pen.y - last_mm):
+                pen.move(y = first_mm)
+                pen.move(y = last_mm)
+                if weave:
+                    pen.move(y = first_mm)
+            else:
+                pen.move(y = last_mm)
+                pen.move(y = first_mm)
+                if weave:
+                    pen.move(y = last_mm)
+        return pen.seconds()
+
+    # Estimate the size of the ink commands of a layer: one pass for
+    # each band crossed by the outlines of the layer, with a tool mask
+    # run between each two outline crossings of the band. An edge of
+    # the outlines crosses each line of a band at one dot, so it makes
+    # as many crossings as it has distinct dots among those lines, and
+    # at least one in each band.
+    def ink_bytes(self, layer = 0):
+        x, y, w, h = self.svg.bbox(layer)
+        if w == 0 or h == 0:
+            return 0
+
+        contours, holes = self.svg.polygons(layer)
+        rings = contours + holes
+
+        # Band rows covered by each ring
+        scale = mm2in(1.0) * self.svg.resolution()[1]
+        top = min([ring[:, 1].min() for ring in rings])
+        lo = numpy.array([numpy.floor((ring[:, 1].min() - top) * scale) for ring in rings]) + y
+        hi = numpy.array([numpy.ceil((ring[:, 1].max() - top) * scale) for ring in rings]) + y
+
+        starts = numpy.arange(y - (y % Y_DOTS), y + h, Y_DOTS)
+        bands = numpy.count_nonzero(((lo[None, :] < starts[:, None] + Y_DOTS) &
+                                     (hi[None, :] >= starts[:, None])).any(axis = 1))
+
+        crossings = 0.0
+        for ring in rings:
+            y0 = (ring[:, 1] - top) * scale + y
+            y1 = numpy.roll(y0, -1)
+            dx = numpy.abs(numpy.roll(ring[:, 0], -1) - ring[:, 0]) * scale
+            dy = numpy.abs(y1 - y0)
+            crossed = numpy.abs(numpy.floor(y1 / Y_DOTS) - numpy.floor(y0 / Y_DOTS)) + 1
+            crossings += numpy.where(dy >= 1, numpy.minimum(dy, dx + crossed), 0).sum()
+
+        # The size of the commands of a band, and of a run, at the
+        # middle of the layer, once terse G-code dropped what the bands
+        # before them left in effect
+        x_mm = X_BIN_PART + in2mm((y + h / 2) / X_DPI)
+        y_mm = in2mm((x + w / 2) / Y_DPI)
+        band = ["T0", "T1 P0", "G1 X%.3f F%.3f" % (x_mm, FEED_PEN), "G1 Y%.3f" % (y_mm), "T0"]
+        if self.config['do_weave']:
+            home = "G0 Y0"
+            if self.config.get('do_serpentine', False):
+                home = "G0 Y%.3f" % (y_mm)
+            band += ["G1 X%.3f F%.3f" % (x_mm, FEED_PEN), "T1 P0", home]
+        run = ["T1 P%d" % ((1 << Y_DOTS) - 1), "G1 Y%.3f" % (y_mm)]
+        self.terse_reset()
+        self.gc_bytes(band)
+        band = self.gc_bytes(band)
+        self.gc_bytes(run)
+        run = self.gc_bytes(run)
+        self.terse_reset()
+
+        return int(bands * band + max(crossings - bands, 0) * run)
+
+    # Is the fuser heated during inking?
+    def preheat(self):
+        config = self.config
+        return (config.get('fuser_preheat', False) and config['do_fuser'] and
+                config['do_layer'])
+
+    # Return the (min, max) X range of the part bin to fuse, in mm
+    #
+    # The range covers the inked lines of the layer plus the fuser
+    # margin, or is None if the layer has no ink.
+    def fuse_range(self, layer = 0):
+        x, y, w, h = self.svg.bbox(layer)
+        if w == 0 or h == 0:
+            return None
+
+        # The lines of the layer run along X
+        margin_mm = self.config.get('fuser_margin_mm', FUSER_MARGIN)
+        x_lo = X_BIN_PART + in2mm(y / X_DPI) - margin_mm
+        x_hi = X_BIN_PART + in2mm((y + h) / X_DPI) + margin_mm
+        return (max(x_lo, X_BIN_PART), min(x_hi, X_BIN_WASTE))
+
+    # Return the (comment, code) commands fusing a layer, with the
+    # fuser already 'preheated' during inking or not
+    def fuse(self, layer = 0, preheated = False):
+        config = self.config
 
-            pass
+        x_range = self.fuse_range(layer)
+        if x_range is None:
+            return [("7. No ink on this layer, nothing to fuse", None)]
+        x_lo, x_hi = x_range
+
+        code = []
+        if preheated:
+            code.append(("7. Select fuser, already hot, and advance to the end of the inked area", None))
+            code.append(("Select fuser and temp", "T20 P%.3f Q%.3f" % (config['fuser_temp']+5, config['fuser_temp']-5)))
+            code.append(("Advance to inked area end", "G0 X%.3f" % (x_hi)))
+            code.append(("8. The fuser was brought up to temp while inking", None))
+            code.append(("9. Retract fuser to start of the inked area", None))
+        else:
+            code.append(("7. Select fuser, and advance to the end of the inked area", None))
+            code.append(("Select fuser, but unlit", "T20 P0 Q0"))
+            x_warm_delta_mm = FEED_FUSER_WARM * TIME_FUSER_WARM / 60
+            code.append(("Advance to inked area end + warm up", "G0 X%.3f" % (x_hi + x_warm_delta_mm+50)))
+            code.append(("8. The fuser is enabled, and brought up to temp", None))
+            code.append(("Select fuser and temp", "T20 P%.3f Q%.3f" % (config['fuser_temp']+5, config['fuser_temp']-5)))
+
+            code.append(("9. Retract fuser to start of the inked area", None))
+            code.append(("Fuser warm-up", "G1 X%.3f F%d" % (x_hi+50, FEED_FUSER_WARM)))
+        for delta in range(0, int((x_hi - x_lo) // 10)):
+            code.append(("Fuse ..", "G1 X%.3f F%d" % (x_hi - delta*10, FEED_FUSER_HOT)))
+        code.append(("Fuse ..", "G1 X%.3f F%d" % (x_lo, FEED_FUSER_HOT)))
+        code.append(("10. The fuser is disabled", "T20 P0 Q0"))
+
+        saved_mm = (X_BIN_WASTE - X_BIN_PART) - (x_hi - x_lo)
+        code.append(("Fused %.1fmm to %.1fmm, %.1fs saved over the whole Part Bin" %
+                     (x_lo, x_hi, saved_mm * 60.0 / FEED_FUSER_HOT), None))
+        return code
+
+    # Inking time of a layer whose fuser is heated during inking, or
+    # None if it is not
+    def preheat_seconds(self, layer = 0):
+        if self.preheat() and len(self.band_spans(layer)) > 0:
+            return self.ink_seconds(layer)
+        return None
+
+    # Return the (comment, code) commands of a layer before its ink
+    # commands, 'seconds' being its preheat_seconds()
+    def layer_start(self, layer = 0, seconds = None):
+        config = self.config
+
+        z_delta_mm = self.svg.height_mm(layer)
+        # Extrude a bit more than the layer width
+        e_delta_mm = z_delta_mm * 1.1;
+
+        code = []
+        code.append((None, "M117 Slice %d of %d" % (layer+1, self.layers())))
+        code.append(("1. Assume layer head is at feed start", None))
+        code.append((  "Select recoat tool", "T21"))
 
-        if y % Y_DOTS != 0:
-            self.brundle_line(y, w_dots, toolmask, weave)
+        if config['do_extrude']:
+            code.append(("2. Raise Feed Bin by one layer width", None))
+            code.append((  "Relative positioning", "G91"))
+            code.append((  "Extrude a feed layer", "G1 E%.3f F%d" % (e_delta_mm, FEED_POWDER)))
+            code.append((  "Absolute positioning", "G90"))
+
+            code.append(("3. Advance recoat blade past Waste Bin", None))
+            code.append((  "Advance to waste bin", "G1 X%.3f F%d" % (X_BIN_WASTE+15, FEED_SPREAD)))
+            code.append(("4. Drop Part Bin by %.3fmm, and Feed Bin by %.3fmm" % (FEED_RETRACT, FEED_RETRACT), None))
+            code.append((  "Relative positioning", "G91"))
+            code.append((  "Drop bins to get out of the way", "G1 E%.3f Z%.3f F%d" % (-FEED_RETRACT, FEED_RETRACT, FEED_POWDER)))
+            code.append((  "Absolute positioning", "G90"))
+
+        if config['do_layer']:
+            code.append(("5. Move pen to start of the part bin", None))
+            # Set the fuser temperature before inking, so that it heats
+            # during the inking passes. The setpoint stays on once the
+            # ink tool is selected again.
+            if seconds is not None:
+                code.append(("Heat the fuser during the %.1fs of inking" % (seconds),
+                             "T20 P%.3f Q%.3f" % (config['fuser_temp']+5, config['fuser_temp']-5)))
+            code.append((  "Select ink tool", "T1 P0"))
+            code.append((  "Move pen to end of the part bin", "G0 X%.3f" % (X_BIN_PART)))
+            code.append(("6. Ink the layer", None))
+        return code
+
+    # Return the (comment, code) commands of a layer after its ink
+    # commands, 'seconds' being its preheat_seconds()
+    def layer_end(self, layer = 0, seconds = None):
+        config = self.config
+        z_delta_mm = self.svg.height_mm(layer)
+
+        code = []
+        if config['do_layer'] and seconds is not None:
+            if seconds < TIME_FUSER_WARM:
+                code.append(("Wait for the fuser to warm up", "G4 P%d" % ((TIME_FUSER_WARM - seconds) * 1000)))
+            code.append(("Fuser warmed up during inking, %.1fs saved" % (min(seconds, TIME_FUSER_WARM)), None))
 
         # Finish the layer
         if config['do_fuser']:
-            self.gc("7. Select fuser, and advance to Waste Bin start")
-            self.gc(  "Select fuser, but unlit", "T20 P0 Q0")
-            x_warm_delta_mm = FEED_FUSER_WARM * TIME_FUSER_WARM / 60
-            self.gc(  "Advance to Waste Bin start + warm up", "G0 X%.3f" % (X_BIN_WASTE + x_warm_delta_mm+50))
-            self.gc("8. The fuser is enabled, and brought up to temp")
-            self.gc(  "Select fuser and temp", "T20 P%.3f Q%.3f" % (config['fuser_temp']+5, config['fuser_temp']-5))
+            code += self.fuse(layer, preheated = config['do_layer'] and seconds is not None)
 
-            self.gc("9. Retract fuser to start of Part Bin")
-            self.gc(  "Fuser warm-up", "G1 X%.3f F%d" % (X_BIN_WASTE+50, FEED_FUSER_WARM))
-            for delta in range(0, int(X_BIN_WASTE - X_BIN_PART)/10):
-                self.gc(  "Fuse ..", "G1 X%.3f F%d" % (X_BIN_WASTE - delta*10, FEED_FUSER_HOT))
-            self.gc(  "Fuse ..", "G1 X%.3f F%d" % (X_BIN_PART, FEED_FUSER_HOT))
-            self.gc("10. The fuser is disabled", "T20 P0 Q0")
-
-        self.gc("11. Retract recoating blade to start of the Feed Bin")
-        self.gc(  "Select the recoating tool", "T21")
-        self.gc(  "Move to start", "G0 X%.3f Y0" % (X_BIN_FEED))
+        code.append(("11. Retract recoating blade to start of the Feed Bin", None))
+        code.append((  "Select the recoating tool", "T21"))
+        code.append((  "Move to start", "G0 X%.3f Y0" % (X_BIN_FEED)))
 
         if config['do_extrude']:
-            self.gc("12. The Feed Bin and Part bin raises by %.3fmm" % FEED_RETRACT)
-            self.gc(  "Relative positioning", "G91")
-            self.gc(  "Raise the bins", "G1 E%.3f Z%.3f F%d" % (FEED_RETRACT, z_delta_mm - FEED_RETRACT, FEED_POWDER))
-            self.gc(  "Absolute positioning", "G90")
+            code.append(("12. The Feed Bin and Part bin raises by %.3fmm" % FEED_RETRACT, None))
+            code.append((  "Relative positioning", "G91"))
+            code.append((  "Raise the bins", "G1 E%.3f Z%.3f F%d" % (FEED_RETRACT, z_delta_mm - FEED_RETRACT, FEED_POWDER)))
+            code.append((  "Absolute positioning", "G90"))
+        return code
+
+    # Size of the commands of a layer other than its ink commands, in
+    # bytes, with the terse G-code state of render()
+    def layer_bytes(self, layer = 0):
+        seconds = self.preheat_seconds(layer)
+        self.terse_reset()
+        size = self.gc_bytes([code for comment, code in self.layer_start(layer, seconds)])
+        if self.config['do_layer']:
+            self.terse_reset()
+        size += self.gc_bytes([code for comment, code in self.layer_end(layer, seconds)])
+        self.terse_reset()
+        return size
+
+    def render(self, layer = 0):
+        # Each layer is a segment of its own in a compiled job, so it
+        # must not depend on the modal state of the layers before it
+        self.terse_reset()
+
+        seconds = self.preheat_seconds(layer)
+        for comment, code in self.layer_start(layer, seconds):
+            self.gc(comment, code)
+
+        if self.config['do_layer']:
+            # See brundle_layer()
+            # Recorded ink commands are replayed in other layers, so
+            # they must not depend on the modal state around them
+            self.terse_reset()
+            self.ink(layer, self.brundle_layer)
+            self.terse_reset()
+
+        for comment, code in self.layer_end(layer, seconds):
+            self.gc(comment, code)
+        pass
 
 #  vim: set shiftwidth=4 expandtab: # 
@@ -0,0 +1,255 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Compiled job files
+#
+# A compiled job holds the printer commands of a job, split into
+# segments so that a player can stream any range of layers to the
+# device without regenerating the job:
+#
+#   MAGIC                   8 bytes
+#   header length           <I
+#   header                  JSON: backend, name, config, size_mm, layers
+#   segment table           one SEGMENT entry per segment
+#   segment payloads
+#
+# Segment 0 holds the commands of Fab.prepare(), segments 1 .. layers
+# hold the commands of each layer, and the last segment holds the
+# commands of Fab.finish(). Payloads may be zlib compressed.
+#
+# Usage: python -m fab.jobfile [--info] [--first N] [--last N]
+#                              [--no-prologue] [--no-epilogue]
+#                              [--device PATH] JOBFILE
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import sys
+import zlib
+import mmap
+import json
+import struct
+import getopt
+
+MAGIC = b'FABJOB\000\001'
+
+# offset, stored length, length, flags, z_mm
+SEGMENT = struct.Struct("<QQQId")
+
+FLAG_ZLIB = 1
+
+class JobWriter(object):
+    """ Compiled job writer, used as the output of a fab.Fab """
+
+    # 'f' must be a seekable binary file
+    def __init__(self, f, backend = None, name = None, config = None,
+                 size_mm = None, layers = 0, compress = False):
+        self.f = f
+        self.compress = compress
+        self.segments = layers + 2
+
+        header = {'backend': backend,
+                  'name': name,
+                  'config': config,
+                  'size_mm': size_mm,
+                  'layers': layers}
+        header = json.dumps(header, sort_keys = True).encode()
+
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+
+        # Reserve the segment table
+        self._table_offset = f.tell()
+        self._table = []
+        f.write(b'\000' * (SEGMENT.size * self.segments))
+
+        self._data = io.BytesIO()
+        self._z_mm = 0.0
+        pass
+
+    def write(self, data):
+        self._data.write(data)
+        pass
+
+    # End the current segment, and start the next one
+    def segment(self, z_mm = 0.0):
+        data = self._data.getvalue()
+        self._data = io.BytesIO()
+
+        flags = 0
+        stored = data
+        if self.compress and len(data) > 0:
+            packed = zlib.compress(data)
+            if len(packed) < len(data):
+                stored = packed
+                flags |= FLAG_ZLIB
+
+        offset = self.f.tell()
+        self.f.write(stored)
+        self._table.append((offset, len(stored), len(data), flags, self._z_mm))
+        self._z_mm = z_mm
+        pass
+
+    def close(self):
+        self.segment()
+        while len(self._table) < self.segments:
+            self.segment()
+
+        self.f.seek(self._table_offset)
+        for entry in self._table[0:self.segments]:
+            self.f.write(SEGMENT.pack(*entry))
+        self.f.seek(0, io.SEEK_END)
+        pass
+
+class JobReader(object):
+    """ Compiled job reader, memory-mapping the job file """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        if self._map[0:len(MAGIC)] != MAGIC:
+            raise ValueError("%s: not a compiled job file" % (path))
+
+        offset = len(MAGIC)
+        length, = struct.unpack_from("<I", self._map, offset)
+        offset += 4
+        self.header = json.loads(self._map[offset:offset+length].decode())
+        offset += length
+
+        self.table = []
+        for i in range(0, self.header['layers'] + 2):
+            self.table.append(SEGMENT.unpack_from(self._map, offset))
+            offset += SEGMENT.size
+        pass
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+        pass
+
+    def layers(self):
+        return self.header['layers']
+
+    def z_mm(self, layer = 0):
+        return self.table[layer + 1][4]
+
+    # Return the payload of a segment, as bytes
+    def segment(self, index):
+        offset, stored, length, flags, z_mm = self.table[index]
+        data = self._map[offset:offset+stored]
+        if flags & FLAG_ZLIB:
+            data = zlib.decompress(data)
+        return data
+
+    def prologue(self):
+        return self.segment(0)
+
+    def layer(self, layer = 0):
+        return self.segment(layer + 1)
+
+    def epilogue(self):
+        return self.segment(len(self.table) - 1)
+
+    # Write the layers 'first' .. 'last' (inclusive) to 'out'
+    def stream(self, out, first = 0, last = None, prologue = True, epilogue = True):
+        if last is None:
+            last = self.layers() - 1
+
+        if prologue:
+            out.write(self.prologue())
+        for layer in range(first, last + 1):
+            out.write(self.layer(layer))
+        if epilogue:
+            out.write(self.epilogue())
+        pass
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], "", [
+                    "info", "first=", "last=", "device=",
+                    "no-prologue", "no-epilogue"])
+
+    info = False
+    first = 0
+    last = None
+    device = None
+    prologue = True
+    epilogue = True
+    for o, a in opts:
+        if o == "--info":
+            info = True
+        elif o == "--first":
+            first = int(a)
+        elif o == "--last":
+            last = int(a)
+        elif o == "--device":
+            device = a
+        elif o == "--no-prologue":
+            prologue = False
+        elif o == "--no-epilogue":
+            epilogue = False
+
+    if len(args) != 1:
+        print("Usage: python -m fab.jobfile [--info] [--first N] [--last N] [--no-prologue] [--no-epilogue] [--device PATH] JOBFILE", file=sys.stderr)
+        sys.exit(1)
+
+    job = JobReader(args[0])
+
+    if info:
+        print(json.dumps(job.header, indent = 2, sort_keys = True))
+        for index, entry in enumerate(job.table):
+            offset, stored, length, flags, z_mm = entry
+            if index == 0:
+                name = "prologue"
+            elif index == len(job.table) - 1:
+                name = "epilogue"
+            else:
+                name = "layer %d" % (index - 1)
+            print("%-10s offset %10d, %8d bytes (%8d stored), z %.3fmm%s" %
+                  (name, offset, length, stored, z_mm,
+                   " zlib" if flags & FLAG_ZLIB else ""))
+        return
+
+    if device is not None:
+        out = open(device, "wb")
+    else:
+        try:
+            # Python3
+            out = sys.stdout.buffer
+        except AttributeError:
+            out = sys.stdout
+
+    job.stream(out, first = first, last = last, prologue = prologue, epilogue = epilogue)
+    out.flush()
+    job.close()
+    pass
+
+if __name__ == "__main__":
+    main()
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -36,35 +36,15 @@ X_DPI = 96.0
 Y_DPI = 96.0
 
 class Fab(fab.Fab):
-    def size(self):
+    def size_mm(self):
         return (BED_X, BED_Y, BED_Z)
 
-    def send(self, comment, code = None):
-        super(Fab, self).send(code = code)
-        log = self.log
-
-        # Custom override for printing the log file
-        if log is not None:
-            if comment is not None:
-                log.write(b"# " + comment.encode() + b"\n")
-            if code is not None:
-                log.write(b"\\%03o" % (ord(code[0])))
-                if code[0] == b'\033':
-                    log.write(b"%c" % (ord(code[1])))
-                    code = code[1:]
-                for b in code[1:]:
-                    log.write(b"\\x%02x" % (ord(b)))
-                    pass
-                pass
-                log.write(b"\n")
-            pass
-        pass
+    def dpi(self):
+        return (X_DPI, Y_DPI)
 
     def prepare(self, svg = None, name = None, config = None):
         super(Fab, self).prepare(svg = svg, name = name, config = config)
 
-        self.svg.resolution(dpi = (X_DPI, Y_DPI))
-
         self.send("Cancel any pending operations", b'\022');
         self.send("Initialize printer", b'\033@');
         pass
@@ -160,6 +140,70 @@ class Fab(fab.Fab):
         self.send("Line %d" % (y), b'\033h' + struct.pack("BB", 7, len(data)) + data)
         pass
 
+    def jetfab_layer(self, layer = 0):
+        w_dots, h_dots = self.svg.size()
+
+        self.send("Generate %dx%d layer" % (w_dots, h_dots), None)
+        self.send("Enter Horizontal Graphics Mode, 104x96 DPI", b'\033*\012\000\000')
+
+        # The lines are packed into two arena buffers in turn, so
+        # that the previous line is still there to compare with
+        w_bytes = (w_dots + 7) // 8
+        line = self.arena.array('line', (w_bytes * 8,), dtype=bool)
+        line[w_dots:] = False
+
+        # Lines outside of the raster are empty
+        line[0:w_dots] = True
+        blank = memoryview(self.arena.packbits(line, 'blank'))
+
+        first = self.arena.array('first', (w_dots,), dtype=numpy.uint8)
+        first[:] = 0
+        lastb = memoryview(first)
+
+        packed = 0
+        for y, band in self.bands(layer, 1, w_dots):
+            if band is None:
+                outb = blank
+            else:
+                numpy.logical_not(band[0], out = line[0:w_dots])
+                packed = 1 - packed
+                outb = memoryview(self.arena.packbits(line, 'packed%d' % (packed)))
+            self.jetfab_line(y, w_dots, outb, lastb)
+            lastb = outb
+            pass
+
+        self.send("Layer complete", b"\012") # Form Feed
+        pass
+
+    # Estimate the size of the ink commands of a layer
+    #
+    # A line equal to the line before it is sent as a repeat, and the
+    # others as their difference with it, two bytes for each changed
+    # byte. A line only changes where an outline edge moves to another
+    # dot: each edge changes a byte on every line where it moves, and
+    # one more for every 8 dots it moves along a line.
+    def ink_bytes(self, layer = 0):
+        w_dots, h_dots = self.svg.size()
+        x, y, w, h = self.svg.bbox(layer)
+
+        # Graphics mode, a repeat for each line, and the form feed
+        size = 5 + h_dots * 5 + 1
+        if w == 0 or h == 0:
+            return size
+
+        contours, holes = self.svg.polygons(layer)
+        dpi = self.svg.resolution()
+        scale = numpy.array([fab.mm2in(dpi[0]), fab.mm2in(dpi[1])])
+
+        changed = 0.0
+        for ring in contours + holes:
+            delta = numpy.abs(numpy.roll(ring, -1, axis=0) - ring) * scale
+            dx, dy = delta[:, 0], delta[:, 1]
+            lines = numpy.where(dy >= 1, numpy.minimum(dx, dy), numpy.minimum(dx, 1))
+            changed += (lines + dx / 8).sum()
+
+        return int(size + 2 * changed)
+
     def render(self, layer = 0):
         config = self.config
         z_delta_mm = self.svg.height_mm(layer)
@@ -176,27 +220,7 @@ class Fab(fab.Fab):
         if config['do_layer']:
             self.send("5. Move pen to start of the part bin")
             self.send("6. Ink the layer")
-            w_dots, h_dots = self.svg.size()
-            surface = self.svg.surface(layer)
-
-            self.send("Generate %dx%d layer" % (w_dots, h_dots), None)
-            self.send("Enter Horizontal Graphics Mode, 104x96 DPI", b'\033*\012\000\000')
-
-            lastb = bytearray([0] * w_dots)
-            stride = surface.get_stride()
-            image = numpy.frombuffer(surface.get_data(), dtype=numpy.uint8)
-            image = numpy.reshape(image, (h_dots, stride))
-            image = numpy.equal(image, 0)
-            image = numpy.packbits(image, axis=-1)
-
-            y = 0
-            for y in range(0, h_dots):
-                outb = bytearray(image[y])
-                self.jetfab_line(y, w_dots, outb, lastb)
-                lastb = outb
-                pass
-
-            self.send("Layer complete", b"\012") # Form Feed
+            self.ink(layer, self.jetfab_layer)
             pass
 
         self.send("7. Retract recoating blade to start of the Feed Bin")
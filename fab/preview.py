@@ -0,0 +1,269 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Layer previews
+#
+# Layers are downsampled to thumbnails from the strips the backend
+# rasterizes anyway, on the thread rasterizing them, and the thumbnails
+# are written as PNG files by a background thread, so that previews
+# never hold up the printer output.
+#
+# Layers the backend does not rasterize take the thumbnail of an
+# identical layer, if it is still remembered, or are rasterized for
+# the preview alone.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import zlib
+import time
+import struct
+import threading
+import collections
+
+try:
+    import queue
+except ImportError:
+    # Python2
+    import Queue as queue
+
+import numpy
+
+import fab
+
+# Maximum number of thumbnails waiting to be written
+QUEUE_DEPTH = 64
+
+# Number of thumbnails remembered for the identical layers
+REMEMBER = 16
+
+# Write a grayscale numpy (h, w) uint8 image as a PNG file
+def write_png(path, image):
+    h, w = image.shape
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    # Each row is prefixed by filter type 0 (None)
+    rows = numpy.zeros((h, w + 1), dtype=numpy.uint8)
+    rows[:, 1:] = image
+
+    with open(path, "wb") as f:
+        f.write(b'\211PNG\r\n\032\n')
+        f.write(chunk(b'IHDR', struct.pack(">IIBBBBB", w, h, 8, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 1)))
+        f.write(chunk(b'IEND', b''))
+    pass
+
+class Preview(object):
+    """ Background layer preview writer """
+
+    # 'size' is the (w, h) of the bed, in dots. Each thumbnail dot
+    # covers 'scale' x 'scale' bed dots. With 'prefix', one PNG is written
+    # per layer; with 'sheet', one contact sheet of all the layers.
+    def __init__(self, size = None, scale = 4, prefix = None, sheet = None):
+        self.scale = max(int(scale), 1)
+        self.prefix = prefix
+        self.sheet = sheet
+        self.w = (size[0] + self.scale - 1) // self.scale
+        self.h = (size[1] + self.scale - 1) // self.scale
+
+        self.layers = 0
+        self.dropped = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+        self._thumbnails = []
+        self._coverage = {}
+        self._known = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize = QUEUE_DEPTH)
+        self._worker = threading.Thread(target = self._work)
+        self._worker.daemon = True
+        self._worker.start()
+        pass
+
+    # Add the ink of the (h, w) 'image' at the (x, y) bed dot to the
+    # thumbnail of a layer. 'image' is the image of a fab.Raster, or a
+    # boolean band with 'full' of 1.
+    def strip(self, layer, x, y, image, full = 255):
+        start = time.time()
+        try:
+            self._strip(layer, x, y, image, full)
+        except Exception as err:
+            self._error(layer, err)
+
+        with self._lock:
+            self.seconds += time.time() - start
+        pass
+
+    # Add the ink of a strip to the coverage of its layer, see strip()
+    def _strip(self, layer, x, y, image, full):
+        scale = self.scale
+        h, w = image.shape
+
+        # Align the image on the thumbnail grid
+        x_pad = x % scale
+        y_pad = y % scale
+        tw = (x_pad + w + scale - 1) // scale
+        th = (y_pad + h + scale - 1) // scale
+        tx = x // scale
+        ty = y // scale
+
+        if h > 0 and w > 0 and tx < self.w and ty < self.h:
+            ink = numpy.zeros((th * scale, tw * scale), dtype=numpy.float32)
+            ink[y_pad:y_pad + h, x_pad:x_pad + w] = image
+            ink = ink.reshape(th, scale, tw, scale).sum(axis = (1, 3))
+            ink /= full * scale * scale
+
+            tw = min(tw, self.w - tx)
+            th = min(th, self.h - ty)
+            with self._lock:
+                coverage = self._coverage.get(layer)
+                if coverage is None:
+                    coverage = numpy.zeros((self.h, self.w), dtype=numpy.float32)
+                    self._coverage[layer] = coverage
+                coverage[ty:ty + th, tx:tx + tw] += ink[0:th, 0:tw]
+        pass
+
+    # Queue the preview of a layer of 'svg', a fab.svg.SVGRender, once
+    # all the strips of the layer are added. The thumbnail is made by
+    # the preview thread.
+    def done(self, layer, svg):
+        start = time.time()
+        try:
+            key = svg.fingerprint(layer)
+            with self._lock:
+                coverage = self._coverage.pop(layer, None)
+            self._queue.put_nowait((layer, coverage, key, svg))
+            self.layers += 1
+        except queue.Full:
+            self.dropped += 1
+        except Exception as err:
+            self._error(layer, err)
+
+        with self._lock:
+            self.seconds += time.time() - start
+        pass
+
+    # Return the thumbnail of a layer, from its 'coverage' if the
+    # backend rasterized it
+    def _make(self, layer, coverage, key, svg):
+        if coverage is not None:
+            thumbnail = self._thumbnail(coverage)
+        else:
+            thumbnail = self._known.get(key)
+            if thumbnail is None:
+                thumbnail = self._rasterize(layer, svg)
+
+        # Keep the most recently used thumbnails
+        self._known.pop(key, None)
+        self._known[key] = thumbnail
+        while len(self._known) > REMEMBER:
+            self._known.popitem(last = False)
+        return thumbnail
+
+    # Return the (h, w) uint8 thumbnail of the ink coverage of a layer,
+    # white paper with the ink in black
+    def _thumbnail(self, coverage):
+        return (255 - numpy.minimum(coverage, 1.0) * 255).astype(numpy.uint8)
+
+    # Return the thumbnail of a layer the backend did not rasterize
+    def _rasterize(self, layer, svg):
+        x, y, w, h = svg.bbox(layer)
+        lines = fab.STRIP_LINES
+        for top in range(y - y % lines, y + h, lines):
+            strip = svg.strip(layer, top, lines)
+            if not strip.empty():
+                self.strip(layer, strip.x, strip.y, strip.image())
+            strip.release()
+
+        with self._lock:
+            coverage = self._coverage.pop(layer, None)
+        if coverage is None:
+            coverage = numpy.zeros((self.h, self.w), dtype=numpy.float32)
+        return self._thumbnail(coverage)
+
+    def _error(self, layer, err):
+        if self.errors == 0:
+            print("Preview of layer %d failed: %s" % (layer, err), file=sys.stderr)
+        self.errors += 1
+        pass
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            start = time.time()
+            layer = item[0]
+            try:
+                thumbnail = self._make(*item)
+                if self.prefix is not None:
+                    write_png("%s%03d.png" % (self.prefix, layer), thumbnail)
+                if self.sheet is not None:
+                    self._thumbnails.append((layer, thumbnail))
+            except Exception as err:
+                self._error(layer, err)
+            with self._lock:
+                self.seconds += time.time() - start
+            pass
+        pass
+
+    # Wait for the pending previews, and write the contact sheet
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+        if self.sheet is None or len(self._thumbnails) == 0:
+            return
+
+        start = time.time()
+        try:
+            self._thumbnails.sort(key = lambda item: item[0])
+            count = len(self._thumbnails)
+            columns = int(numpy.ceil(numpy.sqrt(count)))
+            rows = (count + columns - 1) // columns
+
+            # One dot of gray border between the thumbnails
+            w = self.w + 1
+            h = self.h + 1
+            sheet = numpy.full((rows * h + 1, columns * w + 1), 128, dtype=numpy.uint8)
+            for index, (layer, thumbnail) in enumerate(self._thumbnails):
+                x = (index % columns) * w + 1
+                y = (index // columns) * h + 1
+                sheet[y:y + self.h, x:x + self.w] = thumbnail
+
+            write_png(self.sheet, sheet)
+        except Exception as err:
+            self._error(-1, err)
+        self.seconds += time.time() - start
+        pass
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,223 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Multi-printer scheduler
+#
+# Drives several fabricators from one host. Each printer has a backend
+# from fab.fabricator, a bed size, and a device (a serial port, a pty,
+# or a plain file standing in for one). Queued jobs go to the first
+# free printer of a compatible backend whose bed holds the part, once
+# shifted by the job and the hardware margin of the backend, and all
+# the printers render, encode and stream their jobs at once. Each job
+# is bounded by the bed of the printer it runs on.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import time
+import threading
+import itertools
+
+import fab
+from fab.server import Job
+
+class Printer(object):
+    """ Fabricator attached to the host """
+
+    # 'size_mm' defaults to the bed size of the backend
+    def __init__(self, name = None, fabtype = 'brundle', device = None, size_mm = None):
+        self.name = name
+        self.fabtype = fabtype
+        self.device = device
+        self.backend = fab.fabricator[fabtype].Fab()
+        if size_mm is None:
+            size_mm = self.backend.size_mm()[0:2]
+        self.size_mm = tuple(size_mm)
+
+        self.jobs = 0
+        self.failed = 0
+        self.bytes = 0
+        self.busy = 0.0
+        pass
+
+    # Can the printer print the job?
+    def fits(self, job):
+        if job.fabtype is not None and job.fabtype != self.fabtype:
+            return False
+        if job.size_mm is not None:
+            shift_mm = self.backend.shift_mm(job.config)
+            for i in range(0, 2):
+                if job.size_mm[i] + shift_mm[i] > self.size_mm[i]:
+                    return False
+        return True
+
+    # The config of a job on the printer, bounded by its bed
+    def config(self, job):
+        config = dict(job.config)
+        config['x_bound_mm'] = self.size_mm[0]
+        config['y_bound_mm'] = self.size_mm[1]
+        return config
+
+class Scheduler(object):
+    """ Job scheduler over several printers """
+
+    # 'runner(source, out, fabtype, config, cache, svg)' converts one
+    # job, writing the printer commands to 'out', and returns the job
+    # statistics. The printers share 'cache', a fab.Cache. 'svg' is the
+    # layers of the source given to submit(), or None.
+    def __init__(self, printers = None, runner = None, config = None, cache = None):
+        self.printers = printers
+        self.runner = runner
+        self.config = config
+        self.cache = cache
+
+        self.jobs = []
+        self._queue = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Condition()
+        self._closed = False
+        self._start = None
+        self._threads = []
+        pass
+
+    # Queue a job. With 'fabtype', only printers of that backend take
+    # it. With 'size_mm', the (x, y) extent of the part before it is
+    # shifted, only printers with a large enough bed take it. 'svg',
+    # the fab.svg.SVGRender of the source if it is already loaded, is
+    # passed on to the runner.
+    def submit(self, source = None, fabtype = None, size_mm = None,
+               config = None, priority = 0, svg = None):
+        job_config = dict(self.config)
+        if config is not None:
+            job_config.update(config)
+
+        job = Job(id = next(self._ids), source = source, fabtype = fabtype,
+                  config = job_config, priority = priority)
+        job.size_mm = size_mm
+        job.svg = svg
+        job.printer = None
+
+        if not any([printer.fits(job) for printer in self.printers]):
+            raise ValueError("%s: no printer can print the job" % (source))
+
+        with self._lock:
+            self.jobs.append(job)
+            self._queue.append(job)
+            self._queue.sort(key = lambda job: (job.priority, job.id))
+            self._lock.notify_all()
+        return job
+
+    def start(self):
+        self._start = time.time()
+        for printer in self.printers:
+            thread = threading.Thread(target = self._work, args = (printer,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        pass
+
+    # Wait for all the queued jobs to complete
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        for thread in self._threads:
+            thread.join()
+        pass
+
+    # Take the next job the printer can print, or None when there is
+    # nothing left for it
+    def _next(self, printer):
+        with self._lock:
+            while True:
+                for job in self._queue:
+                    if printer.fits(job):
+                        self._queue.remove(job)
+                        return job
+                if self._closed:
+                    return None
+                self._lock.wait()
+        pass
+
+    def _work(self, printer):
+        while True:
+            job = self._next(printer)
+            if job is None:
+                break
+
+            job.printer = printer.name
+            job.state = 'running'
+            job.started = time.time()
+            try:
+                with open(printer.device, "ab") as out:
+                    job.stats = self.runner(job.source, out, printer.fabtype,
+                                            printer.config(job), self.cache, job.svg)
+                job.state = 'done'
+                printer.bytes += job.stats['bytes']
+            except Exception as err:
+                job.error = str(err)
+                job.state = 'failed'
+                printer.failed += 1
+            except SystemExit as err:
+                job.error = "exit %s" % (err.code)
+                job.state = 'failed'
+                printer.failed += 1
+
+            # The layers are only needed by the job
+            job.svg = None
+            job.finished = time.time()
+            printer.jobs += 1
+            printer.busy += job.finished - job.started
+            print("Job %d: %s on %s %s in %.2fs" %
+                  (job.id, job.source, printer.name, job.state, job.finished - job.started),
+                  file=sys.stderr)
+            job.done.set()
+        pass
+
+    # Per-printer utilization, as a list of dictionaries
+    def report(self):
+        elapsed = 0.0
+        if self._start is not None:
+            elapsed = time.time() - self._start
+
+        report = []
+        for printer in self.printers:
+            utilization = 0.0
+            if elapsed > 0:
+                utilization = printer.busy / elapsed
+            report.append({'printer': printer.name,
+                           'fab': printer.fabtype,
+                           'device': printer.device,
+                           'jobs': printer.jobs,
+                           'failed': printer.failed,
+                           'bytes': printer.bytes,
+                           'busy': printer.busy,
+                           'elapsed': elapsed,
+                           'utilization': utilization})
+        return report
+
+#  vim: set shiftwidth=4 expandtab: #
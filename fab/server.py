@@ -0,0 +1,372 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Fabrication job server
+#
+# The server listens on a local Unix socket, and keeps the interpreter,
+# the fab backends and the cache of their encoded layers warm between
+# jobs. Each job still rasterizes the layers of its own source.
+#
+# Requests and replies are single lines of JSON:
+#
+#   {"op": "submit", "source": PATH, "fab": SYSTEM, "config": {...},
+#    "priority": N, "output": PATH, "stream": BOOL}
+#       Queue a job. Lower priorities run first. The reply is
+#       {"id": ID, "depth": N}, or {"error": ...} if "config" has any
+#       options but the print options of OPTIONS. With a server sink
+#       directory, the commands are written to a file in it, named
+#       "output" if given. With "stream",
+#       the commands are sent as they are produced, each chunk as a
+#       {"id": ID, "data": N} line followed by N bytes of printer
+#       commands, and a {"id": ID, "state": ..., "bytes": N, ...} line
+#       is sent when the job completes.
+#
+#   {"op": "status"}
+#       Reply with the queue depth, and the state and latency of the
+#       recent jobs.
+#
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import itertools
+import collections
+
+try:
+    import queue
+    import socketserver
+except ImportError:
+    # Python2
+    import Queue as queue
+    import SocketServer as socketserver
+
+# Number of completed jobs remembered for 'status'
+HISTORY = 100
+
+# Bytes of printer commands sent to a streaming client at once
+CHUNK = 64 << 10
+
+# Job options a client may set: the options of the print itself, but
+# not the programs run, nor the files written, by the server
+OPTIONS = ('gcode_terse', 'fuser_temp', 'fuser_margin_mm', 'fuser_preheat',
+           'sprays', 'x_bound_mm', 'y_bound_mm', 'x_shift_mm', 'y_shift_mm',
+           'z_slice_mm', 'scale', 'simplify_dots', 'adaptive_mm',
+           'adaptive_tolerance', 'do_startup', 'do_layer', 'do_fuser',
+           'do_extrude', 'do_weave', 'do_serpentine', 'slicer')
+
+class Job(object):
+    """ Fabrication job """
+
+    # 'stream' is a file-like object the commands are written to as
+    # they are produced, or None
+    def __init__(self, id = 0, source = None, fabtype = None, config = None,
+                 priority = 0, output = None, stream = None):
+        self.id = id
+        self.source = source
+        self.fabtype = fabtype
+        self.config = config
+        self.priority = priority
+        self.output = output
+        self.stream = stream
+
+        self.state = 'queued'
+        self.stats = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+        pass
+
+    # Time from submission to completion, in seconds
+    def latency(self):
+        if self.finished is None:
+            return time.time() - self.submitted
+        return self.finished - self.submitted
+
+    def info(self):
+        info = {'id': self.id, 'source': self.source, 'fab': self.fabtype,
+                'priority': self.priority, 'state': self.state,
+                'latency': self.latency()}
+        if self.started is not None:
+            info['wait'] = self.started - self.submitted
+        if self.output is not None:
+            info['output'] = self.output
+        if self.stats is not None:
+            info['layers'] = self.stats['layers']
+            info['bytes'] = self.stats['bytes']
+        if self.error is not None:
+            info['error'] = self.error
+        return info
+
+class Server(object):
+    """ Fabrication job server, on a local Unix socket """
+
+    # 'runner(source, out, fabtype, config)' converts one job, writing
+    # the printer commands to 'out', and returns the job statistics.
+    def __init__(self, path = None, runner = None, fabtype = 'brundle',
+                 config = None, workers = 1, sink_dir = None):
+        self.path = path
+        self.runner = runner
+        self.fabtype = fabtype
+        self.config = config
+        self.sink_dir = sink_dir
+
+        self._queue = queue.PriorityQueue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._running = {}
+        self._history = collections.deque(maxlen = HISTORY)
+
+        self._workers = []
+        for i in range(0, max(workers, 1)):
+            worker = threading.Thread(target = self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        pass
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, source = None, fabtype = None, config = None,
+               priority = 0, output = None, stream = None):
+        job_config = dict(self.config)
+        if config is not None:
+            refused = sorted([key for key in config.keys() if key not in OPTIONS])
+            if len(refused) > 0:
+                raise ValueError("options not accepted from clients: %s" % (", ".join(refused)))
+            job_config.update(config)
+        if fabtype is None:
+            fabtype = self.fabtype
+
+        if output is not None:
+            if self.sink_dir is None or os.path.basename(output) != output or output in ("", ".", ".."):
+                raise ValueError("output must be a file name in the sink directory")
+            output = os.path.join(self.sink_dir, output)
+
+        job = Job(id = next(self._ids), source = source, fabtype = fabtype,
+                  config = job_config, priority = priority, output = output,
+                  stream = stream)
+
+        if job.output is None and self.sink_dir is not None:
+            name = "%d-%s.%s" % (job.id, os.path.splitext(os.path.basename(source))[0], fabtype)
+            job.output = os.path.join(self.sink_dir, name)
+
+        self._queue.put((job.priority, job.id, job))
+        return job
+
+    def status(self):
+        with self._lock:
+            running = [job.info() for job in self._running.values()]
+            history = [job.info() for job in self._history]
+
+        latency = [job['latency'] for job in history if job['state'] == 'done']
+        status = {'depth': self.depth(),
+                  'running': running,
+                  'jobs': history,
+                  'done': len(latency)}
+        if len(latency) > 0:
+            status['latency'] = {'mean': sum(latency) / len(latency),
+                                 'max': max(latency),
+                                 'min': min(latency)}
+        return status
+
+    def _work(self):
+        while True:
+            priority, id, job = self._queue.get()
+
+            with self._lock:
+                self._running[job.id] = job
+            job.state = 'running'
+            job.started = time.time()
+
+            out = _Tee()
+            try:
+                if job.output is not None:
+                    out.outputs.append(open(job.output, "wb"))
+                if job.stream is not None:
+                    out.outputs.append(job.stream)
+                job.stats = self.runner(job.source, out, job.fabtype, job.config)
+                if job.stream is not None:
+                    job.stream.flush()
+                job.state = 'done'
+            except Exception as err:
+                job.error = str(err)
+                job.state = 'failed'
+            except SystemExit as err:
+                job.error = "exit %s" % (err.code)
+                job.state = 'failed'
+            finally:
+                if job.output is not None and len(out.outputs) > 0:
+                    out.outputs[0].close()
+
+            job.finished = time.time()
+            print("Job %d: %s %s in %.2fs" % (job.id, job.source, job.state, job.latency()), file=sys.stderr)
+
+            with self._lock:
+                del self._running[job.id]
+                self._history.append(job)
+            job.done.set()
+            self._queue.task_done()
+        pass
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        server = _UnixServer(self.path, _Handler)
+        server.fab_server = self
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(self.path)
+        pass
+
+class _Tee(object):
+    """ Output writing to several outputs, or none """
+
+    def __init__(self):
+        self.outputs = []
+        pass
+
+    def write(self, data):
+        for output in self.outputs:
+            output.write(data)
+        pass
+
+# Stream of the commands of a job to the client, in chunks of up to
+# CHUNK bytes. The chunks wait for the reply to the submit request to
+# be sent first.
+class _Stream(object):
+    def __init__(self, handler):
+        self.handler = handler
+        self.id = None
+        self.ready = threading.Event()
+        self._data = bytearray()
+        pass
+
+    def write(self, data):
+        self._data += data
+        if len(self._data) >= CHUNK:
+            self.flush()
+        pass
+
+    def flush(self):
+        if len(self._data) == 0:
+            return
+        self.ready.wait()
+        self.handler.reply({'id': self.id, 'data': len(self._data)}, bytes(self._data))
+        del self._data[:]
+        pass
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, message, data = None):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        if data is not None:
+            self.wfile.write(data)
+        self.wfile.flush()
+        pass
+
+    def handle(self):
+        server = self.server.fab_server
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode())
+            except ValueError as err:
+                self.reply({'error': str(err)})
+                continue
+
+            op = request.get('op')
+            if op == 'status':
+                self.reply(server.status())
+            elif op == 'submit' and 'source' in request:
+                stream = None
+                if request.get('stream', False):
+                    stream = _Stream(self)
+                try:
+                    job = server.submit(source = request['source'],
+                                        fabtype = request.get('fab'),
+                                        config = request.get('config'),
+                                        priority = request.get('priority', 0),
+                                        output = request.get('output'),
+                                        stream = stream)
+                except ValueError as err:
+                    self.reply({'error': str(err)})
+                    continue
+                self.reply({'id': job.id, 'depth': server.depth()})
+                if stream is not None:
+                    stream.id = job.id
+                    stream.ready.set()
+                    job.done.wait()
+                    info = job.info()
+                    info.setdefault('bytes', 0)
+                    self.reply(info)
+            else:
+                self.reply({'error': "unknown request"})
+            pass
+        pass
+
+# Client side: send one request, and return the reply
+def request(path, message, out = None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    f = sock.makefile("rwb")
+    try:
+        f.write(json.dumps(message).encode() + b"\n")
+        f.flush()
+        reply = json.loads(f.readline().decode())
+
+        if message.get('op') == 'submit' and message.get('stream') and 'id' in reply:
+            reply = json.loads(f.readline().decode())
+            while 'data' in reply:
+                remain = reply['data']
+                while remain > 0:
+                    data = f.read(min(remain, 1 << 16))
+                    if not data:
+                        raise IOError("connection closed in the middle of a job")
+                    if out is not None:
+                        out.write(data)
+                    remain -= len(data)
+                reply = json.loads(f.readline().decode())
+    finally:
+        f.close()
+        sock.close()
+
+    return reply
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,148 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Z sharded slicing helpers
+#
+# A tall part is cut into shards along Z, at whole layers, and each
+# shard is sliced on its own. 'slic3r --cut' keeps the X and Y of the
+# part, but moves each piece down to Z 0, and slic3r's SVG export moves
+# the slices by the lower X/Y corner of the bounding box of the print,
+# without flipping Y (Slic3r::Print::export_svg). So the layers of each
+# shard are moved back up by the Z of the cut, and across by the offset
+# of the lower corner of the shard from the lower corner of the part.
+#
+# Layer i of the shard cut at layer c is layer c + i of the part. Each
+# shard only contributes the layers up to the next cut, so the layers
+# at the cuts are neither lost nor repeated.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import re
+import struct
+
+import numpy
+
+from fab import svg
+
+# Binary STL facet: normal, three vertices, attributes
+_FACET = numpy.dtype([('normal', '<f4', (3,)),
+                      ('vertices', '<f4', (3, 3)),
+                      ('attributes', '<u2')])
+
+_VERTEX = re.compile(br'vertex\s+(\S+)\s+(\S+)\s+(\S+)')
+_POINTS = re.compile(br'(\spoints\s*=\s*")([^"]*)(")')
+
+# Return the (N, 3) array of the vertices of a binary or ASCII STL file
+def stl_vertices(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) >= 84:
+        count, = struct.unpack_from("<I", data, 80)
+        if 84 + count * _FACET.itemsize == len(data):
+            facets = numpy.frombuffer(data, dtype=_FACET, count=count, offset=84)
+            return facets['vertices'].reshape((-1, 3)).astype(numpy.float64)
+
+    vertices = _VERTEX.findall(data)
+    return numpy.array(vertices, dtype=numpy.float64).reshape((-1, 3))
+
+# Return the (min, max) corners of the vertices of an STL file
+def stl_extent(path):
+    vertices = stl_vertices(path)
+    if len(vertices) == 0:
+        raise ValueError("%s: no facets" % (path))
+    return (vertices.min(axis = 0), vertices.max(axis = 0))
+
+# Return the Z of the cuts, in mm from the bottom of the part, that
+# split 'height_mm' into 'shards' of whole layers of 'layer_mm'
+def cuts(height_mm, shards, layer_mm):
+    layers = int(round(height_mm / layer_mm))
+    z = []
+    for shard in range(1, shards):
+        layer = int(round(layers * shard / shards))
+        if layer > 0 and layer < layers and (len(z) == 0 or layer * layer_mm > z[-1]):
+            z.append(layer * layer_mm)
+    return z
+
+# Move the points of a <polygon> element by (dx, dy) mm
+def _move_points(match, dx, dy):
+    values = match.group(2).replace(b',', b' ').split()
+    points = []
+    for i in range(0, len(values) - 1, 2):
+        points.append(("%.9g,%.9g" % (float(values[i]) + dx, float(values[i + 1]) + dy)).encode())
+    return match.group(1) + b' '.join(points) + match.group(3)
+
+# Merge the SVGs of the shards into the SVG file 'output'
+#
+# Each of the 'shards' is the (svg_file, first, last, z_mm, dx, dy) of
+# a shard, holding the layers 'first' up to, but not including, 'last'
+# of the part (None for the top shard), cut at 'z_mm' from the bottom
+# and with its corner at (dx, dy) mm from the corner of the part.
+#
+# Returns the number of layers.
+def merge(shards, output):
+    root = None
+    layers = 0
+    with open(output, "wb") as out:
+        for path, first, last, z_mm, dx, dy in shards:
+            index = svg.scan(path)
+            if root is None:
+                root = index['root'].encode('latin-1')
+                out.write(root + b'\n')
+
+            groups = sorted(index['layers'], key = lambda layer: layer[0])
+            if last is not None and len(groups) < last - first:
+                raise ValueError("%s: %d layers, expected %d" %
+                                 (path, len(groups), last - first))
+            if layers != first:
+                raise ValueError("%s: starts at layer %d, expected %d" % (path, first, layers))
+
+            with open(path, "rb") as f:
+                data = f.read()
+
+            for local, (layer_z_mm, start, end, fingerprint) in enumerate(groups):
+                if last is not None and first + local >= last:
+                    break
+                if layer_z_mm is None:
+                    raise ValueError("%s: layers without slic3r:z" % (path))
+
+                group = data[start:end]
+                tag = svg._G_TAG.match(group).group(0)
+                z = ("%.9g" % ((layer_z_mm + z_mm) / 1000000)).encode()
+                retagged = svg._Z_ATTR.sub(lambda m: m.group(0).replace(m.group(1), z), tag)
+                group = retagged + group[len(tag):]
+                if dx != 0 or dy != 0:
+                    group = _POINTS.sub(lambda m: _move_points(m, dx, dy), group)
+
+                out.write(group + b'\n')
+                layers += 1
+
+        out.write(b'</svg>\n')
+
+    return layers
+
+#  vim: set shiftwidth=4 expandtab: #
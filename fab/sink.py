@@ -0,0 +1,554 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Virtual printers
+#
+# A sink stands in for the device a fab.Fab writes to. It decodes the
+# printer commands back into the bitmap inked on each layer, and feeds
+# them through an emulated link: the device drains its buffer at the
+# baud rate, and the host stalls whenever the buffer is full.
+#
+# The per-layer digests of the decoded bitmaps tell whether two runs
+# print the same part, whatever their encoding, and the link report
+# tells how fast the host keeps up with the printer.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import struct
+import hashlib
+
+import numpy
+
+import fab
+from fab import brundle
+
+# Device buffer, in bytes, when none is given
+BUFFER = 4096
+
+# Bits on the wire per byte (8N1)
+BITS_PER_BYTE = 10
+
+class Sink(object):
+    """ Virtual printer, decoding the commands written to it """
+
+    # 'baud' is the link speed (0 for an unlimited link), and 'buffer'
+    # the size of the device buffer. Everything written is also
+    # passed on to 'output', if any. With 'realtime', the host really
+    # sleeps while stalled, otherwise the stalls are only accounted.
+    def __init__(self, output = None, baud = 0, buffer = None, realtime = True):
+        self.output = output
+        self.baud = baud
+        if buffer is None:
+            buffer = BUFFER
+        self.buffer = buffer
+        self.realtime = realtime
+
+        # Width of the bed in dots, if known, to clip the padding of
+        # the decoded lines to
+        self.width = None
+
+        # Per-layer (dots, digest) of the decoded bitmaps
+        self.layers = []
+
+        self.bytes = 0
+        self.stalled = 0.0
+        self.decoding = 0.0
+        self._start = None
+        self._clock = None
+        self._level = 0.0
+
+        self._data = bytearray()
+        self._rows = None
+        pass
+
+    # Time of the emulated host, without the time spent decoding or,
+    # when not in realtime, stalled
+    def _now(self):
+        now = time.time() - self.decoding
+        if not self.realtime:
+            now += self.stalled
+        return now
+
+    # Pass 'count' bytes through the link, stalling until the device
+    # buffer has room for them
+    def _transmit(self, count):
+        now = self._now()
+        if self._start is None:
+            self._start = now
+            self._clock = now
+        self.bytes += count
+
+        if self.baud <= 0:
+            self._clock = now
+            return
+
+        rate = self.baud / BITS_PER_BYTE
+        self._level = max(0.0, self._level - (now - self._clock) * rate)
+        self._clock = now
+
+        wait = (self._level + count - self.buffer) / rate
+        if wait > 0:
+            if self.realtime:
+                time.sleep(wait)
+            self.stalled += wait
+            self._level -= wait * rate
+            self._clock += wait
+        self._level += count
+        pass
+
+    def write(self, data):
+        self._transmit(len(data))
+        if self.output is not None:
+            self.output.write(data)
+
+        start = time.time()
+        self._data += data
+        used = self.decode(self._data)
+        del self._data[:used]
+        self.decoding += time.time() - start
+        pass
+
+    def flush(self):
+        if self.output is not None:
+            self.output.flush()
+        pass
+
+    # MUST OVERRIDE: Decode the complete commands at the start of
+    # 'data', and return the number of bytes decoded
+    def decode(self, data):
+        return len(data)
+
+    # Start the bitmap of a new layer
+    def layer_begin(self):
+        if self._rows is not None:
+            self.layer_end()
+        self._rows = {}
+        pass
+
+    # Ink the dots set in 'dots', a bool array, from column 'x' of
+    # row 'y' of the layer
+    def ink(self, y, x, dots):
+        if self._rows is None or y < 0:
+            return
+        if x < 0:
+            dots = dots[-x:]
+            x = 0
+        if len(dots) == 0:
+            return
+
+        row = self._rows.get(y)
+        if row is None or len(row) < x + len(dots):
+            grown = numpy.zeros((x + len(dots)), dtype=bool)
+            if row is not None:
+                grown[0:len(row)] = row
+            row = grown
+            self._rows[y] = row
+        row[x:x+len(dots)] |= dots
+        pass
+
+    # Complete the bitmap of the layer, and record its digest
+    def layer_end(self):
+        if self._rows is None:
+            return
+        bitmap = self.bitmap()
+        self._rows = None
+
+        digest = hashlib.sha1(struct.pack("<II", *bitmap.shape))
+        digest.update(numpy.packbits(bitmap, axis=-1).tobytes())
+        self.layers.append((int(numpy.count_nonzero(bitmap)), digest.hexdigest()))
+        pass
+
+    # Bitmap of the layer being decoded, trimmed to its inked dots
+    def bitmap(self):
+        rows = self._rows or {}
+        h = max([y + 1 for y in rows.keys()] + [0])
+        w = max([len(row) for row in rows.values()] + [0])
+        if self.width is not None:
+            w = min(w, self.width)
+
+        bitmap = numpy.zeros((h, w), dtype=bool)
+        for y, row in rows.items():
+            if y < h:
+                bitmap[y, 0:min(w, len(row))] = row[0:w]
+
+        inked = numpy.nonzero(bitmap)
+        if len(inked[0]) == 0:
+            return numpy.zeros((0, 0), dtype=bool)
+        return bitmap[0:inked[0].max()+1, 0:inked[1].max()+1]
+
+    # Complete the last layer, and wait for the device to drain
+    def close(self):
+        self.layer_end()
+        if self._start is None:
+            return
+        now = self._now()
+        if self.baud > 0:
+            now = max(now, self._clock + self._level * BITS_PER_BYTE / self.baud)
+            self._level = 0.0
+        self._clock = now
+        pass
+
+    # Dictionary of the decoded layers and of the link throughput
+    def report(self):
+        elapsed = 0.0
+        if self._start is not None:
+            elapsed = self._clock - self._start
+
+        digest = hashlib.sha1()
+        for dots, layer in self.layers:
+            digest.update(layer.encode())
+
+        rate = 0.0
+        if elapsed > 0:
+            rate = self.bytes / elapsed
+
+        return {'layers': len(self.layers),
+                'dots': sum([dots for dots, layer in self.layers]),
+                'digest': digest.hexdigest(),
+                'bytes': self.bytes,
+                'seconds': elapsed,
+                'rate': rate,
+                'stalled': self.stalled,
+                'decoding': self.decoding}
+
+class GCodeSink(Sink):
+    """ Virtual BrundleFab, decoding G-code """
+
+    def __init__(self, **kwargs):
+        super(GCodeSink, self).__init__(**kwargs)
+        self.position = {'X': 0.0, 'Y': 0.0, 'Z': 0.0, 'E': 0.0}
+        self.relative = False
+        self.motion = None
+        self.tool = None
+        self.mask = 0
+        # The Y dot the ink bar last went over, on the line of the ink
+        # head, or None until the head is positioned along the line
+        self.fired = None
+        self.positioned = False
+        pass
+
+    def decode(self, data):
+        end = data.rfind(b"\n") + 1
+        for line in bytes(data[0:end]).decode().splitlines():
+            self.command(line.split(";")[0].split())
+        return end
+
+    # Execute one G-code line, as a list of words
+    def command(self, words):
+        if len(words) == 0:
+            return
+
+        if words[0][0] in "GMT":
+            command = words.pop(0)
+        else:
+            # Terse G-code repeats the last motion command
+            command = self.motion
+
+        args = {}
+        for word in words:
+            try:
+                args[word[0]] = float(word[1:])
+            except ValueError:
+                args[word[0]] = word[1:]
+
+        if command in ("G0", "G1"):
+            self.motion = command
+            self.move(args)
+        elif command == "G28":
+            for axis in self.position.keys():
+                if len(args) == 0 or axis in args:
+                    self.position[axis] = 0.0
+        elif command == "G90":
+            self.relative = False
+        elif command == "G91":
+            self.relative = True
+        elif command == "M117":
+            if len(words) > 0 and words[0] == "Slice":
+                self.layer_begin()
+        elif command is not None and command[0] == "T":
+            self.tool = int(command[1:])
+            if self.tool == 1 and 'P' in args:
+                self.mask = int(args['P'])
+
+        if command is not None and command[0] == "G" and command not in ("G0", "G1"):
+            self.motion = None
+        pass
+
+    # Move the axes, inking the dots passed over by the ink head
+    #
+    # The first move along a line positions the ink head on its first
+    # dot. From there on, the ink bar goes over every dot the head
+    # reaches, up to the end of the move, so a run of dots ends on its
+    # last dot, and the next run starts from the dot after it.
+    def move(self, args):
+        start = dict(self.position)
+        for axis in self.position.keys():
+            if axis in args:
+                if self.relative:
+                    self.position[axis] += args[axis]
+                else:
+                    self.position[axis] = args[axis]
+
+        if self.position['X'] != start['X']:
+            self.fired = None
+            self.positioned = False
+            return
+
+        if self.tool != 1:
+            return
+
+        if not self.positioned:
+            self.positioned = True
+            return
+
+        y0 = int(round(fab.mm2in(start['Y']) * brundle.Y_DPI))
+        y1 = int(round(fab.mm2in(self.position['Y']) * brundle.Y_DPI))
+        if y0 == y1:
+            return
+
+        if self.fired == y0:
+            y0 += 1 if y1 > y0 else -1
+        self.fired = y1
+        if self.mask == 0:
+            return
+        y0, y1 = min(y0, y1), max(y0, y1)
+
+        # The ink bar nozzles end at the X position of the ink head
+        x_dots = int(round(fab.mm2in(start['X'] - brundle.X_BIN_PART) * brundle.X_DPI))
+        dots = numpy.ones((y1 - y0 + 1), dtype=bool)
+        for nozzle in range(0, brundle.Y_DOTS):
+            if self.mask & (1 << nozzle):
+                self.ink(x_dots - (brundle.Y_DOTS - 1) + nozzle, y0, dots)
+        pass
+
+class EscpSink(Sink):
+    """ Virtual ESC/P raster printer """
+
+    def __init__(self, **kwargs):
+        super(EscpSink, self).__init__(**kwargs)
+        self.row = 0
+        self.column = 0
+        self.remote = False
+        pass
+
+    def decode(self, data):
+        offset = 0
+        while offset < len(data):
+            used = self.command(data, offset)
+            if used == 0:
+                break
+            offset += used
+        return offset
+
+    # Execute the command at 'offset', and return its length, or 0
+    # if it is not complete yet
+    def command(self, data, offset):
+        left = len(data) - offset
+        c = data[offset]
+
+        if self.remote:
+            # Remote mode commands, up to ESC NUL NUL NUL
+            if c == 0x1b:
+                if left < 4:
+                    return 0
+                self.remote = False
+                return 4
+            if left < 4:
+                return 0
+            length, = struct.unpack_from("<H", data, offset + 2)
+            if left < 4 + length:
+                return 0
+            return 4 + length
+
+        if c != 0x1b:
+            if c == 0x0d:
+                self.column = 0
+            elif c == 0x0c:
+                # Form feed ends the page
+                if self._rows is None:
+                    self.layer_begin()
+                self.layer_end()
+                self.row = 0
+                self.column = 0
+            return 1
+
+        if left < 2:
+            return 0
+        code = data[offset + 1]
+
+        if code == ord('('):
+            if left < 5:
+                return 0
+            code = data[offset + 2]
+            length, = struct.unpack_from("<H", data, offset + 3)
+            if left < 5 + length:
+                return 0
+            args = bytes(data[offset+5:offset+5+length])
+            if code == ord('v'):
+                if self._rows is None:
+                    self.layer_begin()
+                self.row += struct.unpack("<L", args)[0]
+            elif code == ord('$'):
+                self.column = struct.unpack("<L", args)[0]
+            elif code == ord('R'):
+                self.remote = True
+            return 5 + length
+        elif code == ord('i'):
+            if left < 9:
+                return 0
+            color, cmode, bpp, bwidth, lines = struct.unpack_from("<BBBHH", data, offset + 2)
+            if left < 9 + bwidth * lines:
+                return 0
+            self.image(data[offset+9:offset+9+bwidth*lines], color, bpp, bwidth, lines)
+            return 9 + bwidth * lines
+        elif code == 0x01:
+            end = data.find(b"@EJL     \n", offset)
+            if end < 0:
+                return 0
+            return end + 10 - offset
+        elif code == ord('@'):
+            return 2
+        elif code == 0x19:
+            return 3 if left >= 3 else 0
+        elif code == 0x00:
+            return 4 if left >= 4 else 0
+
+        raise ValueError("ESC/P: unknown command ESC 0x%02x" % (code))
+
+    # Ink an 'ESC i' image. The microweave images (color | 0x40) are
+    # the odd lines of the band, the others its even lines.
+    def image(self, data, color, bpp, bwidth, lines):
+        if self._rows is None:
+            self.layer_begin()
+
+        image = numpy.unpackbits(numpy.frombuffer(bytes(data), dtype=numpy.uint8))
+        image = image.reshape((lines, bwidth * 8 // bpp, bpp)).any(axis=-1)
+
+        weave = 1 if (color & 0x40) else 0
+        for line in range(0, lines):
+            self.ink(self.row + line * 2 + weave, self.column, image[line])
+        pass
+
+class JetFabSink(Sink):
+    """ Virtual JetFab printer, decoding ESC h lines """
+
+    def __init__(self, **kwargs):
+        super(JetFabSink, self).__init__(**kwargs)
+        self.row = 0
+        self.line = bytearray()
+        pass
+
+    def decode(self, data):
+        offset = 0
+        while offset < len(data):
+            used = self.command(data, offset)
+            if used == 0:
+                break
+            offset += used
+        return offset
+
+    def command(self, data, offset):
+        left = len(data) - offset
+        c = data[offset]
+
+        if c != 0x1b:
+            if c == 0x0a:
+                # Layer complete
+                self.layer_end()
+            return 1
+
+        if left < 2:
+            return 0
+        code = data[offset + 1]
+
+        if code == ord('@'):
+            return 2
+        elif code == ord('*'):
+            if left < 5:
+                return 0
+            self.layer_begin()
+            self.row = 0
+            # The first line is encoded against a line of zeroes
+            self.line = bytearray(255)
+            return 5
+        elif code == ord('h'):
+            if left < 4:
+                return 0
+            length = data[offset + 3]
+            if left < 4 + length:
+                return 0
+            self.line = self.expand(data[offset+4:offset+4+length], self.line)
+            # Inverted: the clear bits are inked
+            line = numpy.unpackbits(numpy.frombuffer(bytes(self.line), dtype=numpy.uint8))
+            self.ink(self.row, 0, line == 0)
+            self.row += 1
+            return 4 + length
+
+        raise ValueError("JetFab: unknown command ESC 0x%02x" % (code))
+
+    # Expand an encoded line, given the line before it
+    def expand(self, data, prev):
+        mode = data[0]
+        args = data[1:]
+
+        if mode == 0:
+            return bytearray(args)
+        elif mode == 1:
+            bits = []
+            for run in args:
+                bits += [run >> 7] * (run & 0x7f)
+            return bytearray(numpy.packbits(numpy.array(bits, dtype=numpy.uint8)))
+        elif mode == 8:
+            line = bytearray()
+            for i in range(0, len(args), 2):
+                line += bytearray([args[i+1]]) * args[i]
+            return line
+        elif mode == 254:
+            line = bytearray(prev)
+            for i in range(0, len(args), 2):
+                if args[i] >= len(line):
+                    line += bytearray([0xff]) * (args[i] + 1 - len(line))
+                line[args[i]] = args[i+1]
+            return line
+        elif mode == 255:
+            return bytearray(prev)
+
+        raise ValueError("JetFab: unknown line mode %d" % (mode))
+
+# Sinks of the fabrication systems
+SINKS = {'brundle': GCodeSink,
+         'tmc600': EscpSink,
+         'posjet': JetFabSink}
+
+# Virtual printer for the fabrication system 'fabtype'
+def sink(fabtype, **kwargs):
+    if fabtype not in SINKS:
+        raise ValueError("%s: no virtual printer" % (fabtype))
+    return SINKS[fabtype](**kwargs)
+
+#  vim: set shiftwidth=4 expandtab: #
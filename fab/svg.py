@@ -0,0 +1,787 @@
+# 
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+# 
+#  Licensed under the MIT License:
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+
+import os
+import re
+import json
+import mmap
+import cairo
+import numpy
+import hashlib
+import tempfile
+
+from xml.dom import minidom
+
+from fab import in2mm, mm2in
+
+# Suffix of the layer index file, kept next to the SVG file
+INDEX_SUFFIX = ".idx"
+
+_SVG_TAG = re.compile(br'<svg\b[^>]*>')
+_G_TAG = re.compile(br'<g\b[^>]*>')
+_Z_ATTR = re.compile(br'\sslic3r:z\s*=\s*"([^"]*)"')
+_ID_ATTR = re.compile(br'\sid\s*=\s*"([^"]*)"')
+
+# Scan an SVG file for its layers, in one pass
+#
+# Returns the index of the file: the start tag of its <svg> element, and
+# the [z_mm, start, end, fingerprint] of each layer, where start and end
+# are the byte range of its <g> element, and the fingerprint is the
+# digest of the contents of the <g> element.
+def scan(path):
+    index = {'root': "<svg>", 'layers': []}
+    if os.path.getsize(path) == 0:
+        return index
+
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    try:
+        root = _SVG_TAG.search(data)
+        if root is not None:
+            index['root'] = root.group(0).decode('latin-1')
+
+        offset = 0
+        while True:
+            group = _G_TAG.search(data, offset)
+            if group is None:
+                break
+            end = data.find(b'</g>', group.end())
+            if end < 0:
+                break
+
+            tag = group.group(0)
+            z = _Z_ATTR.search(tag)
+            if z is not None:
+                # slic3r
+                z_mm = float(z.group(1)) * 1000000
+            else:
+                # repsnapper
+                z_mm = None
+                label = _ID_ATTR.search(tag)
+                if label is not None:
+                    label = label.group(1).split(b':')
+                    if len(label) == 2:
+                        z_mm = float(label[1])
+
+            fingerprint = hashlib.sha1(data[group.end():end]).hexdigest()
+            offset = end + len(b'</g>')
+            index['layers'].append([z_mm, group.start(), offset, fingerprint])
+    finally:
+        data.close()
+
+    return index
+
+# Return the layer index of an SVG file, from the index file next to
+# it if it is up to date, or by scanning the SVG file. With 'persist',
+# a new index is saved next to the SVG file, if possible.
+def layer_index(path, persist = True):
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime]
+    index_path = path + INDEX_SUFFIX
+
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get('stamp') == stamp:
+            return index
+    except (IOError, OSError, ValueError):
+        pass
+
+    index = scan(path)
+    index['stamp'] = stamp
+
+    if persist:
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(index_path)),
+                                             prefix = os.path.basename(index_path) + ".",
+                                             suffix = ".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f)
+            os.rename(temp_path, index_path)
+        except (IOError, OSError):
+            if temp_path is not None and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    return index
+
+# Default simplification tolerance, in dots
+TOLERANCE_DOTS = 0.1
+
+# The tolerance must stay under half a dot: a dot only changes when the
+# outline moves across its centre, and the centre of a dot that the
+# outline does not pass through is at least half a dot away from it.
+# Only the dots on the outline may change.
+MAX_TOLERANCE_DOTS = 0.5
+
+# Decimals of the fractions of a dot of the layer shift
+SHIFT_PRECISION = 6
+
+# Douglas-Peucker simplification of a closed ring of points, dropping
+# the points closer than 'tolerance' to the simplified outline
+def simplify(points, tolerance = 0.0):
+    count = len(points)
+    if count <= 4 or tolerance <= 0:
+        return points
+
+    # Split the ring at the point furthest from the first point
+    ring = numpy.concatenate((points, points[0:1]))
+    far = int(numpy.argmax(((points - points[0]) ** 2).sum(axis = 1)))
+    if far == 0:
+        return points
+
+    keep = numpy.zeros(count + 1, dtype=bool)
+    keep[0] = keep[far] = keep[count] = True
+
+    spans = [(0, far), (far, count)]
+    while len(spans) > 0:
+        a, b = spans.pop()
+        if b - a < 2:
+            continue
+
+        # Distance of the inner points to the a-b chord
+        chord = ring[b] - ring[a]
+        inner = ring[a+1:b] - ring[a]
+        length = numpy.hypot(chord[0], chord[1])
+        if length == 0:
+            distance = numpy.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distance = numpy.abs(chord[0] * inner[:, 1] - chord[1] * inner[:, 0]) / length
+
+        i = int(numpy.argmax(distance))
+        if distance[i] > tolerance:
+            i += a + 1
+            keep[i] = True
+            spans.append((a, i))
+            spans.append((i, b))
+
+    simple = ring[keep][:-1]
+    if len(simple) < 3:
+        return points
+
+    return simple
+
+# Total area of a list of rings of points, by the shoelace formula
+def rings_area(rings):
+    if len(rings) == 0:
+        return 0.0
+
+    points = numpy.concatenate(rings)
+    lengths = numpy.array([len(ring) for ring in rings])
+    starts = numpy.cumsum(lengths) - lengths
+
+    # Index of the next point of each point, around its ring
+    following = numpy.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+
+    x = points[:, 0]
+    y = points[:, 1]
+    cross = x * y[following] - x[following] * y
+    return float(numpy.abs(numpy.add.reduceat(cross, starts)).sum() / 2)
+
+class SVGRender(object):
+    """ SVG Rendering helpers """
+
+    # The layers come either from a parsed 'xml' document, or from the
+    # SVG file 'path', through its layer index. Layers of an indexed file
+    # are only parsed when they are used.
+    def __init__(self, xml = None, path = None, persist = True):
+        self._svg = xml
+        self._path = path
+        self._dpi = [300] * 2
+        self._size = [200] * 2
+        self._shift = [0] * 2
+        self._z = []
+        self._polygons = {}
+        self._outlines = {}
+        self._areas = {}
+        self._rasters = {}
+        self._tolerance = TOLERANCE_DOTS
+
+        # fab.arena.Arena of the strip surfaces, if any
+        self.arena = None
+
+        # Vertex counts, before and after simplification
+        self.vertices_in = 0
+        self.vertices_out = 0
+
+        if xml is None:
+            index = layer_index(path, persist = persist)
+            self._root = index['root'].encode('latin-1')
+            for z_mm, start, end, fingerprint in index['layers']:
+                self._z.append((z_mm, (start, end), fingerprint))
+        else:
+            for layer in self._svg.getElementsByTagName("g"):
+                self._z.append((self._group_z(layer), layer, self._group_fingerprint(layer)))
+
+        # Sort by Z
+        self._z.sort(key = lambda z: z[0])
+
+        self._count_repeats()
+        pass
+
+    # Count the number of later layers sharing the fingerprint of
+    # each layer
+    def _count_repeats(self):
+        self._repeats = [0] * len(self._z)
+        self._fingerprints = {}
+        for layer in range(len(self._z) - 1, -1, -1):
+            fingerprint = self._z[layer][2]
+            self._repeats[layer] = self._fingerprints.get(fingerprint, 0)
+            self._fingerprints[fingerprint] = self._repeats[layer] + 1
+        pass
+
+    # Determine Z value of a layer of the SVG
+    def _group_z(self, svg_layer):
+        z_mm = None
+        if svg_layer.hasAttribute("slic3r:z"):
+            # slic3r
+            z_mm = float(svg_layer.getAttribute("slic3r:z")) * 1000000
+        else:
+            # repsnapper
+            label = svg_layer.getAttribute("id").split(':')
+            if len(label) != 2:
+                return
+            z_mm = float(label[1])
+        return z_mm
+
+    # Digest of the polygons of a layer of the SVG
+    def _group_fingerprint(self, svg_layer):
+        digest = hashlib.sha1()
+        for poly in svg_layer.getElementsByTagName("polygon"):
+            for attr in ("slic3r:type", "fill", "points"):
+                digest.update(poly.getAttribute(attr).encode())
+                digest.update(b"\000")
+        return digest.hexdigest()
+
+    # Return the <g> element of a layer, parsing it from its byte range
+    # of the SVG file if needed
+    def _group(self, layer = 0):
+        group = self._z[layer][1]
+        if not isinstance(group, tuple):
+            return group
+
+        start, end = group
+        with open(self._path, "rb") as f:
+            f.seek(start)
+            fragment = f.read(end - start)
+
+        # The start tag of the <svg> element declares the namespaces
+        xml = minidom.parseString(self._root + fragment + b'</svg>')
+        return xml.getElementsByTagName("g")[0]
+
+    # Layers with the same fingerprint have identical polygons
+    def fingerprint(self, layer = 0):
+        return self._z[layer][2]
+
+    # Number of layers after 'layer' with the same fingerprint
+    def repeats(self, layer = 0):
+        return self._repeats[layer]
+
+    # Number of layers that duplicate an earlier layer
+    def duplicates(self):
+        return len(self._z) - len(self._fingerprints)
+
+    def z_mm(self, layer = 0):
+        if layer >= len(self._z):
+            return self._z[len(self._z)-1][0]
+        else:
+            return self._z[layer][0]
+
+    def height_mm(self, layer = 0):
+        z_mm = self.z_mm(layer)
+        if layer == 0:
+            height_mm = z_mm
+        else:
+            height_mm = z_mm - self._z[layer-1][0]
+        return height_mm
+
+    # Return number of layers
+    def layers(self):
+        return len(self._z)
+
+    def _surface_cache_flush(self):
+        self._rasters = {}
+        pass
+
+    def _any2mm(self, ref = None, mm = None, inch = None):
+        if inch is not None:
+            mm = [ in2mm(x) for x in inch]
+            pass
+
+        if mm is not None:
+            changed = False
+            for i in range(0, 2):
+                if mm[i] is not None and mm[i] > 0:
+                    ref[i] = mm[i]
+                    changed = True
+                    pass
+                pass
+            return changed
+
+        return False
+
+    # Return the size, in mm. The cached rasters are not clipped to
+    # the bed, so they survive a change of size.
+    def size_mm(self, mm = None, inch = None):
+        self._any2mm(ref = self._size, mm = mm, inch = inch)
+
+        return tuple(self._size)
+
+    # Return the size, in dots
+    def size(self):
+        return tuple([int(mm2in(self._size[i])*self._dpi[i]) for i in range(0,2)])
+
+    # Return the shift of the layers on the bed, in mm. The cached
+    # rasters only depend on the fraction of a dot of the shift, so
+    # moving the layers by whole dots reuses them.
+    def offset_mm(self, mm = None, inch = None):
+        self._any2mm(ref = self._shift, mm = mm, inch = inch)
+
+        return tuple(self._shift)
+
+    # Set up the resolution in dpi
+    def resolution(self, dpi = None):
+        if self._any2mm(ref = self._dpi, mm = dpi):
+            self._surface_cache_flush()
+
+        return tuple(self._dpi)
+
+    # Set up the simplification tolerance, in dots, under
+    # MAX_TOLERANCE_DOTS
+    def tolerance(self, dots = None):
+        if dots is not None and not (0 <= dots < MAX_TOLERANCE_DOTS):
+            raise ValueError("simplification tolerance of %g dots, must be under %g" %
+                             (dots, MAX_TOLERANCE_DOTS))
+        if dots is not None and dots != self._tolerance:
+            self._tolerance = dots
+            self._surface_cache_flush()
+
+        return self._tolerance
+
+    # Return the layer shift in dots, as the ([x, y] whole dots,
+    # [x, y] fractions of a dot). The fractions are rounded to
+    # SHIFT_PRECISION, so that repositioned layers share their rasters.
+    def _shift_dots(self):
+        whole = [0] * 2
+        frac = [0.0] * 2
+        for i in range(0, 2):
+            dots = mm2in(self._shift[i]) * self._dpi[i]
+            whole[i] = int(numpy.floor(dots))
+            frac[i] = round(dots - whole[i], SHIFT_PRECISION)
+            if frac[i] >= 1.0:
+                whole[i] += 1
+                frac[i] = 0.0
+        return (whole, frac)
+
+    def _draw_path(self, cr, points):
+        cr.move_to(points[0][0], points[0][1])
+        for point in points[1:]:
+            cr.line_to(point[0], point[1])
+        cr.close_path()
+
+    # Return the (contours, holes) of a layer, as lists of
+    # numpy (N, 2) arrays of points in mm
+    def polygons(self, layer = 0):
+        z_mm, svg, fingerprint = self._z[layer]
+
+        # Layers with identical polygons share the same point arrays
+        polygons = self._polygons.get(fingerprint)
+        if polygons is not None:
+            return polygons
+
+        svg = self._group(layer)
+
+        contours = []
+        holes = []
+        for poly in svg.getElementsByTagName("polygon"):
+            if poly.hasAttribute("slic3r:type"):
+                # slic3r
+                mode = poly.getAttribute("slic3r:type")
+                if mode == 'contour':
+                    ring = contours
+                elif mode == 'hole':
+                    ring = holes
+                else:
+                    continue
+            elif poly.hasAttribute("fill"):
+                fill = poly.getAttribute("fill")
+                if fill == 'black':
+                    ring = contours
+                elif fill == 'white':
+                    ring = holes
+                else:
+                    continue
+            else:
+                continue
+
+            p = poly.getAttribute("points").replace(',', ' ').split()
+            points = numpy.array(p, dtype=numpy.float64)
+            points = numpy.reshape(points[0:len(points)//2*2], (-1, 2))
+            if len(points) > 0:
+                ring.append(points)
+
+        polygons = (contours, holes)
+        self._polygons[fingerprint] = polygons
+
+        return polygons
+
+    # Return the (contours, holes) of a layer, simplified to the
+    # tolerance at the current resolution
+    def outlines(self, layer = 0):
+        z_mm, svg, fingerprint = self._z[layer]
+
+        tolerance = in2mm(self._tolerance / max(self._dpi))
+        key = (fingerprint, tolerance)
+        outlines = self._outlines.get(key)
+        if outlines is not None:
+            return outlines
+
+        contours, holes = self.polygons(layer)
+        outlines = ([simplify(ring, tolerance) for ring in contours],
+                    [simplify(ring, tolerance) for ring in holes])
+
+        for before, after in zip(contours + holes, outlines[0] + outlines[1]):
+            self.vertices_in += len(before)
+            self.vertices_out += len(after)
+
+        self._outlines[key] = outlines
+        return outlines
+
+    # Return the ink coverage of a layer, as a boolean numpy array of
+    # the cells of a grid, starting at 'origin' (in mm), with
+    # 'cells' (columns, rows) of 'pitch_mm'. A cell is inked if its
+    # centre is inside the polygons, by the even-odd rule.
+    def _coverage(self, layer, origin, pitch_mm, cells):
+        columns, rows = cells
+        spans = numpy.zeros((rows, columns + 1), dtype=numpy.int32)
+
+        contours, holes = self.polygons(layer)
+        rings = contours + holes
+        if len(rings) > 0:
+            start = (numpy.concatenate(rings) - origin) / pitch_mm - 0.5
+            end = numpy.concatenate([numpy.roll(ring, -1, axis = 0) for ring in rings])
+            end = (end - origin) / pitch_mm - 0.5
+
+            # Rows whose centre line crosses each edge
+            lo = numpy.ceil(numpy.minimum(start[:, 1], end[:, 1])).astype(int)
+            hi = numpy.ceil(numpy.maximum(start[:, 1], end[:, 1])).astype(int)
+            count = hi - lo
+            edge = numpy.repeat(numpy.arange(len(start)), count)
+            row = lo[edge] + numpy.arange(len(edge)) - numpy.repeat(numpy.cumsum(count) - count, count)
+
+            # Crossing points, sorted along each row
+            x0, y0 = start[edge, 0], start[edge, 1]
+            x1, y1 = end[edge, 0], end[edge, 1]
+            x = x0 + (row - y0) * (x1 - x0) / (y1 - y0)
+            order = numpy.lexsort((x, row))
+            row = row[order]
+            x = numpy.clip(numpy.ceil(x[order]), 0, columns).astype(int)
+
+            # Each pair of crossings of a row bounds an inked span
+            numpy.add.at(spans, (row[0::2], x[0::2]), 1)
+            numpy.add.at(spans, (row[1::2], x[1::2]), -1)
+
+        return numpy.cumsum(spans, axis = 1)[:, 0:columns] > 0
+
+    # Merge the runs of consecutive layers whose cross sections differ
+    # by at most 'tolerance' of their area, into layers up to 'max_mm'
+    # thick. Each merged layer has the polygons of the bottom layer of
+    # its run, and the Z of the top layer. The cross sections are
+    # compared by the area of their XOR on a grid of 'pitch_mm' cells,
+    # by default the dots of the layers at the current resolution and
+    # offset: a coarser grid misses the changes smaller than its cells.
+    #
+    # Returns the number of layers removed.
+    def merge(self, max_mm = 0.0, tolerance = 0.02, pitch_mm = None):
+        if max_mm <= 0 or len(self._z) < 2:
+            return 0
+
+        rings = []
+        for layer in range(0, len(self._z)):
+            contours, holes = self.polygons(layer)
+            rings += contours
+        if len(rings) == 0:
+            return 0
+
+        points = numpy.concatenate(rings)
+        origin = points.min(axis = 0)
+        if pitch_mm is None:
+            # The grid of the dots of the bed, see _render()
+            whole, frac = self._shift_dots()
+            scale = numpy.array([mm2in(1.0) * self._dpi[i] for i in range(0, 2)])
+            shift = numpy.array(whole) + numpy.array(frac)
+            pitch_mm = 1.0 / scale
+            origin = (numpy.floor(origin * scale + shift) - shift) / scale
+        cells = (numpy.ceil((points.max(axis = 0) - origin) / pitch_mm) + 1).astype(int)
+
+        merged = [self._z[0]]
+        bottom_mm = 0.0
+        base = self._coverage(0, origin, pitch_mm, cells)
+        for layer in range(1, len(self._z)):
+            z_mm, svg, fingerprint = self._z[layer]
+
+            if fingerprint == merged[-1][2]:
+                coverage = base
+                change = 0
+            else:
+                coverage = self._coverage(layer, origin, pitch_mm, cells)
+                change = numpy.count_nonzero(base ^ coverage)
+
+            if z_mm - bottom_mm <= max_mm and change <= tolerance * numpy.count_nonzero(base):
+                merged[-1] = (z_mm, merged[-1][1], merged[-1][2])
+            else:
+                bottom_mm = merged[-1][0]
+                merged.append(self._z[layer])
+                base = coverage
+            pass
+
+        removed = len(self._z) - len(merged)
+        self._z = merged
+        self._count_repeats()
+
+        return removed
+
+    # Return the (x, y) extent of the polygons of all the layers, in mm,
+    # from the bed origin
+    def extent_mm(self):
+        extent = numpy.zeros(2)
+        for layer in range(0, len(self._z)):
+            contours, holes = self.polygons(layer)
+            for ring in contours:
+                extent = numpy.maximum(extent, ring.max(axis = 0))
+
+        return tuple(extent + self.offset_mm())
+
+    # Return the inked area of a layer, in mm^2
+    def area_mm2(self, layer = 0):
+        z_mm, svg, fingerprint = self._z[layer]
+
+        area = self._areas.get(fingerprint)
+        if area is None:
+            contours, holes = self.polygons(layer)
+            area = rings_area(contours) - rings_area(holes)
+            self._areas[fingerprint] = area
+
+        return area
+
+    # Return the (x, y, w, h) bounding box of the polygons of a layer,
+    # in dots, shifted by the fractions of a dot 'frac' only, and not
+    # clipped to the bed
+    def _extent(self, layer, frac):
+        contours, holes = self.polygons(layer)
+        if len(contours) == 0:
+            return (0, 0, 0, 0)
+
+        points = numpy.concatenate(contours)
+
+        box = []
+        for i in range(0, 2):
+            scale = mm2in(1.0) * self._dpi[i]
+            lo = int(numpy.floor(points[:, i].min() * scale + frac[i]))
+            hi = int(numpy.ceil(points[:, i].max() * scale + frac[i]))
+            box.append((lo, hi - lo))
+
+        return (box[0][0], box[1][0], box[0][1], box[1][1])
+
+    # Clip the (x, y, w, h) dot rectangle to the bed
+    def _clip(self, x, y, w, h):
+        dot = self.size()
+        x0 = min(max(x, 0), dot[0])
+        y0 = min(max(y, 0), dot[1])
+        x1 = min(max(x + w, x0), dot[0])
+        y1 = min(max(y + h, y0), dot[1])
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    # Return the (x, y, w, h) bounding box of a layer, in dots,
+    # clipped to the bed
+    def bbox(self, layer = 0):
+        whole, frac = self._shift_dots()
+        x, y, w, h = self._extent(layer, frac)
+        if w == 0 or h == 0:
+            return (0, 0, 0, 0)
+
+        return self._clip(x + whole[0], y + whole[1], w, h)
+
+    # Return the fab.Raster of a layer, cropped to the bounding box
+    # of its polygons
+    def raster(self, layer = 0):
+        z_mm, svg, fingerprint = self._z[layer]
+        whole, frac = self._shift_dots()
+
+        # Layers with identical polygons share the same raster, and
+        # layers shifted by whole dots only move its origin. The raster
+        # is rendered in the frame of the fraction of a dot of the shift.
+        key = (fingerprint, tuple(self._dpi), tuple(frac), self._tolerance)
+        raster = self._rasters.get(key)
+        if raster is None:
+            x, y, w, h = self._extent(layer, frac)
+            if w == 0 or h == 0:
+                raster = Raster()
+            else:
+                raster = self._render(layer, x + whole[0], y + whole[1], w, h)
+                raster.x -= whole[0]
+                raster.y -= whole[1]
+
+            # Update the raster cache
+            self._rasters[key] = raster
+
+        if raster.empty():
+            return raster
+
+        x, y, w, h = self._clip(raster.x + whole[0], raster.y + whole[1], raster.w, raster.h)
+        if w == 0 or h == 0:
+            return Raster()
+
+        return Raster(x = x, y = y, w = w, h = h, surface = raster.surface,
+                      origin = (raster.origin[0] + x - raster.x - whole[0],
+                                raster.origin[1] + y - raster.y - whole[1]))
+
+    # Return the fab.Raster of the bed rows y .. y + lines - 1 of a layer,
+    # cropped to the bounding box of its polygons. Strips are not cached.
+    #
+    # With an arena, the strips of all the layers are rendered into
+    # surfaces of the width of the bed from the arena, and must be
+    # released when done.
+    def strip(self, layer = 0, y = 0, lines = 1):
+        x, y_box, w, h = self.bbox(layer)
+        lo = max(y, y_box)
+        hi = min(y + lines, y_box + h)
+        if w == 0 or hi <= lo:
+            return Raster()
+
+        if self.arena is None:
+            return self._render(layer, x, lo, w, hi - lo)
+
+        surface = self.arena.surface(self.size()[0], lines)
+        raster = self._render(layer, x, lo, w, hi - lo, surface = surface)
+        raster.arena = self.arena
+        return raster
+
+    # Rasterize the (x, y, w, h) dot rectangle of a layer, into a new
+    # surface, or at the origin of the reused 'surface'
+    def _render(self, layer, x, y, w, h, surface = None):
+        contours, holes = self.outlines(layer)
+        whole, frac = self._shift_dots()
+
+        if surface is None:
+            # Create a new cairo surface, covering only the rectangle
+            surface = cairo.ImageSurface(cairo.FORMAT_A8, w, h)
+            cr = cairo.Context(surface)
+        else:
+            # Clear the rectangle of the reused surface, and keep
+            # the drawing in it
+            cr = cairo.Context(surface)
+            cr.rectangle(0, 0, w, h)
+            cr.clip()
+            cr.set_operator(cairo.OPERATOR_CLEAR)
+            cr.paint()
+            cr.set_operator(cairo.OPERATOR_OVER)
+        cr.set_antialias(cairo.ANTIALIAS_NONE)
+
+        # Move the rectangle to the surface origin, and the layer to
+        # its place on the bed
+        cr.translate(whole[0] + frac[0] - x, whole[1] + frac[1] - y)
+
+        # Scale from mm to dots
+        cr.scale(mm2in(1.0) * self._dpi[0], mm2in(1.0) * self._dpi[1])
+
+        # Draw all the rings as one path, filled by the even-odd rule:
+        # the holes clear the contours around them, and the islands in
+        # the holes are filled again
+        cr.set_fill_rule(cairo.FILL_RULE_EVEN_ODD)
+        for ring in contours + holes:
+            self._draw_path(cr, ring)
+        cr.fill()
+
+        # Emit the image
+        surface.flush()
+
+        return Raster(x = x, y = y, w = w, h = h, surface = surface)
+
+class Raster(object):
+    """ Layer raster, cropped to the bounding box of the layer """
+
+    def __init__(self, x = 0, y = 0, w = 0, h = 0, surface = None, origin = (0, 0),
+                 arena = None):
+        # Origin of the raster on the bed, in dots
+        self.x = x
+        self.y = y
+        # Size of the raster, in dots
+        self.w = w
+        self.h = h
+        # cairo.ImageSurface of the raster, or None if empty
+        self.surface = surface
+        # Origin of the raster in the surface, in dots
+        self.origin = origin
+        # fab.arena.Arena the surface belongs to, if any
+        self.arena = arena
+        pass
+
+    def empty(self):
+        return self.surface is None
+
+    # Give the surface back to its arena
+    def release(self):
+        if self.arena is not None and self.surface is not None:
+            self.arena.release(self.surface)
+            self.surface = None
+        pass
+
+    # Return the (h, w) uint8 image of the raster
+    def image(self):
+        if self.surface is None:
+            return numpy.zeros((0, 0), dtype=numpy.uint8)
+
+        stride = self.surface.get_stride()
+        image = numpy.frombuffer(self.surface.get_data(), dtype=numpy.uint8)
+        image = numpy.reshape(image, (self.surface.get_height(), stride))
+        x, y = self.origin
+        return image[y:y + self.h, x:x + self.w]
+
+    # Return the (lines, width) boolean ink map of the bed rows
+    # y .. y + lines - 1, in 'out' if given. Everything outside of the
+    # raster is empty.
+    def rows(self, y = 0, lines = 1, width = 0, out = None):
+        if out is None:
+            band = numpy.zeros((lines, width), dtype=bool)
+        else:
+            band = out
+            band[:] = False
+
+        y0 = max(y, self.y)
+        y1 = min(y + lines, self.y + self.h)
+        x0 = max(0, self.x)
+        x1 = min(width, self.x + self.w)
+        if y0 < y1 and x0 < x1:
+            image = self.image()
+            numpy.greater(image[y0 - self.y:y1 - self.y, x0 - self.x:x1 - self.x], 0,
+                          out = band[y0 - y:y1 - y, x0:x1])
+
+        return band
+
+#  vim: set shiftwidth=4 expandtab: # 
@@ -53,6 +53,13 @@ class Fab(fab.Fab):
     def size_mm(self):
         return (BED_X, BED_Y, BED_Z)
 
+    def dpi(self):
+        return (DPI_X, DPI_Y)
+
+    # Accomodate the 5mm hardware left margin
+    def margin_mm(self):
+        return (5.0, 0.0)
+
     def send_esc(self, code = None, data = None):
         if data is None:
             data = b''
@@ -72,9 +79,6 @@ class Fab(fab.Fab):
         pass
 
     def prepare(self, svg = None, name = None, config = None):
-        # Accomodate the 5mm hardware left margin
-        config['x_shift_mm'] += 5.0
-
         super(Fab, self).prepare(svg = svg, name = name, config = config)
 
         # Do any start-of-day initialization here
@@ -105,13 +109,12 @@ class Fab(fab.Fab):
         # Enable graphics mode
         self.send_escp(b'G', b'\001')
 
-        # Set resolution
-        svg.resolution(dpi = (DPI_X, DPI_Y))
+        # Set resolution, see dpi()
         dots_h, dots_v = svg.size()
         unit = 1440
-        page = unit / DPI_Y
-        vertical = unit / DPI_Y
-        horizontal = unit / DPI_X
+        page = unit // DPI_Y
+        vertical = unit // DPI_Y
+        horizontal = unit // DPI_X
         self.send_escp(b'U', struct.pack("<BBBH", page, vertical, horizontal, unit))
 
         self.margin_left = int(fab.mm2in(BED_X_MARGIN_LEFT) * DPI_X)
@@ -127,39 +130,98 @@ class Fab(fab.Fab):
         self.send_escp(b'c', struct.pack("<LL", self.margin_top, self.margin_top + dots_v))
         pass
 
+    # 'raster' is the (lines, bwidth) numpy uint8 bitmap of a band
+    #
+    # The ESC i commands of the band are built once in arena buffers,
+    # and only their color changes from one color to the next.
     def _render_lines(self, raster = None, microweave = False):
         lines = len(raster)
-        bwidth = len(raster[0])
 
         if lines == 0:
             return
 
+        bwidth = len(raster[0])
+
         if microweave:
-            bitmap = bytearray([]).join([raster[i] for i in range(0, lines, 2)])
-            weaved = bytearray([]).join([raster[i] for i in range(1, lines, 2)])
-            lines //= 2
+            halves = [(0x00, raster[0::2]), (0x40, raster[1::2])]
         else:
-            bitmap = bytearray([]).join(raster)
+            halves = [(0x00, raster)]
 
         cmode = 0
         bpp = 2 # 2 bits/pixel
 
-        for color in [2, 1, 4]:
-            cmd = struct.pack("<BBBHH", color, cmode, bpp, bwidth, lines )
-            if self.margin_left > 0:
-                self.send_escp(b'$', struct.pack("<L", self.margin_left))
-
-            self.send_esc(b'i', cmd + bitmap)
+        commands = []
+        for index, (weave, bitmap) in enumerate(halves):
+            command = self.arena.array('esc_i%d' % (index), (9 + bitmap.size,), dtype=numpy.uint8)
+            struct.pack_into("<BBBBBHH", command, 0, 0x1b, ord('i'), 0, cmode, bpp, bwidth, len(bitmap))
+            command[9:].reshape(bitmap.shape)[:] = bitmap
+            commands.append((weave, command))
 
-            if microweave:
-                self.send_escp(b'$', struct.pack("<L", self.margin_left))
-                cmd = struct.pack("<BBBHH", color | 0x40, cmode, bpp, bwidth, lines )
-                self.send_esc(b'i', cmd + weaved)
+        for color in [2, 1, 4]:
+            for weave, command in commands:
+                if weave or self.margin_left > 0:
+                    self.send_escp(b'$', struct.pack("<L", self.margin_left))
+                command[2] = color | weave
+                self.send(code = memoryview(command))
 
             self.send(code = b'\r')
             pass
         pass
 
+    def _render_layer(self, layer = 0):
+        h_dots, v_dots = self.svg.size()
+
+        # Got to the top margin
+        advance = self.margin_top
+
+        # Render the lines...
+        lines = 180
+        for y, image in self.bands(layer, lines, h_dots):
+            # .. in groups of 180, skipping over the blank groups
+            # with a single vertical advance
+            if y + lines > v_dots:
+                break
+            if image is None or not image.any():
+                advance += lines
+                continue
+
+            self.send_escp(b'v', struct.pack("<L", advance))
+            advance = lines
+
+            # Make into a 2-bit representation, in whole bytes
+            bwidth = (2 * h_dots + 7) // 8
+            dots = self.arena.array('dots', (lines, bwidth * 8), dtype=bool)
+            dots[:, 0:2*h_dots:2] = image
+            dots[:, 1:2*h_dots:2] = image
+            dots[:, 2*h_dots:] = False
+
+            self._render_lines(self.arena.packbits(dots, 'packed'), microweave = True)
+            pass
+
+        self.send(code = b'\x0c')
+        pass
+
+    # Estimate the size of the ink commands of a layer, assuming that
+    # every band overlapping the layer has ink
+    def ink_bytes(self, layer = 0):
+        h_dots, v_dots = self.svg.size()
+        x, y, w, h = self.svg.bbox(layer)
+
+        lines = 180
+        bands = 0
+        if w > 0 and h > 0:
+            bands = len(range(y - y % lines, min(y + h, v_dots - v_dots % lines), lines))
+
+        # Each color is sent as two half bands, for the microweave
+        bwidth = (2 * h_dots + 7) // 8
+        image = 2 + 7 + (lines // 2) * bwidth
+        margin = 0
+        if self.margin_left > 0:
+            margin = 9
+        color = margin + image + 9 + image + 1
+
+        return bands * (9 + 3 * color) + 1
+
     def render(self, layer = 0):
         config = self.config
         z_delta_mm = self.svg.height_mm(layer)
@@ -174,39 +236,10 @@ class Fab(fab.Fab):
             pass
 
         if config['do_layer']:
-            h_dots, v_dots = self.svg.size()
-
             self.send("5. Move pen to start of the part bin")
             self.send("6. Ink the layer")
 
-            surface = self.svg.surface(layer)
-            stride = surface.get_stride()
-            image = numpy.frombuffer(surface.get_data(), dtype=numpy.uint8)
-            image = numpy.reshape(image, (v_dots, stride))
-            image = numpy.greater(image, 0)
-            # Make into a 2-bit representation
-            image = numpy.repeat(image, 2, axis=-1)
-            image = numpy.packbits(image, axis=-1)
-
-            # Got to the top margin
-            self.send_escp(b'v', struct.pack("<L", self.margin_top))
-
-            # Render the lines...
-            lines = 180
-            last_y = 0
-            for y in range(0, v_dots//lines):
-                # .. in groups of 180
-                if y > 0:
-                    self.send_escp(b'v', struct.pack("<L", lines))
-                raster = [bytearray(image[y*lines + l]) for l in range(0, lines)]
-
-                self._render_lines(raster, microweave = True)
-                last_y = y*(lines + 1)
-                pass
-
-            lines = v_dots - last_y
-            raster = [bytearray(image[last_y]) for l in range(0, lines)]
-            self.send(code = b'\x0c')
+            self.ink(layer, self._render_layer)
             pass
 
         self.send("7. Retract recoating blade to start of the Feed Bin")
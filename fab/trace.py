@@ -0,0 +1,183 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Binary trace logs
+#
+# A trace records every (comment, code) sent by a fab.Fab, tagged with
+# the layer being printed, without formatting anything:
+#
+#   MAGIC                   8 bytes
+#   header length           <I
+#   header                  JSON: backend, name
+#   records                 RECORD, then the comment and the code
+#
+# The records of Fab.prepare() and Fab.finish() have the PROLOGUE and
+# EPILOGUE layers. The decoder pretty-prints a trace:
+#
+# Usage: python -m fab.trace [--layer N] TRACEFILE
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import json
+import struct
+import getopt
+
+MAGIC = b'FABTRC\000\001'
+
+# layer, comment length, code length
+RECORD = struct.Struct("<iII")
+
+PROLOGUE = -1
+EPILOGUE = -2
+
+# Bytes of records buffered between writes
+BUFFER = 1 << 20
+
+class TraceWriter(object):
+    """ Buffered binary trace writer, used as the log of a fab.Fab """
+
+    def __init__(self, f, backend = None, name = None):
+        self.f = f
+        # Layer of the following records
+        self.layer = PROLOGUE
+
+        header = json.dumps({'backend': backend, 'name': name}, sort_keys = True).encode()
+        self._buffer = bytearray(MAGIC)
+        self._buffer += struct.pack("<I", len(header))
+        self._buffer += header
+        pass
+
+    def record(self, comment = None, code = None):
+        if comment is None:
+            comment = b''
+        else:
+            comment = comment.encode()
+        if code is None:
+            code = b''
+
+        buffer = self._buffer
+        buffer += RECORD.pack(self.layer, len(comment), len(code))
+        buffer += comment
+        buffer += code
+        if len(buffer) >= BUFFER:
+            self.flush()
+        pass
+
+    def flush(self):
+        self.f.write(self._buffer)
+        del self._buffer[:]
+        pass
+
+    def close(self):
+        self.flush()
+        self.f.close()
+        pass
+
+class TraceReader(object):
+    """ Binary trace reader """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._data = f.read()
+
+        if self._data[0:len(MAGIC)] != MAGIC:
+            raise ValueError("%s: not a trace file" % (path))
+
+        offset = len(MAGIC)
+        length, = struct.unpack_from("<I", self._data, offset)
+        offset += 4
+        self.header = json.loads(self._data[offset:offset+length].decode())
+        self._offset = offset + length
+        pass
+
+    # Yield the (layer, comment, code) records of the trace
+    def records(self):
+        data = self._data
+        offset = self._offset
+        while offset < len(data):
+            layer, comment, code = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            yield (layer,
+                   data[offset:offset+comment].decode(),
+                   data[offset+comment:offset+comment+code])
+            offset += comment + code
+        pass
+
+# Printable form of a command: text as it is, and everything else
+# as escapes
+def describe(code):
+    text = []
+    for c in bytearray(code):
+        if c == 0x0a:
+            text.append("\n")
+        elif 0x20 <= c < 0x7f and c != 0x5c:
+            text.append(chr(c))
+        elif c == 0x1b:
+            text.append("\\033")
+        else:
+            text.append("\\x%02x" % (c))
+    return "".join(text).rstrip("\n")
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], "", ["layer="])
+
+    only = None
+    for o, a in opts:
+        if o == "--layer":
+            only = int(a)
+
+    if len(args) != 1:
+        print("Usage: python -m fab.trace [--layer N] TRACEFILE", file=sys.stderr)
+        sys.exit(1)
+
+    trace = TraceReader(args[0])
+    print("# %s: %s" % (trace.header['backend'], trace.header['name']))
+
+    last = None
+    for layer, comment, code in trace.records():
+        if only is not None and layer != only:
+            continue
+        if layer != last:
+            if layer == PROLOGUE:
+                print("## Prologue")
+            elif layer == EPILOGUE:
+                print("## Epilogue")
+            else:
+                print("## Layer %d" % (layer))
+            last = layer
+        if len(comment) > 0:
+            print("# %s" % (comment))
+        if len(code) > 0:
+            print(describe(code))
+        pass
+    pass
+
+if __name__ == "__main__":
+    main()
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,207 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Ink volume of a whole job
+#
+# The layers of a job are rasterized into one bit-packed array of
+# (layers, rows, bytes), the bed rows of each layer packed 8 dots to
+# the byte, memory mapped from a file so that it may be larger than
+# memory. Layers are rasterized on first use, a strip at a time, and
+# layers with identical polygons are copied from the first of them.
+#
+# The whole-job reductions run over a few layers at a time.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import tempfile
+
+import numpy
+
+import fab
+
+# Bytes of the volume scanned at once by the reductions
+CHUNK_BYTES = 64 << 20
+
+# Number of set bits of each byte
+_POPCOUNT = numpy.array([bin(i).count("1") for i in range(0, 256)], dtype=numpy.uint8)
+
+class Volume(object):
+    """ Bit-packed ink volume of a job, memory mapped from a file """
+
+    # The volume covers the layers of 'svg' at its current resolution,
+    # in the file 'path', or in a temporary file
+    def __init__(self, svg = None, path = None):
+        self.svg = svg
+        w_dots, h_dots = svg.size()
+        self.width = w_dots
+        self.shape = (svg.layers(), h_dots, (w_dots + 7) // 8)
+
+        self._temp = None
+        if path is None:
+            self._temp = tempfile.NamedTemporaryFile(prefix = "volume-")
+            path = self._temp.name
+        self.path = path
+
+        self.bits = numpy.memmap(path, dtype=numpy.uint8, mode="w+", shape=self.shape)
+        self.filled = numpy.zeros((self.shape[0]), dtype=bool)
+        self._first = {}
+        pass
+
+    def layers(self):
+        return self.shape[0]
+
+    # Rasterize a layer into the volume, if it is not already
+    def fill(self, layer = 0):
+        if self.filled[layer]:
+            return
+
+        svg = self.svg
+        fingerprint = svg.fingerprint(layer)
+        first = self._first.get(fingerprint)
+        if first is not None:
+            self.bits[layer] = self.bits[first]
+            self.filled[layer] = True
+            return
+
+        x, y, w, h = svg.bbox(layer)
+        if w > 0 and h > 0:
+            svg.outlines(layer)
+            lines = fab.STRIP_LINES
+            for top in range(y - y % lines, y + h, lines):
+                height = min(lines, self.shape[1] - top)
+                if height <= 0:
+                    break
+                out = None
+                if svg.arena is not None:
+                    out = svg.arena.array('volume', (height, self.width), dtype=bool)
+                strip = svg.strip(layer, top, height)
+                band = strip.rows(top, height, self.width, out = out)
+                strip.release()
+                self.bits[layer, top:top+height] = numpy.packbits(band, axis=-1)
+
+        self._first[fingerprint] = layer
+        self.filled[layer] = True
+        pass
+
+    # Rasterize all the layers not rasterized yet
+    def fill_all(self):
+        for layer in range(0, self.shape[0]):
+            self.fill(layer)
+        pass
+
+    # Return the (lines, width) boolean ink map of the bed rows
+    # y .. y + lines - 1 of a layer, in 'out' if given, as Raster.rows()
+    def rows(self, layer = 0, y = 0, lines = 1, width = 0, out = None):
+        self.fill(layer)
+
+        if out is None:
+            band = numpy.zeros((lines, width), dtype=bool)
+        else:
+            band = out
+            band[:] = False
+        y1 = min(y + lines, self.shape[1])
+        x1 = min(width, self.width)
+        if y < y1 and x1 > 0:
+            bits = numpy.unpackbits(self.bits[layer, y:y1], axis=-1)
+            band[0:y1-y, 0:x1] = bits[:, 0:x1]
+        return band
+
+    # Yield the (first, bits) of the layers, a few layers at a time
+    def _chunks(self):
+        self.fill_all()
+        layers = max(CHUNK_BYTES // max(self.shape[1] * self.shape[2], 1), 1)
+        for first in range(0, self.shape[0], layers):
+            yield (first, self.bits[first:first+layers])
+        pass
+
+    # Number of inked dots of each layer
+    def dots(self):
+        dots = numpy.zeros((self.shape[0]), dtype=numpy.int64)
+        for first, bits in self._chunks():
+            counts = _POPCOUNT[bits].sum(axis=(1, 2), dtype=numpy.int64)
+            dots[first:first+len(counts)] = counts
+        return dots
+
+    # The (x, y, w, h) dot bounding box of the ink of each layer, as a
+    # (layers, 4) array, all zero for layers without ink
+    def extents(self):
+        extents = numpy.zeros((self.shape[0], 4), dtype=numpy.int64)
+        for first, bits in self._chunks():
+            # Ink of each row, and ink of each column over all the rows
+            rows = bits.any(axis=2)
+            columns = numpy.unpackbits(numpy.bitwise_or.reduce(bits, axis=1), axis=-1)
+            columns = columns[:, 0:self.width] > 0
+            for i in range(0, len(bits)):
+                y = numpy.flatnonzero(rows[i])
+                x = numpy.flatnonzero(columns[i])
+                if len(y) > 0:
+                    extents[first+i] = (x[0], y[0], x[-1] + 1 - x[0], y[-1] + 1 - y[0])
+        return extents
+
+    # For each layer, the first layer with an identical raster
+    def duplicates(self):
+        first = numpy.arange(self.shape[0])
+        seen = {}
+        for start, bits in self._chunks():
+            for i in range(0, len(bits)):
+                digest = hashlib.sha1(bits[i]).digest()
+                first[start+i] = seen.setdefault(digest, start + i)
+        return first
+
+    # Dictionary of the ink usage of the whole job
+    def usage(self):
+        dots = self.dots()
+        extents = self.extents()
+        duplicates = self.duplicates()
+
+        inked = numpy.flatnonzero(dots)
+        extent = [0, 0, 0, 0]
+        if len(inked) > 0:
+            boxes = extents[inked]
+            x0 = boxes[:, 0].min()
+            y0 = boxes[:, 1].min()
+            x1 = (boxes[:, 0] + boxes[:, 2]).max()
+            y1 = (boxes[:, 1] + boxes[:, 3]).max()
+            extent = [int(x0), int(y0), int(x1 - x0), int(y1 - y0)]
+
+        return {'layers': self.shape[0],
+                'dots': int(dots.sum()),
+                'inked': len(inked),
+                'duplicates': int(numpy.count_nonzero(duplicates != numpy.arange(self.shape[0]))),
+                'extent': extent,
+                'bytes': int(self.bits.size)}
+
+    def close(self):
+        self.bits.flush()
+        self.bits = None
+        if self._temp is not None:
+            self._temp.close()
+            self._temp = None
+        pass
+
+#  vim: set shiftwidth=4 expandtab: #
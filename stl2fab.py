@@ -28,11 +28,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
 import sys
+import json
+import time
 import getopt
+import shutil
+import hashlib
 import tempfile
 import subprocess
-from xml.dom import minidom
 
 import fab
 
@@ -40,12 +44,20 @@ def usage():
     print("""
 svg2brundlefab [options] sourcefile.stl >sourcefile.gcode
 svg2brundlefab [options] --svg sourcefile.svg >sourcefile.gcode
+svg2brundlefab [options] sourcefile.stl sourcefile.stl ...
+svg2brundlefab [options] --manifest=FILE
 
   -h, --help            This help
 
 Input conversion:
   --svg                 Treat input as a SVG file
+  --svg-index           Keep a layer index next to each SVG file, so that
+                        it opens without being read again
   -s, --slicer=SLICER   Select a slicer ('repsnapper' or 'slic3r')
+  --slicer-bin=PATH     Run PATH as the slicer program
+  --shards=N            Cut STL parts into N shards along Z, and slice
+                        the shards with N slicer processes at once
+                        (slic3r only)
 
 Transformation:
   --units=in            Assume model was in inches
@@ -53,36 +65,111 @@ Transformation:
   --scale N             Scale object (before offsetting)
   --x-offset N          Add a X offset (in mm) to the layers
   --y-offset N          Add a Y offset (in mm) to the layers
+  --adaptive=N          Merge consecutive layers whose cross section
+                        barely changes into layers up to N mm thick
+  --adaptive-tolerance=F
+                        Largest change of the cross section of merged
+                        layers, as a fraction of its area (default 0.02)
+  --simplify=N          Drop outline points closer than N dots to the
+                        simplified outline (default 0.1, 0 disables,
+                        under 0.5)
 
 Output:
   -f, --fab=SYSTEM      Fabrication system (brundle, posjet)
+  --dry-run             Print an estimate of the job (volume, ink, powder,
+                        and output size) from the layer outlines alone,
+                        without generating the printer commands
+  --volume=FILE         Rasterize the job into one bit-packed volume of
+                        all its layers, memory mapped from FILE, for the
+                        backends to encode from, and print its ink usage
+
+Batch mode (more than one source file, or a manifest):
+  --manifest=FILE       Read source files from FILE, one per line
+  --output-dir=DIR      Directory for the 'sourcefile.SYSTEM' outputs
+                        (default: next to each source file)
+  -j, --jobs=N          Number of worker processes (default: one per CPU)
+  --cache-dir=DIR       Directory of sliced SVGs, shared by all the jobs
+
+Job server:
+  --daemon=SOCKET       Serve jobs on the Unix socket SOCKET, using -j
+                        worker threads. The command line options are the
+                        defaults for the submitted jobs.
+  --sink-dir=DIR        Directory for the outputs of the served jobs
+  --submit=SOCKET       Submit the source files to the server on SOCKET,
+                        and write the printer commands to stdout. Only
+                        the print options may be given with them, not
+                        the slicer program, nor the output files.
+  --priority=N          Priority of the submitted jobs (lower runs first)
+  --status=SOCKET       Print the queue and job latencies of a server
+
+Printer farm:
+  --printer=NAME:SYSTEM:DEVICE[:XxY]
+                        Add a printer of fabrication system SYSTEM, whose
+                        commands are appended to DEVICE (a port, a pty, or
+                        a file), with a bed of X by Y mm (default: the bed
+                        of the system). With printers, the source files
+                        are scheduled on the first free printer that can
+                        print them, and all the printers run at once.
+
+Compiled job:
+  --job=FILE            Write a compiled job file (per-layer indexed, see
+                        'python -m fab.jobfile') instead of to stdout
+  --job-compress        Compress the layers of the compiled job file
+
+Loopback:
+  --loopback=BAUD[:BUFFER]
+                        Print to a virtual printer of the fabrication
+                        system, linked at BAUD bits/s (0 for no limit)
+                        with a device buffer of BUFFER bytes (default
+                        4096). The printer decodes the commands back into
+                        the inked dots, and reports their digest, and the
+                        link throughput and stalls. The commands are
+                        still written to stdout.
 
 Debug:
-  --log=LOGFILE         Annotated logfile of the emitted commands
-  -p, --png             Generate 'layer-XXX.png' files, one for each layer
+  --log=LOGFILE         Binary trace of the emitted commands, see
+                        'python -m fab.trace LOGFILE'
+  -p, --png             Generate 'layer-XXX.png' thumbnails, one for each layer
+  --png-scale=N         Downsample the thumbnails by N (default 4)
+  --png-sheet=FILE      Generate a contact sheet of all the layers
 
 BrundleFab Specific
 ===================
 
 Fuser control:
   --fuser-temp N        Temperature of the fuser (at heat shield), in C.
+  --fuser-margin N      Fuse N mm (default 10) beyond the inked area of
+                        each layer, instead of the whole Part Bin
+  --fuser-preheat       Heat the fuser during inking, instead of after
+                        it, and only wait for the rest of its warm-up
+                        time, from the estimated inking time (off by
+                        default)
 
 GCode output:
+  --terse               Generate the shortest GCode: no trailing zeros,
+                        no repeated G0/G1 or unchanged feed rates
   -G, --no-gcode        Do not generate any GCode (assumes S, E, and L)
   -S, --no-startup      Do not generate GCode startup code
   -L, --no-layer        Do not generate layer inking commands
   -W, --no-weave        Do not generate interweave commands
+  --serpentine          Plan the inking: ink each band in the direction
+                        closest to the ink head, over its inked span only
+  --no-serpentine       Ink every band in the same direction, with a
+                        fixed return pass (the default)
   -F, --no-fuser        Do not generate fuser commands
   -E, --no-extrude      Do not generate E or Z axis commands
 
 """)
     pass
 
-def main(out = None, log = None):
+# Return the default job configuration
+def default_config():
     config = {}
 
     config['gcode_terse'] = False
     config['fuser_temp'] = 0.0      # Celsius
+    config['fuser_margin_mm'] = 10.0
+    config['fuser_preheat'] = False
     config['sprays'] = 6            # Sprays per pixel
     config['x_bound_mm'] = 200.0
     config['y_bound_mm'] = 200.0
@@ -90,14 +177,29 @@ def main(out = None, log = None):
     config['y_shift_mm'] = 0.0
     config['z_slice_mm'] = 0.5
     config['scale'] = 1.0
+    config['simplify_dots'] = 0.1   # Dots
+    config['adaptive_mm'] = 0.0     # Off
+    config['adaptive_tolerance'] = 0.02
     config['do_png'] = False
+    config['png_prefix'] = "layer-"
+    config['png_scale'] = 4
+    config['png_sheet'] = None
     config['do_gcode'] = True
     config['do_startup'] = True
     config['do_layer'] = True
     config['do_fuser'] = True
     config['do_extrude'] = True
     config['do_weave'] = True
+    config['do_serpentine'] = False
     config['slicer'] = 'slic3r'
+    config['slicer_bin'] = None
+    config['shards'] = 1
+    config['svg_index'] = False
+    config['volume'] = None
+    return config
+
+def main(out = None, log = None):
+    config = default_config()
 
     unit = {}
     unit['mm'] = 1.0
@@ -110,20 +212,49 @@ def main(out = None, log = None):
 
     logfile = None
 
+    manifest = None
+    output_dir = None
+    jobs = None
+    cache_dir = None
+
+    jobfile = None
+    job_compress = False
+
+    dry_run = False
+
+    loopback = None
+
+    printers = []
+
+    daemon = None
+    sink_dir = None
+    submit = None
+    priority = 0
+
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "EFGhLf:o:ps:SW", [
+        opts, args = getopt.getopt(sys.argv[1:], "EFGhLf:j:o:ps:SW", [
                 "help",
                 "no-gcode","no-startup","no-extrude","no-fuser","no-layer",
                 "png","fab=", "log=",
-                "slicer=","svg","units=",
+                "slicer=","slicer-bin=","shards=","svg","units=",
                 "x-offset=","y-offset=","z-slice=","scale=",
                 "no-weave","overspray=",
-                "fuser-temp="])
+                "fuser-temp=",
+                "manifest=","output-dir=","jobs=","cache-dir=",
+                "daemon=","sink-dir=","printer=","submit=","priority=","status=",
+                "job=","job-compress",
+                "png-scale=","png-sheet=",
+                "serpentine","no-serpentine","fuser-margin=","fuser-preheat",
+                "simplify=","dry-run","loopback=","volume=","svg-index","adaptive=","adaptive-tolerance=","terse"])
     except getopt.GetoptError as err:
         print(err)
         usage()
         sys.exit(2)
 
+    # Remember the options given, for the jobs submitted to a server
+    config = Options(config)
+    submit_fab = None
+
     for o, a in opts:
         if o in ("-h", "--help"):
             usage()
@@ -140,14 +271,31 @@ def main(out = None, log = None):
             config['do_gcode'] = False
         elif o in ("-W","--no-weave"):
             config['do_weave'] = False
+        elif o in ("--terse"):
+            config['gcode_terse'] = True
+        elif o in ("--serpentine"):
+            config['do_serpentine'] = True
+        elif o in ("--no-serpentine"):
+            config['do_serpentine'] = False
         elif o in ("-p","--png"):
             config['do_png'] = True
+        elif o in ("--png-scale"):
+            config['png_scale'] = int(a)
+        elif o in ("--png-sheet"):
+            config['png_sheet'] = a
         elif o in ("-s","--slicer"):
             config['slicer'] = a
+        elif o in ("--slicer-bin"):
+            config['slicer_bin'] = a
+        elif o in ("--shards"):
+            config['shards'] = int(a)
         elif o in ("--svg"):
             config['slicer'] = 'svg'
+        elif o in ("--svg-index"):
+            config['svg_index'] = True
         elif o in ("-f","--fab"):
             fabtype = a
+            submit_fab = a
         elif o in ("--log"):
             logfile = a
         elif o in ("--x-offset"):
@@ -158,10 +306,56 @@ def main(out = None, log = None):
             config['z_slice_mm'] = float(a) * unit[units]
         elif o in ("--scale"):
             config['scale'] = float(a)
+        elif o in ("--adaptive"):
+            config['adaptive_mm'] = float(a) * unit[units]
+        elif o in ("--adaptive-tolerance"):
+            config['adaptive_tolerance'] = float(a)
+        elif o in ("--simplify"):
+            config['simplify_dots'] = float(a)
+            # Simplifying by half a dot or more changes whole dots
+            if not (0 <= config['simplify_dots'] < 0.5):
+                usage()
+                sys.exit(1)
         elif o in ("-o","--overspray"):
             config['sprays'] = int(a)
         elif o in ("--fuser-temp"):
             config['fuser_temp'] = float(a)
+        elif o in ("--fuser-preheat"):
+            config['fuser_preheat'] = True
+        elif o in ("--fuser-margin"):
+            config['fuser_margin_mm'] = float(a) * unit[units]
+        elif o in ("--manifest"):
+            manifest = a
+        elif o in ("--output-dir"):
+            output_dir = a
+        elif o in ("-j","--jobs"):
+            jobs = int(a)
+        elif o in ("--cache-dir"):
+            cache_dir = a
+        elif o in ("--dry-run"):
+            dry_run = True
+        elif o in ("--volume"):
+            config['volume'] = a
+        elif o in ("--loopback"):
+            loopback = [int(v) for v in a.split(":")]
+        elif o in ("--job"):
+            jobfile = a
+        elif o in ("--job-compress"):
+            job_compress = True
+        elif o in ("--daemon"):
+            daemon = a
+        elif o in ("--printer"):
+            printers.append(a)
+        elif o in ("--sink-dir"):
+            sink_dir = a
+        elif o in ("--submit"):
+            submit = a
+        elif o in ("--priority"):
+            priority = int(a)
+        elif o in ("--status"):
+            from fab.server import request
+            print(json.dumps(request(a, {'op': 'status'}), indent = 2))
+            sys.exit(0)
         elif o in ("--units"):
             if not units in unit:
                 usage()
@@ -170,72 +364,707 @@ def main(out = None, log = None):
         else:
             assert False, ("unhandled option: %s" % o)
 
-    if len(args) != 1:
+    if manifest is not None:
+        with open(manifest) as f:
+            args += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    if units != 'mm':
+        config['scale'] = config['scale'] * unit[units]
+
+    given = config.given()
+    config = dict(config)
+
+    if not config['slicer'] in ("slic3r", "repsnapper", "svg"):
         usage()
         sys.exit(1)
 
-    config['scale'] = config['scale'] * unit[units]
+    if daemon is not None:
+        run_daemon(daemon, fabtype = fabtype, config = config, jobs = jobs,
+                   sink_dir = sink_dir, cache_dir = cache_dir)
+        return
+
+    if len(args) == 0:
+        usage()
+        sys.exit(1)
+
+    if submit is not None:
+        from fab.server import request
+        for source in args:
+            # The server defaults apply to the options not given
+            reply = request(submit, {'op': 'submit',
+                                     'source': os.path.abspath(source),
+                                     'fab': submit_fab,
+                                     'config': given,
+                                     'priority': priority,
+                                     'stream': True}, out = out)
+            if reply.get('state') != 'done':
+                print("%s: FAILED: %s" % (source, reply.get('error')), file=sys.stderr)
+                sys.exit(1)
+            print("%s: %d layers, %d bytes, %.2fs latency" %
+                  (source, reply['layers'], reply['bytes'], reply['latency']), file=sys.stderr)
+        return
+
+    if len(printers) > 0:
+        run_farm(args, printers, config = config, cache_dir = cache_dir)
+        return
+
+    if dry_run:
+        for source in args:
+            try:
+                estimate_job(source, fabtype = fabtype, config = config,
+                             cache_dir = cache_dir)
+            except subprocess.CalledProcessError as err:
+                sys.exit(err.returncode)
+        return
+
+    if len(args) > 1 or manifest is not None:
+        run_batch(args, fabtype = fabtype, config = config, jobs = jobs,
+                  output_dir = output_dir, cache_dir = cache_dir,
+                  logfile = logfile)
+        return
+
+    if logfile:
+        from fab.trace import TraceWriter
+        log = TraceWriter(open(logfile, "wb"), backend = fabtype, name = args[0])
+    else:
+        log = None
+
+    sink = None
+    if loopback is not None:
+        from fab.sink import sink as virtual_printer
+        buffer = None
+        if len(loopback) > 1:
+            buffer = loopback[1]
+        sink = virtual_printer(fabtype, baud = loopback[0], buffer = buffer)
+
+    try:
+        stats = run_job(args[0], out = out, log = log, fabtype = fabtype,
+                        config = config, cache_dir = cache_dir,
+                        jobfile = jobfile, job_compress = job_compress,
+                        sink = sink)
+    except subprocess.CalledProcessError as err:
+        sys.exit(err.returncode)
+    finally:
+        if log is not None:
+            log.close()
+
+    print("Deduplicated %d of %d layers" % (stats['deduplicated'], stats['layers']), file=sys.stderr)
+
+    if sink is not None:
+        report = stats['sink']
+        print("Loopback: %d layers, %d dots inked, digest %s" %
+              (report['layers'], report['dots'], report['digest']), file=sys.stderr)
+        print("Loopback: %d bytes in %.2fs, %.0f bytes/s, stalled %.2fs" %
+              (report['bytes'], report['seconds'], report['rate'], report['stalled']),
+              file=sys.stderr)
+    pass
+
+class Options(dict):
+    """ Job configuration, remembering the keys set after its defaults """
+
+    def __init__(self, defaults = None):
+        super(Options, self).__init__(defaults)
+        self._given = set()
+        pass
+
+    def __setitem__(self, key, value):
+        self._given.add(key)
+        super(Options, self).__setitem__(key, value)
+        pass
+
+    # Dictionary of the keys set
+    def given(self):
+        return dict([(key, self[key]) for key in self._given])
+
+class Output(object):
+    """ Output stream wrapper, counting the bytes written """
 
-    temp_svg = tempfile.NamedTemporaryFile()
+    def __init__(self, output = None):
+        self.output = output
+        self.bytes = 0
+        pass
+
+    def write(self, data):
+        self.bytes += len(data)
+        if self.output is not None:
+            self.output.write(data)
+        pass
 
+def slicer_args(config, source, svg_file):
     if config['slicer'] == "slic3r":
-        slicer_args = ["slic3r",
-                            "--export-svg",
-                            "--output", temp_svg.name,
-                            "--first-layer-height", str(config['z_slice_mm']),
-                            "--layer-height", str(config['z_slice_mm']),
-                            "--nozzle-diameter", str(config['z_slice_mm']),
-                            "--scale", str(config['scale']),
-                            args[0]]
+        return [config.get('slicer_bin') or "slic3r",
+                "--export-svg",
+                "--output", svg_file,
+                "--first-layer-height", str(config['z_slice_mm']),
+                "--layer-height", str(config['z_slice_mm']),
+                "--nozzle-diameter", str(config['z_slice_mm']),
+                "--scale", str(config['scale']),
+                source]
     elif config['slicer'] == "repsnapper":
-        slicer_args = ["repsnapper",
-                            "-t",
-                            "-i", args[0],
-                            "--svg", temp_svg.name]
-    elif config['slicer'] == "svg":
-        slicer_args = None
-    else:
-        usage()
-        sys.exit(1)
+        return [config.get('slicer_bin') or "repsnapper",
+                "-t",
+                "-i", source,
+                "--svg", svg_file]
+    return None
 
-    # Slice STL/AMF into SVG
-    if slicer_args == None:
+# Slice STL/AMF into SVG
+#
+# Returns the (svg_file, tempfile) of the sliced source. The tempfile,
+# if any, must be kept open for as long as the svg_file is in use.
+#
+# With a 'cache_dir', the sliced SVG is kept there, keyed on the source
+# contents and the slicer arguments, so that repeated sources are only
+# sliced once.
+def slice_source(source, config, cache_dir = None):
+    if slicer_args(config, source, "") is None:
         # User gave us an SVG file instead of STL
-        svg_file = args[0]
-    else:
+        return (source, None)
+
+    if cache_dir is None:
+        temp_svg = tempfile.NamedTemporaryFile()
         # Break the STL into layers
-        rc = subprocess.call(slicer_args, stdout=sys.stderr)
-        if rc != 0:
-            sys.exit(rc)
+        slice_file(source, temp_svg.name, config)
+        return (temp_svg.name, temp_svg)
 
-        # Parse the SVG file
-        svg_file = temp_svg.name
+    digest = hashlib.sha1()
+    digest.update(repr(slicer_args(config, "", "")).encode())
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    svg_file = os.path.join(cache_dir, digest.hexdigest() + ".svg")
 
-    # Parse milti-layer SVG file
-    svg = fab.SVGRender(xml = minidom.parse(svg_file))
+    if not os.path.exists(svg_file):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Slice into a private file, so concurrent jobs never see
+        # a partially written SVG
+        fd, temp_file = tempfile.mkstemp(dir = cache_dir, prefix = digest.hexdigest() + ".",
+                                         suffix = ".svg")
+        os.close(fd)
+        try:
+            slice_file(source, temp_file, config)
+            os.rename(temp_file, svg_file)
+        except:
+            os.unlink(temp_file)
+            raise
 
-    if logfile:
-        log = open(logfile, "w")
+    return (svg_file, None)
+
+# Slice a source file into the SVG file 'svg_file'
+def slice_file(source, svg_file, config):
+    if (config.get('shards', 1) > 1 and config['slicer'] == "slic3r" and
+        source.lower().endswith(".stl")):
+        slice_shards(source, svg_file, config)
     else:
-        log = None
+        subprocess.check_call(slicer_args(config, source, svg_file), stdout=sys.stderr)
+    pass
+
+# Slice an STL file in Z shards, with one slicer process per shard
+#
+# Each shard is cut out of the part with 'slic3r --cut', at whole
+# layers, and sliced. The slicer runs are processes of their own, so a
+# pool of threads only waits on them, and works in the daemonic workers
+# of run_batch() too, which can't have child processes of Python's own.
+# Their layers are merged back in Z order, see fab.shard.
+def slice_shards(source, svg_file, config):
+    # Only sharded slicing pays for importing multiprocessing
+    from multiprocessing.pool import ThreadPool
+    from fab import shard
+
+    layer_mm = config['z_slice_mm']
+    scale = config['scale']
+    lo, hi = shard.stl_extent(source)
+    cuts = shard.cuts((hi[2] - lo[2]) * scale, config['shards'], layer_mm)
+    if len(cuts) == 0:
+        subprocess.check_call(slicer_args(config, source, svg_file), stdout=sys.stderr)
+        return
+
+    workdir = tempfile.mkdtemp(prefix = "stl2fab-shards-")
+    try:
+        # The (first, last) mm of each shard, from the bottom of the part
+        bounds = list(zip([0.0] + cuts, cuts + [None]))
+        jobs = [(source, os.path.join(workdir, "shard-%d" % (index)), below, above, config)
+                for index, (below, above) in enumerate(bounds)]
+
+        pool = ThreadPool(processes = len(jobs))
+        try:
+            pieces = pool.map(_slice_shard, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+        shards = []
+        for (shard_svg, piece_lo), (below, above) in zip(pieces, bounds):
+            first = int(round(below / layer_mm))
+            last = None
+            if above is not None:
+                last = int(round(above / layer_mm))
+            shards.append((shard_svg, first, last, below,
+                           (piece_lo[0] - lo[0]) * scale, (piece_lo[1] - lo[1]) * scale))
+
+        shard.merge(shards, svg_file)
+    finally:
+        shutil.rmtree(workdir, ignore_errors = True)
+    pass
+
+# Cut the shard of a part between 'below' and 'above' mm (None for
+# the top of the part), in a directory of its own, and slice it
+#
+# Returns the (svg_file, lower corner) of the shard.
+def _slice_shard(job):
+    source, workdir, below, above, config = job
+    from fab import shard
 
-    printer = fab.fabricator[fabtype].Fab(output = out, log = log)
+    os.makedirs(workdir)
+    slicer = slicer_args(config, "", "")[0]
+    scale = config['scale']
 
-    printer.prepare(svg = svg, name = args[0], config = config)
+    # slic3r cuts the unscaled part, from its own bottom
+    piece = os.path.join(workdir, "part.stl")
+    shutil.copyfile(source, piece)
+    if below > 0:
+        subprocess.check_call([slicer, "--cut", "%.9g" % (below / scale), piece],
+                              stdout=sys.stderr)
+        piece = piece + "_upper.stl"
+    if above is not None:
+        subprocess.check_call([slicer, "--cut", "%.9g" % ((above - below) / scale), piece],
+                              stdout=sys.stderr)
+        piece = piece + "_lower.stl"
 
-    for layer in range(0, printer.layers()):
+    shard_svg = os.path.join(workdir, "shard.svg")
+    subprocess.check_call(slicer_args(config, piece, shard_svg), stdout=sys.stderr)
+    return (shard_svg, shard.stl_extent(piece)[0])
+
+# Slice a source file, and load its layers
+#
+# Returns the (svg, tempfile) of the source, see slice_source().
+def load_svg(source, config, cache_dir = None, verbose = True):
+    svg_file, temp_svg = slice_source(source, config, cache_dir = cache_dir)
+
+    # Index the multi-layer SVG file. Sliced SVGs in the cache keep
+    # their layer index, to open instantly the next time.
+    persist = config['svg_index'] or (temp_svg is None and svg_file != source)
+    svg = fab.SVGRender(path = svg_file, persist = persist)
+    svg.tolerance(dots = config['simplify_dots'])
+
+    return (svg, temp_svg)
+
+# Merge the layers of 'svg' into adaptive layers, when configured, on
+# the dots that 'printer' will render them on
+def merge_layers(svg, printer, config, verbose = True):
+    if config['adaptive_mm'] <= 0:
+        return
+
+    printer.layout(svg = svg, config = config)
+
+    layers = svg.layers()
+    removed = svg.merge(max_mm = config['adaptive_mm'],
+                        tolerance = config['adaptive_tolerance'])
+    if verbose:
+        print("Adaptive layers: %d layers merged into %d" % (layers, layers - removed), file=sys.stderr)
+    pass
+
+# Convert one source file, writing the printer commands to 'out', or
+# to the compiled job file 'jobfile'. With a 'sink', a fab.sink.Sink,
+# the commands go through the virtual printer on their way to 'out'.
+# With 'svg', the layers of the source already returned by load_svg(),
+# the source is not loaded again.
+#
+# Returns a dictionary of job statistics.
+def run_job(source, out = None, log = None, fabtype = 'brundle', config = None,
+            cache = None, cache_dir = None, verbose = True,
+            jobfile = None, job_compress = False, sink = None, svg = None):
+    start = time.time()
+
+    # The backends may adjust the config, so keep our own copy
+    config = dict(config)
+
+    temp_svg = None
+    if svg is None:
+        svg, temp_svg = load_svg(source, config, cache_dir = cache_dir, verbose = verbose)
+
+    if sink is not None:
+        sink.output = out
+        out = sink
+
+    output = Output(out)
+    printer = fab.fabricator[fabtype].Fab(output = output, log = log, cache = cache)
+    merge_layers(svg, printer, config, verbose = verbose)
+
+    writer = None
+    if jobfile is not None:
+        from fab.jobfile import JobWriter
+        writer = JobWriter(open(jobfile, "wb"), backend = fabtype,
+                           name = source, config = config,
+                           size_mm = list(printer.size_mm()),
+                           layers = svg.layers(),
+                           compress = job_compress)
+        if sink is not None:
+            sink.output = writer
+        else:
+            output.output = writer
+
+    printer.prepare(svg = svg, name = source, config = config)
+
+    if sink is not None:
+        sink.width = svg.size()[0]
+
+    volume = None
+    if config['volume'] is not None:
+        from fab.volume import Volume
+        volume = Volume(svg, path = config['volume'])
+        printer.volume = volume
+
+    preview = None
+    if config['do_png'] or config['png_sheet'] is not None:
+        from fab.preview import Preview
+        prefix = None
         if config['do_png']:
-            surface = printer.surface(layer)
-            surface.write_to_png("layer-%03d.png" % layer)
+            prefix = config['png_prefix']
+        preview = Preview(size = svg.size(), scale = config['png_scale'],
+                          prefix = prefix, sheet = config['png_sheet'])
+        printer.preview = preview
 
-        print("Layer %d of %d" % (layer, printer.layers()), file=sys.stderr)
+    layers = printer.layers()
+    first_allocated = printer.arena.allocated
+    for layer in range(0, layers):
+        if writer is not None:
+            writer.segment(z_mm = svg.z_mm(layer))
+
+        if log is not None:
+            log.layer = layer
+
+        if verbose:
+            print("Layer %d of %d" % (layer, layers), file=sys.stderr)
         printer.render(layer = layer)
+
+        # The backend fed the preview with the strips of the layer
+        if preview is not None:
+            preview.done(layer, svg)
+
+        # After the first layer, the arena should have all the
+        # buffers of the job
+        if layer == 0:
+            first_allocated = printer.arena.allocated
+        pass
+
+    if writer is not None:
+        writer.segment()
+
+    if log is not None:
+        from fab.trace import EPILOGUE
+        log.layer = EPILOGUE
+
+    printer.finish()
+
+    if writer is not None:
+        writer.close()
+        writer.f.close()
+
+    if sink is not None:
+        sink.close()
+
+    usage = None
+    if volume is not None:
+        usage = volume.usage()
+        volume.close()
+        if verbose:
+            print("Volume: %d of %d layers inked (%d duplicates), %d dots, extent %dx%d dots at (%d, %d), %d bytes" %
+                  (usage['inked'], usage['layers'], usage['duplicates'], usage['dots'],
+                   usage['extent'][2], usage['extent'][3], usage['extent'][0], usage['extent'][1],
+                   usage['bytes']), file=sys.stderr)
+
+    arena = printer.arena.report()
+    if verbose:
+        print("Arena: %d bytes allocated, %d after the first layer, peak %d bytes in use, "
+              "%d bytes of commands encoded outside of it" %
+              (arena['allocated'], arena['allocated'] - first_allocated, arena['peak'],
+               arena['encoded']), file=sys.stderr)
+
+    if verbose and svg.vertices_in > 0:
+        print("Simplified %d to %d vertices (%.1f%%)" %
+              (svg.vertices_in, svg.vertices_out,
+               100.0 * svg.vertices_out / svg.vertices_in), file=sys.stderr)
+
+    if preview is not None:
+        preview.close()
+        if verbose:
+            print("Preview: %d layers in %.2fs (%d dropped, %d failed)" %
+                  (preview.layers, preview.seconds, preview.dropped, preview.errors),
+                  file=sys.stderr)
+
+    stats = {'source': source,
+             'layers': layers,
+             'deduplicated': printer.deduplicated,
+             'bytes': output.bytes,
+             'seconds': time.time() - start}
+    if sink is not None:
+        stats['sink'] = sink.report()
+    if usage is not None:
+        stats['volume'] = usage
+    stats['arena'] = arena
+    return stats
+
+# Estimate a job from the layer polygons alone, without rasterizing
+# or encoding the layers, and print the estimate
+#
+# Returns a dictionary of job estimates.
+def estimate_job(source, fabtype = 'brundle', config = None, cache_dir = None,
+                 verbose = True):
+    start = time.time()
+
+    config = dict(config)
+
+    svg, temp_svg = load_svg(source, config, cache_dir = cache_dir, verbose = verbose)
+
+    # The layers are not rendered: the backend estimates the size of
+    # their commands. Only the start and the end of the job are
+    # generated, and counted.
+    output = Output(None)
+    printer = fab.fabricator[fabtype].Fab(output = output)
+    merge_layers(svg, printer, config, verbose = verbose)
+    printer.prepare(svg = svg, name = source, config = config)
+
+    dpi = svg.resolution()
+    dots_per_mm2 = fab.mm2in(dpi[0]) * fab.mm2in(dpi[1])
+    x_mm, y_mm = svg.size_mm()
+
+    layers = printer.layers()
+    volume_mm3 = 0.0
+    powder_mm3 = 0.0
+    drops = 0
+    layer_bytes = 0
+    for layer in range(0, layers):
+        area_mm2 = svg.area_mm2(layer)
+        height_mm = svg.height_mm(layer)
+        layer_drops = int(area_mm2 * dots_per_mm2) * config['sprays']
+
+        volume_mm3 += area_mm2 * height_mm
+        # The backends feed 1.1 layers of powder for each layer
+        powder_mm3 += x_mm * y_mm * height_mm * 1.1
+        drops += layer_drops
+
+        layer_bytes += printer.layer_bytes(layer)
+        if config['do_layer']:
+            layer_bytes += printer.ink_bytes(layer)
+
+        if verbose:
+            print("Layer %d at %.3fmm: %.2fmm2 inked, %d drops" %
+                  (layer, svg.z_mm(layer), area_mm2, layer_drops))
         pass
 
     printer.finish()
 
+    estimate = {'source': source,
+                'layers': layers,
+                'volume_mm3': volume_mm3,
+                'powder_mm3': powder_mm3,
+                'drops': drops,
+                'bytes': output.bytes + layer_bytes,
+                'seconds': time.time() - start}
+
+    if verbose:
+        print("%s: %d layers, %.1fmm3 part, %d ink drops, %.1fmm3 powder, ~%d bytes (estimated in %.2fs)" %
+              (source, layers, volume_mm3, drops, powder_mm3, estimate['bytes'], estimate['seconds']))
+
+    return estimate
+
+# Per-worker cache of encoded layers, shared by all the jobs of a worker
+_cache = None
+
+def _batch_init():
+    global _cache
+    _cache = fab.Cache()
     pass
 
+def _batch_job(job):
+    source, output, fabtype, config, cache_dir, logfile = job
+
+    log = None
+    if logfile:
+        from fab.trace import TraceWriter
+        log = TraceWriter(open(logfile, "wb"), backend = fabtype, name = source)
+
+    try:
+        with open(output, "wb") as out:
+            stats = run_job(source, out = out, log = log, fabtype = fabtype,
+                            config = config, cache = _cache,
+                            cache_dir = cache_dir, verbose = False)
+        stats['output'] = output
+    except Exception as err:
+        stats = {'source': source, 'error': str(err)}
+    finally:
+        if log is not None:
+            log.close()
+
+    return stats
+
+# Convert many source files on a pool of worker processes
+def run_batch(sources, fabtype = 'brundle', config = None, jobs = None,
+              output_dir = None, cache_dir = None, logfile = None):
+    # Only batch runs pay for importing multiprocessing
+    import multiprocessing
+
+    start = time.time()
+
+    temp_dir = None
+    if cache_dir is None:
+        cache_dir = temp_dir = tempfile.mkdtemp(prefix = "stl2fab-")
+
+    try:
+        batch = []
+        for source in sources:
+            output = "%s.%s" % (os.path.splitext(source)[0], fabtype)
+            if output_dir is not None:
+                output = os.path.join(output_dir, os.path.basename(output))
+            log = None
+            if logfile:
+                log = output + ".log"
+            job_config = dict(config)
+            job_config['png_prefix'] = output + "-layer-"
+            if config['png_sheet'] is not None:
+                job_config['png_sheet'] = output + ".png"
+            if config['volume'] is not None:
+                job_config['volume'] = output + ".volume"
+            batch.append((source, output, fabtype, job_config, cache_dir, log))
+
+        if output_dir is not None and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        pool = multiprocessing.Pool(processes = jobs, initializer = _batch_init)
+
+        done = 0
+        failed = 0
+        layers = 0
+        total = 0
+        for stats in pool.imap_unordered(_batch_job, batch):
+            if 'error' in stats:
+                failed += 1
+                print("%s: FAILED: %s" % (stats['source'], stats['error']), file=sys.stderr)
+                continue
+
+            done += 1
+            layers += stats['layers']
+            total += stats['bytes']
+            print("%s: %d layers (%d deduplicated), %d bytes in %.2fs, %.1f layers/s" %
+                  (stats['output'], stats['layers'], stats['deduplicated'], stats['bytes'],
+                   stats['seconds'], stats['layers'] / max(stats['seconds'], 1e-6)),
+                  file=sys.stderr)
+            pass
+
+        pool.close()
+        pool.join()
+
+        elapsed = max(time.time() - start, 1e-6)
+        print("Batch: %d jobs (%d failed), %d layers, %d bytes in %.2fs, %.2f jobs/s, %.1f layers/s" %
+              (done, failed, layers, total, elapsed, done / elapsed, layers / elapsed),
+              file=sys.stderr)
+
+        if failed > 0:
+            sys.exit(1)
+    finally:
+        # Only remove the cache directory made for this run
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors = True)
+    pass
+
+# Serve jobs on a Unix socket, keeping the backends and caches warm
+def run_daemon(path, fabtype = 'brundle', config = None, jobs = None,
+               sink_dir = None, cache_dir = None):
+    cache = fab.Cache()
+
+    temp_dir = None
+    if cache_dir is None:
+        cache_dir = temp_dir = tempfile.mkdtemp(prefix = "stl2fab-")
+
+    try:
+        if sink_dir is not None and not os.path.isdir(sink_dir):
+            os.makedirs(sink_dir)
+
+        def runner(source, out, fabtype, config):
+            return run_job(source, out = out, fabtype = fabtype, config = config,
+                           cache = cache, cache_dir = cache_dir, verbose = False)
+
+        if jobs is None:
+            jobs = 1
+
+        from fab.server import Server
+        server = Server(path = path, runner = runner, fabtype = fabtype,
+                        config = config, workers = jobs, sink_dir = sink_dir)
+        print("Serving on %s" % (path), file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        # Only remove the cache directory made for this run
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors = True)
+    pass
+
+# Schedule the source files on several printers
+#
+# Each printer is given as 'NAME:SYSTEM:DEVICE[:XxY]'.
+def run_farm(sources, printers, config = None, cache_dir = None):
+    from fab.scheduler import Printer, Scheduler
+
+    temp_dir = None
+    if cache_dir is None:
+        cache_dir = temp_dir = tempfile.mkdtemp(prefix = "stl2fab-")
+
+    try:
+        farm = []
+        for spec in printers:
+            fields = spec.split(":")
+            if len(fields) < 3:
+                print("--printer=%s: expected NAME:SYSTEM:DEVICE[:XxY]" % (spec), file=sys.stderr)
+                sys.exit(1)
+            size_mm = None
+            if len(fields) > 3:
+                size_mm = [float(v) for v in fields[3].split("x")]
+            farm.append(Printer(name = fields[0], fabtype = fields[1],
+                                device = fields[2], size_mm = size_mm))
+
+        def runner(source, out, fabtype, config, cache, svg):
+            return run_job(source, out = out, fabtype = fabtype, config = config,
+                           cache = cache, cache_dir = cache_dir, verbose = False,
+                           svg = svg)
+
+        scheduler = Scheduler(printers = farm, runner = runner,
+                              config = config, cache = fab.Cache())
+        scheduler.start()
+
+        # The sliced SVGs outside of the cache directory, kept open
+        # until their jobs are done
+        temp_svgs = []
+        for source in sources:
+            # The extent of the part, before the shift of the job and the
+            # margin of the printer, picks the printers with a large enough
+            # bed. The job prints the same loaded layers.
+            svg, temp_svg = load_svg(source, config, cache_dir = cache_dir, verbose = False)
+            temp_svgs.append(temp_svg)
+            try:
+                scheduler.submit(source = source, size_mm = svg.extent_mm(), svg = svg)
+            except ValueError as err:
+                print(err, file=sys.stderr)
+            pass
+
+        scheduler.close()
+
+        for job in scheduler.jobs:
+            if job.state != 'done':
+                print("%s: FAILED on %s: %s" % (job.source, job.printer, job.error), file=sys.stderr)
+
+        for entry in scheduler.report():
+            print("%s (%s): %d jobs, %d failed, %d bytes, busy %.2fs of %.2fs (%.0f%%)" %
+                  (entry['printer'], entry['fab'], entry['jobs'], entry['failed'],
+                   entry['bytes'], entry['busy'], entry['elapsed'],
+                   entry['utilization'] * 100), file=sys.stderr)
+    finally:
+        # Only remove the cache directory made for this run
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors = True)
+    pass
 
 if __name__ == "__main__":
     try:
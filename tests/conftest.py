@@ -0,0 +1,110 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Shared helpers of the tests
+#
+# The tests that rasterize layers need pycairo, and skip without it.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import sys
+
+import pytest
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOP not in sys.path:
+    sys.path.insert(0, TOP)
+
+SQUARE = "10,10 30,10 30,30 10,30"
+HOLE = "15,15 25,15 25,25 15,25"
+
+# Four layers of a square with a square hole, the third without the
+# hole, so that layers are both repeated and different
+LAYERS = [[("contour", SQUARE), ("hole", HOLE)],
+          [("contour", SQUARE), ("hole", HOLE)],
+          [("contour", SQUARE)],
+          [("contour", SQUARE), ("hole", HOLE)]]
+
+# Write a Slic3r style SVG of 'layers', each a list of the (type, points)
+# of its polygons, 'z_mm' apart
+def write_svg(path, layers = LAYERS, z_mm = 0.5):
+    with open(path, "w") as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" '
+                'xmlns:slic3r="http://slic3r.org/namespaces/slic3r">\n')
+        for i, polygons in enumerate(layers):
+            f.write('<g id="layer%d" slic3r:z="%.9g">' % (i, (i + 1) * z_mm / 1000000))
+            for kind, points in polygons:
+                f.write('<polygon slic3r:type="%s" points="%s"/>' % (kind, points))
+            f.write('</g>\n')
+        f.write('</svg>\n')
+    return path
+
+@pytest.fixture
+def svg_file(tmp_path):
+    return write_svg(str(tmp_path / "part.svg"))
+
+# Run stl2fab with the command line 'args', returning its output
+@pytest.fixture
+def convert(monkeypatch):
+    def run(*args):
+        import stl2fab
+        out = io.BytesIO()
+        monkeypatch.setattr(sys, "argv", ["stl2fab.py"] + list(args))
+        stl2fab.main(out = out)
+        return out.getvalue()
+    return run
+
+# Return the fab.Fab of 'fabtype' prepared for 'svg_file', with the
+# default config updated by 'options', writing to 'out'
+def prepare(fabtype, svg_file, out = None, **options):
+    import fab
+    import stl2fab
+
+    config = stl2fab.default_config()
+    config['slicer'] = 'svg'
+    config.update(options)
+    svg, temp_svg = stl2fab.load_svg(svg_file, config, verbose = False)
+
+    if out is None:
+        out = io.BytesIO()
+    printer = fab.fabricator[fabtype].Fab(output = stl2fab.Output(out))
+    stl2fab.merge_layers(svg, printer, config, verbose = False)
+    printer.prepare(svg = svg, name = svg_file, config = config)
+    return printer
+
+# Decode the output of a backend through its virtual printer, returning
+# the fab.sink.Sink
+def decode(fabtype, data):
+    from fab.sink import sink
+    printer = sink(fabtype, realtime = False)
+    printer.write(data)
+    printer.close()
+    return printer
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,93 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+
+# Adaptive layers
+#
+# Each merged layer must raster the same as every layer it replaces,
+# within the tolerance of the merge.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import numpy
+import pytest
+
+pytest.importorskip("cairo")
+
+from fab.svg import SVGRender
+
+from conftest import prepare, write_svg
+
+def circle(x, y, r, points = 96):
+    return " ".join(["%.6f,%.6f" % (x + r * math.cos(2 * math.pi * i / points),
+                                    y + r * math.sin(2 * math.pi * i / points))
+                     for i in range(0, points)])
+
+# A ring slowly growing thinner, 0.1mm layers
+LAYERS = [[("contour", circle(30, 30, 20 - 0.05 * i)), ("hole", circle(30, 30, 8 + 0.03 * i))]
+          for i in range(0, 30)]
+
+@pytest.mark.parametrize("tolerance", [0.01, 0.02, 0.05])
+def test_merged_layers(tmp_path, tolerance):
+    path = write_svg(str(tmp_path / "ring.svg"), LAYERS, z_mm = 0.1)
+    layers = SVGRender(path = path)
+    merged = SVGRender(path = path)
+    for svg in (layers, merged):
+        svg.resolution(dpi = (100, 100))
+    assert merged.merge(max_mm = 1.0, tolerance = tolerance) > 0
+
+    w, h = layers.size()
+    layer = 0
+    for index in range(0, merged.layers()):
+        raster = merged.raster(index).rows(0, h, w)
+        assert layers.z_mm(layer) <= merged.z_mm(index)
+        while layer < layers.layers() and layers.z_mm(layer) <= merged.z_mm(index):
+            change = numpy.count_nonzero(raster ^ layers.raster(layer).rows(0, h, w))
+            assert change <= tolerance * numpy.count_nonzero(raster), "layer %d" % (layer)
+            layer += 1
+    assert layer == layers.layers()
+
+# The layers are merged on the dots of the backend, not on the default
+# resolution of the SVG
+@pytest.mark.parametrize("fabtype", ["brundle", "tmc600"])
+def test_merge_resolution(tmp_path, monkeypatch, fabtype):
+    grids = []
+    merge = SVGRender.merge
+    def record(svg, **kwargs):
+        grids.append((svg.resolution(), svg.offset_mm()))
+        return merge(svg, **kwargs)
+    monkeypatch.setattr(SVGRender, "merge", record)
+
+    path = write_svg(str(tmp_path / "ring.svg"), LAYERS, z_mm = 0.1)
+    printer = prepare(fabtype, path, adaptive_mm = 1.0, x_shift_mm = 2.0)
+    assert grids == [(printer.svg.resolution(), printer.svg.offset_mm())]
+    assert grids[0][0] == printer.dpi()
+    assert printer.svg.layers() < len(LAYERS)
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,60 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+
+# Buffer arena
+#
+# The backends pack their bands into arena buffers: from the second
+# layer on, a job should not allocate, and the packing must match
+# numpy.packbits().
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy
+import pytest
+
+pytest.importorskip("cairo")
+
+from fab.arena import Arena
+
+from conftest import prepare
+
+def test_packbits():
+    arena = Arena()
+    bits = numpy.random.RandomState(1).rand(5, 64) < 0.5
+    assert numpy.array_equal(arena.packbits(bits, 'packed'), numpy.packbits(bits, axis=-1))
+
+@pytest.mark.parametrize("fabtype", ["brundle", "posjet", "tmc600"])
+def test_no_allocation_after_first_layer(fabtype, svg_file):
+    printer = prepare(fabtype, svg_file)
+    printer.render(layer = 0)
+    allocated = printer.arena.allocated
+    for layer in range(1, printer.layers()):
+        printer.render(layer = layer)
+    assert printer.arena.allocated == allocated
+
+#  vim: set shiftwidth=4 expandtab: #
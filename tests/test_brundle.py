@@ -0,0 +1,70 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# BrundleFab backend
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pytest
+
+pytest.importorskip("cairo")
+
+from conftest import decode
+
+# The planner inks the same dots as the fixed passes, in either
+# direction, with and without interweave
+@pytest.mark.parametrize("weave", [[], ["-W"]])
+def test_serpentine_inks_same_dots(svg_file, convert, weave):
+    args = ["--svg", "-f", "brundle"] + weave
+    fixed = decode("brundle", convert(*(args + [svg_file]))).report()
+    planned = decode("brundle", convert(*(args + ["--serpentine", svg_file]))).report()
+
+    assert fixed['dots'] > 0
+    assert planned['digest'] == fixed['digest']
+
+# The fuser temperature is set before inking, whatever the planner,
+# and the fuser is not selected again until inking is done
+@pytest.mark.parametrize("planner", ["--serpentine", "--no-serpentine"])
+def test_fuser_preheat(svg_file, convert, planner):
+    gcode = convert("--svg", "-f", "brundle", "--fuser-preheat", "--fuser-temp=150",
+                    planner, svg_file).decode()
+
+    layers = gcode.split("M117 Slice")[1:]
+    assert len(layers) == 4
+    for layer in layers:
+        lines = layer.splitlines()
+        inking = [i for i, line in enumerate(lines)
+                  if line.startswith("T1 P") and line != "T1 P0"]
+        fuser = [i for i, line in enumerate(lines) if line.startswith("T20")]
+        heat = [i for i in fuser if lines[i] == "T20 P155.000 Q145.000"]
+
+        assert len(inking) > 0
+        assert heat[0] < inking[0]
+        assert len([i for i in fuser if i < inking[-1]]) == 1
+        assert "T20 P0 Q0" not in lines[heat[0]:inking[-1]]
+
+#  vim: set shiftwidth=4 expandtab: #
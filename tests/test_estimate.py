@@ -0,0 +1,79 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Job estimate (--dry-run)
+#
+# The estimate must not render the layers, and should be close to the
+# size of the real output.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import pytest
+
+pytest.importorskip("cairo")
+
+import fab
+
+from conftest import LAYERS, write_svg
+
+def circle(x, y, r, points = 48):
+    return " ".join(["%.3f,%.3f" % (x + r * math.cos(2 * math.pi * i / points),
+                                    y + r * math.sin(2 * math.pi * i / points))
+                     for i in range(0, points)])
+
+# The layers of the test part, and a round and a slanted one
+ROUND = LAYERS + [[("contour", circle(30, 30, 20)), ("hole", circle(30, 30, 8))],
+                  [("contour", "5,5 55,12 20,50")]]
+
+@pytest.mark.parametrize("fabtype,terse", [("brundle", False),
+                                           ("brundle", True),
+                                           ("posjet", False),
+                                           ("tmc600", False)])
+def test_estimate(fabtype, terse, tmp_path, convert, monkeypatch):
+    import stl2fab
+
+    svg_file = write_svg(str(tmp_path / "round.svg"), ROUND)
+    options = ["--svg", "-f", fabtype]
+    if terse:
+        options.append("--terse")
+    size = len(convert(*(options + [svg_file])))
+
+    def render(self, layer = 0):
+        raise AssertionError("layer %d rendered" % (layer))
+    monkeypatch.setattr(fab.fabricator[fabtype].Fab, "render", render)
+
+    config = stl2fab.default_config()
+    config['slicer'] = 'svg'
+    config['gcode_terse'] = terse
+    estimate = stl2fab.estimate_job(svg_file, fabtype = fabtype, config = config,
+                                    verbose = False)
+    assert estimate['layers'] == len(ROUND)
+    assert abs(estimate['bytes'] - size) < size * 0.25, (estimate['bytes'], size)
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,115 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Terse G-code round trip
+#
+# The plain and terse outputs are replayed through a G-code interpreter
+# that keeps every command, moves to the current position included:
+# terse output may only drop the words that are still in effect, never
+# a command.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pytest
+
+pytest.importorskip("cairo")
+
+from fab.jobfile import JobReader
+
+# Return the commands of a G-code output, each as the command and the
+# absolute position and feed rate after it, starting from an unknown
+# modal state
+def replay(gcode):
+    position = {}
+    feed = None
+    mode = None
+    relative = False
+
+    commands = []
+    for line in gcode.decode().splitlines():
+        words = line.split()
+        if len(words) == 0:
+            continue
+        if words[0] == "M117":
+            commands.append((line,))
+            continue
+
+        if words[0][0] in "GMT":
+            command = words.pop(0)
+        else:
+            command = mode
+
+        if command in ("G0", "G1"):
+            mode = command
+            axes = [word for word in words if word[0] != "F"]
+            for word in words:
+                axis, value = word[0], float(word[1:])
+                if axis == "F":
+                    # A feed rate alone, and unchanged, is no command
+                    if len(axes) == 0 and value == feed:
+                        break
+                    feed = value
+                elif relative:
+                    position[axis] = round(position.get(axis, 0.0) + value, 6)
+                else:
+                    position[axis] = value
+            else:
+                commands.append((command, tuple(sorted(position.items())), feed))
+        else:
+            if command == "G90":
+                relative = False
+            elif command == "G91":
+                relative = True
+            if command is not None and command[0] == "G":
+                mode = None
+            commands.append((command, tuple([(word[0], float(word[1:])) for word in words])))
+        pass
+
+    return commands
+
+def test_terse_motion(svg_file, convert):
+    plain = convert("--svg", "-f", "brundle", svg_file)
+    terse = convert("--svg", "-f", "brundle", "--terse", svg_file)
+
+    assert len(terse) < len(plain)
+    assert replay(terse) == replay(plain)
+
+def test_terse_layers_self_contained(svg_file, convert, tmp_path):
+    segments = []
+    for args in ([], ["--terse"]):
+        path = str(tmp_path / ("job%d.fab" % len(segments)))
+        convert("--svg", "-f", "brundle", "--job=" + path, *(args + [svg_file]))
+        job = JobReader(path)
+        segments.append([job.layer(layer) for layer in range(0, job.layers())] + [job.epilogue()])
+        job.close()
+
+    plain, terse = segments
+    assert len(plain) == 5
+    for index, (a, b) in enumerate(zip(plain, terse)):
+        assert replay(b) == replay(a), "segment %d" % (index)
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,50 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+
+# Startup imports
+#
+# Importing stl2fab and fab must not load the rasterizer, the backends
+# or the job server; they are imported by the code paths using them.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import subprocess
+import sys
+
+from conftest import TOP
+
+LAZY = ['cairo', 'numpy', 'fab.svg', 'fab.arena', 'fab.brundle', 'fab.posjet',
+        'fab.tmc600', 'fab.server', 'fab.jobfile', 'fab.trace', 'fab.scheduler']
+
+def test_lazy_imports():
+    code = ("import sys, stl2fab\n"
+            "print(' '.join(sorted(set(%r) & set(sys.modules))))" % (LAZY))
+    loaded = subprocess.check_output([sys.executable, "-c", code], cwd = TOP)
+    assert loaded.decode().split() == []
+
+#  vim: set shiftwidth=4 expandtab: #
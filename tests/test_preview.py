@@ -0,0 +1,134 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Layer previews
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import zlib
+import struct
+
+import numpy
+import pytest
+
+pytest.importorskip("cairo")
+
+from conftest import prepare, LAYERS
+
+SCALE = 4
+
+# Read a grayscale PNG written by fab.preview.write_png()
+def read_png(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    offset = 8
+    chunks = {}
+    while offset < len(data):
+        length, = struct.unpack_from(">I", data, offset)
+        kind = data[offset + 4:offset + 8]
+        chunks[kind] = data[offset + 8:offset + 8 + length]
+        offset += 12 + length
+
+    w, h = struct.unpack_from(">II", chunks[b'IHDR'])
+    rows = numpy.frombuffer(zlib.decompress(chunks[b'IDAT']), dtype=numpy.uint8)
+    return rows.reshape((h, w + 1))[:, 1:]
+
+# The thumbnail of a whole layer raster, downsampled at once
+def thumbnail(printer, layer):
+    w, h = printer.svg.size()
+    w = (w + SCALE - 1) // SCALE
+    h = (h + SCALE - 1) // SCALE
+    ink = numpy.zeros((h * SCALE, w * SCALE), dtype=numpy.float32)
+
+    raster = printer.svg.raster(layer)
+    if not raster.empty():
+        ink[raster.y:raster.y + raster.h, raster.x:raster.x + raster.w] = raster.image()
+    ink = ink.reshape(h, SCALE, w, SCALE).mean(axis = (1, 3))
+    return (255 - ink).astype(numpy.uint8)
+
+@pytest.mark.parametrize("fabtype", ["brundle", "posjet", "tmc600"])
+@pytest.mark.parametrize("options", [[], ["-L"], ["--volume"]])
+def test_preview_from_strips(svg_file, convert, tmp_path, monkeypatch, fabtype, options):
+    if options == ["--volume"]:
+        options = ["--volume=" + str(tmp_path / "job.volume")]
+    monkeypatch.chdir(str(tmp_path))
+
+    # Only layers the backend does not rasterize are rasterized again
+    import fab.preview
+    rasterized = []
+    def rasterize(self, layer, svg):
+        rasterized.append(layer)
+        return original(self, layer, svg)
+    original = fab.preview.Preview._rasterize
+    monkeypatch.setattr(fab.preview.Preview, "_rasterize", rasterize)
+
+    convert(*(["--svg", "-f", fabtype, "-p", "--png-scale=%d" % (SCALE)] + options + [svg_file]))
+
+    if options != ["-L"]:
+        assert rasterized == []
+
+    printer = prepare(fabtype, svg_file)
+    for layer in range(0, len(LAYERS)):
+        actual = read_png(os.path.join(str(tmp_path), "layer-%03d.png" % (layer)))
+        expected = thumbnail(printer, layer)
+        assert actual.shape == expected.shape
+        assert numpy.abs(actual.astype(int) - expected).max() <= 1
+        assert expected.min() == 0
+
+# A failing preview is counted, and does not stop the print
+@pytest.mark.parametrize("options", [[], ["--volume"]])
+def test_preview_failure(svg_file, convert, tmp_path, monkeypatch, options):
+    if options == ["--volume"]:
+        options = ["--volume=" + str(tmp_path / "job.volume")]
+    monkeypatch.chdir(str(tmp_path))
+    expected = convert(*(["--svg", "-f", "brundle"] + options + [svg_file]))
+
+    import fab.preview
+    errors = []
+    def strip(self, layer, x, y, image, full = 255):
+        raise RuntimeError("no preview")
+    def error(self, layer, err):
+        errors.append(layer)
+    monkeypatch.setattr(fab.preview.Preview, "strip", strip)
+    monkeypatch.setattr(fab.preview.Preview, "_error", error)
+
+    assert convert(*(["--svg", "-f", "brundle", "-p"] + options + [svg_file])) == expected
+    assert len(errors) > 0
+
+# Preview.strip() counts its own failures
+def test_strip_failure():
+    from fab.preview import Preview
+    preview = Preview(size = (64, 64), scale = SCALE)
+    preview.strip(0, 0, 0, numpy.ones((8,), dtype=bool), full = 1)
+    preview.strip(0, 0, 0, numpy.ones((8, 8), dtype=bool), full = 1)
+    preview.close()
+    assert preview.errors == 1
+    assert preview.seconds > 0
+
+#  vim: set shiftwidth=4 expandtab: #
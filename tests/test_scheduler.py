@@ -0,0 +1,105 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Multi-printer scheduler
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pytest
+
+from fab.scheduler import Printer, Scheduler
+
+from conftest import write_svg
+
+CONFIG = {'x_shift_mm': 0.0, 'y_shift_mm': 0.0,
+          'x_bound_mm': 200.0, 'y_bound_mm': 200.0}
+
+def test_printer_bed():
+    assert Printer(fabtype = 'brundle').size_mm == (150, 200)
+    assert Printer(fabtype = 'posjet').size_mm == (65, 65)
+    assert Printer(fabtype = 'brundle', size_mm = (100, 120)).size_mm == (100, 120)
+
+def test_fits_shifted():
+    posjet = Printer(name = 'p', fabtype = 'posjet')
+    scheduler = Scheduler(printers = [posjet], config = CONFIG)
+
+    job = scheduler.submit(source = "part.svg", size_mm = (60, 60))
+    assert posjet.fits(job)
+
+    config = {'x_shift_mm': 10.0}
+    with pytest.raises(ValueError):
+        scheduler.submit(source = "part.svg", size_mm = (60, 60), config = config)
+
+def test_fits_margin():
+    # The tmc600 shifts the layers by its 5mm left margin
+    tmc600 = Printer(name = 't', fabtype = 'tmc600')
+    scheduler = Scheduler(printers = [tmc600], config = CONFIG)
+
+    width = tmc600.size_mm[0]
+    assert tmc600.fits(scheduler.submit(source = "a.svg", size_mm = (width - 5, 10)))
+    with pytest.raises(ValueError):
+        scheduler.submit(source = "b.svg", size_mm = (width - 4, 10))
+
+def test_bed_bounds_job(tmp_path):
+    seen = []
+    def runner(source, out, fabtype, config, cache, svg):
+        seen.append((fabtype, config['x_bound_mm'], config['y_bound_mm']))
+        return {'bytes': 0}
+
+    printers = [Printer(name = 'b', fabtype = 'brundle', device = str(tmp_path / "b.out")),
+                Printer(name = 'p', fabtype = 'posjet', device = str(tmp_path / "p.out"))]
+    scheduler = Scheduler(printers = printers, runner = runner, config = CONFIG)
+    scheduler.submit(source = "b.svg", fabtype = 'brundle')
+    scheduler.submit(source = "p.svg", fabtype = 'posjet')
+    scheduler.start()
+    scheduler.close()
+
+    assert sorted(seen) == [('brundle', 150, 200), ('posjet', 65, 65)]
+
+# Each source is loaded once, to place it and to print it
+def test_farm_loads_once(tmp_path, convert, monkeypatch):
+    pytest.importorskip("cairo")
+    import stl2fab
+
+    sources = [write_svg(str(tmp_path / name)) for name in ("a.svg", "b.svg")]
+    loaded = []
+    load_svg = stl2fab.load_svg
+    def load(source, *args, **kwargs):
+        loaded.append(source)
+        return load_svg(source, *args, **kwargs)
+    monkeypatch.setattr(stl2fab, "load_svg", load)
+
+    device = str(tmp_path / "b.out")
+    config = stl2fab.default_config()
+    config['slicer'] = 'svg'
+    stl2fab.run_farm(sources, ["b:brundle:" + device], config = config)
+
+    assert sorted(loaded) == sources
+    expected = b"".join([convert("--svg", "-f", "brundle", source) for source in sources])
+    assert open(device, "rb").read() == expected
+
+#  vim: set shiftwidth=4 expandtab: #
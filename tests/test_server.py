@@ -0,0 +1,129 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+# Fabrication job server
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import time
+import threading
+
+import fab.server
+
+def serve(tmp_path, runner, config = None, sink_dir = None):
+    path = str(tmp_path / "fab.sock")
+    server = fab.server.Server(path = path, runner = runner, config = config or {},
+                               sink_dir = sink_dir)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    # The socket exists before it listens
+    for i in range(0, 500):
+        try:
+            fab.server.request(path, {'op': 'status'})
+            break
+        except (IOError, OSError):
+            time.sleep(0.01)
+    return path
+
+def test_stream_while_running(tmp_path):
+    written = threading.Event()
+    release = threading.Event()
+
+    # Stall the job after its first chunk, until the client has it
+    def runner(source, out, fabtype, config):
+        out.write(b"x" * fab.server.CHUNK)
+        written.set()
+        assert release.wait(10)
+        out.write(b"tail")
+        return {'layers': 1, 'bytes': fab.server.CHUNK + 4}
+
+    path = serve(tmp_path, runner)
+
+    class Out(object):
+        def __init__(self):
+            self.data = io.BytesIO()
+        def write(self, data):
+            self.data.write(data)
+            release.set()
+
+    out = Out()
+    reply = fab.server.request(path, {'op': 'submit', 'source': "part.svg",
+                                      'stream': True}, out = out)
+    assert reply['state'] == 'done'
+    assert reply['bytes'] == fab.server.CHUNK + 4
+    assert out.data.getvalue() == b"x" * fab.server.CHUNK + b"tail"
+
+def test_submit_defaults(tmp_path):
+    seen = []
+    def runner(source, out, fabtype, config):
+        seen.append((fabtype, config))
+        return {'layers': 0, 'bytes': 0}
+
+    path = serve(tmp_path, runner, config = {'do_weave': False, 'sprays': 6})
+    fab.server.request(path, {'op': 'submit', 'source': "part.svg",
+                              'config': {'sprays': 3}, 'stream': True})
+    assert seen == [('brundle', {'do_weave': False, 'sprays': 3})]
+
+def test_submit_given_options(tmp_path, convert):
+    seen = []
+    def runner(source, out, fabtype, config):
+        seen.append((fabtype, config))
+        out.write(b"G28\n")
+        return {'layers': 0, 'bytes': 4}
+
+    path = serve(tmp_path, runner, config = {'do_weave': False, 'sprays': 6})
+    assert convert("--submit=" + path, "--overspray=3", "part.svg") == b"G28\n"
+    assert seen == [('brundle', {'do_weave': False, 'sprays': 3})]
+
+# Clients only set the print options, and only write in the sink directory
+def test_submit_refused(tmp_path):
+    seen = []
+    def runner(source, out, fabtype, config):
+        seen.append((source, config))
+        out.write(b"G28\n")
+        return {'layers': 0, 'bytes': 4}
+
+    sink_dir = tmp_path / "sink"
+    sink_dir.mkdir()
+    path = serve(tmp_path, runner, config = {'slicer_bin': None}, sink_dir = str(sink_dir))
+    for request in ({'config': {'slicer_bin': "/bin/sh"}},
+                    {'config': {'sprays': 3, 'volume': "/tmp/job.volume"}},
+                    {'output': "../part.brundle"},
+                    {'output': str(tmp_path / "part.brundle")}):
+        request.update({'op': 'submit', 'source': "part.svg", 'stream': True})
+        assert 'error' in fab.server.request(path, request)
+    assert seen == []
+
+    reply = fab.server.request(path, {'op': 'submit', 'source': "part.svg", 'stream': True,
+                                      'output': "part.brundle", 'config': {'sprays': 3}})
+    assert reply['state'] == 'done'
+    assert seen == [("part.svg", {'slicer_bin': None, 'sprays': 3})]
+    assert (sink_dir / "part.brundle").read_bytes() == b"G28\n"
+
+#  vim: set shiftwidth=4 expandtab: #
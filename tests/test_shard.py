@@ -0,0 +1,178 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+
+# Z sharded slicing
+#
+# A stub slic3r stands in for the real one: its parts are square
+# frustums, cut and sliced exactly, so that the sharded slices can be
+# compared with the slices of the whole part.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+import sys
+
+import pytest
+
+pytest.importorskip("cairo")
+
+# The frustum is centred on (50, 40), with a half-width of 20mm at its
+# bottom and 5mm at its top, 30mm up. An STL piece records the Z of its
+# bottom in the part in its solid name, as slic3r moves every piece
+# down to Z 0. Each slicing run logs its start and end times.
+STUB = r'''
+import re, sys, time
+
+HEIGHT = 30.0
+
+def half(z):
+    return 20.0 - 15.0 * z / HEIGHT
+
+def write(path, z0, z1, base):
+    out = ["solid base=%r" % (base)]
+    for z in (z0, z1):
+        w = half(base + z)
+        for x, y in ((-w, -w), (w, -w), (w, w), (-w, w)):
+            out.append("facet normal 0 0 0\nouter loop\n" +
+                       ("vertex %r %r %r\n" % (50 + x, 40 + y, z)) * 3 +
+                       "endloop\nendfacet")
+    out.append("endsolid")
+    open(path, "w").write("\n".join(out) + "\n")
+
+def read(path):
+    data = open(path).read()
+    base = float(re.search(r"base=(\S+)", data).group(1))
+    vertices = [[float(v) for v in m] for m in re.findall(r"vertex (\S+) (\S+) (\S+)", data)]
+    z = [v[2] for v in vertices]
+    return base, min(z), max(z), vertices
+
+args = sys.argv[1:]
+if args[0] == "--cut":
+    z = float(args[1])
+    base, z0, z1, vertices = read(args[2])
+    write(args[2] + "_lower.stl", 0, z, base + z0)
+    write(args[2] + "_upper.stl", z, z1 - z0, base + z0)
+    sys.exit(0)
+
+started = time.time()
+out = args[args.index("--output") + 1]
+height = float(args[args.index("--layer-height") + 1])
+scale = float(args[args.index("--scale") + 1])
+base, z0, z1, vertices = read(args[-1])
+x0 = min([v[0] for v in vertices]) * scale
+y0 = min([v[1] for v in vertices]) * scale
+time.sleep(0.5)
+
+svg = ['<svg xmlns="http://www.w3.org/2000/svg" xmlns:slic3r="http://slic3r.org/namespaces/slic3r">']
+i = 0
+while (i + 0.5) * height < (z1 - z0) * scale - 1e-9:
+    w = half(((base + z0) * scale + (i + 0.5) * height) / scale) * scale
+    points = " ".join(["%g,%g" % (50 * scale + x - x0, 40 * scale + y - y0)
+                       for x, y in ((-w, -w), (w, -w), (w, w), (-w, w))])
+    svg.append('<g id="layer%d" slic3r:z="%.9g"><polygon slic3r:type="contour" points="%s"/></g>' %
+               (i, (i + 1) * height / 1e6, points))
+    i += 1
+svg.append("</svg>")
+open(out, "w").write("\n".join(svg) + "\n")
+open(sys.argv[0] + ".log", "a").write("%r %r\n" % (started, time.time()))
+'''
+
+# Return the (z, points) of the layers of an SVG file
+def layers(path):
+    data = open(path).read()
+    return [(float(z), [float(p) for p in points.replace(",", " ").split()])
+            for z, points in re.findall(r'slic3r:z="([^"]*)".*?points="([^"]*)"', data)]
+
+# Install the stub slicer, and write the whole part with it
+#
+# Returns the (slicer, part) paths.
+def stub(tmp_path, name = "part.stl"):
+    slicer = str(tmp_path / "slic3r.py")
+    with open(slicer, "w") as f:
+        f.write("#!%s\n" % (sys.executable) + STUB)
+    os.chmod(slicer, 0o755)
+
+    part = str(tmp_path / name)
+    functions = {}
+    exec(STUB.split("args = sys.argv")[0], functions)
+    functions['write'](part, 0.0, 30.0, 0.0)
+    return slicer, part
+
+def test_shards(tmp_path):
+    import stl2fab
+
+    slicer, part = stub(tmp_path)
+
+    config = stl2fab.default_config()
+    config['slicer_bin'] = slicer
+    config['z_slice_mm'] = 0.5
+
+    whole = str(tmp_path / "whole.svg")
+    stl2fab.slice_file(part, whole, config)
+    os.unlink(slicer + ".log")
+
+    config['shards'] = 3
+    sharded = str(tmp_path / "sharded.svg")
+    stl2fab.slice_file(part, sharded, config)
+
+    expected = layers(whole)
+    assert len(expected) == 60
+    got = layers(sharded)
+    assert len(got) == len(expected)
+    for (z, points), (z_expected, points_expected) in zip(got, expected):
+        assert z == pytest.approx(z_expected)
+        assert points == pytest.approx(points_expected, abs = 1e-4)
+
+    # The shards are sliced at the same time
+    runs = [[float(t) for t in line.split()] for line in open(slicer + ".log")]
+    assert len(runs) == 3
+    assert max([start for start, end in runs]) < min([end for start, end in runs])
+
+# Batch workers are daemonic processes, which must still slice shards
+def test_batch_shards(tmp_path):
+    import stl2fab
+
+    slicer, first = stub(tmp_path, "first.stl")
+    second = str(tmp_path / "second.stl")
+    with open(first) as src, open(second, "w") as dst:
+        dst.write(src.read())
+
+    config = stl2fab.default_config()
+    config['slicer_bin'] = slicer
+    config['z_slice_mm'] = 0.5
+    config['shards'] = 2
+
+    stl2fab.run_batch([first, second], config = config, jobs = 2)
+
+    for source in (first, second):
+        output = os.path.splitext(source)[0] + ".brundle"
+        assert os.path.getsize(output) > 0
+    assert len(open(slicer + ".log").readlines()) == 4
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,94 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+
+# Outline simplification
+#
+# Simplified outlines must raster the same dots as the exact ones, but
+# for dots on the outline.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import numpy
+import pytest
+
+pytest.importorskip("cairo")
+
+from fab.svg import SVGRender
+
+from conftest import LAYERS, write_svg
+
+def circle(x, y, r, points):
+    return " ".join(["%.6f,%.6f" % (x + r * math.cos(2 * math.pi * i / points),
+                                    y + r * math.sin(2 * math.pi * i / points))
+                     for i in range(0, points)])
+
+# A finely tessellated ring, as slicers make of round parts
+ROUND = [[("contour", circle(30, 30, 20, 240)), ("hole", circle(30, 30, 8, 120))]]
+
+def rasters(path, tolerance):
+    svg = SVGRender(path = path)
+    svg.tolerance(dots = tolerance)
+    w, h = svg.size()
+    return [svg.raster(layer).rows(0, h, w) for layer in range(0, svg.layers())]
+
+def test_simplify_square(svg_file):
+    for exact, simple in zip(rasters(svg_file, 0.0), rasters(svg_file, 0.4)):
+        assert numpy.array_equal(simple, exact)
+
+@pytest.mark.parametrize("tolerance", [0.1, 0.25, 0.49])
+def test_simplify_round(tmp_path, tolerance):
+    path = write_svg(str(tmp_path / "round.svg"), ROUND)
+    svg = SVGRender(path = path)
+    svg.tolerance(dots = tolerance)
+    svg.outlines(0)
+    assert svg.vertices_out < svg.vertices_in
+
+    exact, = rasters(path, 0.0)
+    simple, = rasters(path, tolerance)
+
+    # The dots changed are on the outline: a dot with a neighbour on the
+    # other side of the exact outline
+    padded = numpy.pad(exact, 1, mode = 'edge')
+    h, w = exact.shape
+    edge = numpy.zeros(exact.shape, dtype=bool)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            edge |= padded[1+dy:1+dy+h, 1+dx:1+dx+w] != exact
+    changed = simple != exact
+    assert not numpy.any(changed & ~edge)
+    assert numpy.count_nonzero(changed) < numpy.count_nonzero(edge) * tolerance
+
+def test_tolerance_under_half_a_dot(svg_file):
+    svg = SVGRender(path = svg_file)
+    with pytest.raises(ValueError):
+        svg.tolerance(dots = 0.5)
+    assert svg.tolerance() == 0.1
+
+#  vim: set shiftwidth=4 expandtab: #
@@ -0,0 +1,85 @@
+#
+#  Copyright (C) 2016, Jason S. McMullan <jason.mcmullan@gmail.com>
+#  All rights reserved.
+#
+#  Licensed under the MIT License:
+#
+#  Permission is hereby granted, free of charge, to any person obtaining
+#  a copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+#
+
+
+# Virtual printers
+#
+# The output of each backend, decoded by its virtual printer, must ink
+# the dots of the rasterized layers, no more and no less.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy
+import pytest
+
+pytest.importorskip("cairo")
+
+import fab.sink
+
+from conftest import prepare, LAYERS
+
+# Trim a bitmap to its inked dots, as fab.sink.Sink.bitmap()
+def trim(bitmap):
+    inked = numpy.nonzero(bitmap)
+    return bitmap[0:inked[0].max()+1, 0:inked[1].max()+1]
+
+@pytest.mark.parametrize("fabtype,options", [("brundle", []),
+                                             ("brundle", ["-W"]),
+                                             ("brundle", ["--serpentine"]),
+                                             ("posjet", []),
+                                             ("tmc600", [])])
+def test_decoded_layers(svg_file, convert, monkeypatch, fabtype, options):
+    bitmaps = []
+    def layer_end(self):
+        if self._rows is not None:
+            bitmaps.append(self.bitmap())
+        original(self)
+    original = fab.sink.Sink.layer_end
+    monkeypatch.setattr(fab.sink.Sink, "layer_end", layer_end)
+
+    data = convert(*(["--svg", "-f", fabtype] + options + [svg_file]))
+    printer = prepare(fabtype, svg_file)
+    w, h = printer.svg.size()
+    sink = fab.sink.sink(fabtype, realtime = False)
+    sink.width = w
+    sink.write(data)
+    sink.close()
+
+    # The ESC/P page starts at the margins of the bed
+    top, left = 0, 0
+    if fabtype == 'tmc600':
+        top, left = printer.margin_top, printer.margin_left
+
+    assert len(bitmaps) == len(LAYERS)
+    for layer, bitmap in enumerate(bitmaps):
+        expected = numpy.zeros((top + h, left + w), dtype=bool)
+        expected[top:, left:] = printer.svg.raster(layer).rows(0, h, w)
+        expected = trim(expected)
+        assert bitmap.shape == expected.shape, "layer %d" % (layer)
+        assert numpy.array_equal(bitmap, expected), "layer %d" % (layer)
+
+#  vim: set shiftwidth=4 expandtab: #